@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+'''
+server-side completeness checks: a terms aggregation on full_id_hash grouped by track & orbit
+tells which gunws (or gunw-merged) exist for each group without transferring their documents.
+Documents are only fetched for the groups found complete.
+'''
+from __future__ import print_function
+from builtins import str
+from builtins import object
+from products import ProductIndex, stringify_orbit
+
+TRACK_FIELD = 'metadata.track_number'
+HASH_FIELD = 'metadata.full_id_hash.raw'
+
+def build_aggregation(grq_query, orbit_field):
+    '''returns the aggregation query over the search query's matches: track -> full_id_hash -> orbit number buckets'''
+    orbit_agg = {'orbit': {'terms': {'field': orbit_field, 'size': 0}}}
+    hash_agg = {'full_id_hash': {'terms': {'field': HASH_FIELD, 'size': 0}, 'aggs': orbit_agg}}
+    return {'query': grq_query['query'], 'aggs': {'track': {'terms': {'field': TRACK_FIELD, 'size': 0}, 'aggs': hash_agg}}}
+
+class HashBuckets(object):
+    '''
+    the full_id_hashes present per (track, orbit) from the aggregation response. Stands in for
+    the gunw list in gen_completed; fetch(hashes) returns the product records for the hashes
+    '''
+    def __init__(self, prod_type, aggregations, fetch):
+        self.type = prod_type
+        self.fetch = fetch
+        self.groups = {} # (track, orbit) -> set of full_id_hashes
+        for track_bucket in aggregations.get('track', {}).get('buckets', []):
+            for hash_bucket in track_bucket.get('full_id_hash', {}).get('buckets', []):
+                orbits = [x['key'] for x in hash_bucket.get('orbit', {}).get('buckets', [])]
+                if orbits:
+                    self.groups.setdefault((str(track_bucket['key']), stringify_orbit(orbits)), set()).add(hash_bucket['key'])
+
+    def __len__(self):
+        return sum(len(hashes) for hashes in self.groups.values())
+
+    def hashes(self, track, orbit):
+        '''returns the set of full_id_hashes present along the track & orbit'''
+        return self.groups.get((str(track), orbit), set())
+
+    def products(self, hashes):
+        '''returns the most recent product for each of the hashes, in order, fetching only those products'''
+        latest = ProductIndex(self.fetch(sorted(set(hashes)))).latest_by_hash
+        missing = [hsh for hsh in hashes if hsh not in latest]
+        if missing:
+            raise Exception('unable to retrieve {} products for: {}'.format(self.type, ', '.join(missing)))
+        return [latest[hsh] for hsh in hashes]
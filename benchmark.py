@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+'''
+offline benchmark of the aoi, gunw & greylist evaluations. Each corpus (newline delimited
+{_index, _type, _id, _source} documents) is served from the in-memory GRQ backend & every job
+type is timed against it, so regressions can be measured without a live cluster. The time the
+backend spends serving requests is reported separately from the evaluator's own. Corpora of
+any size can be generated with corpus.py.
+
+    python corpus.py medium.ndjson --aois 1000
+    python benchmark.py small.ndjson medium.ndjson large.ndjson --repeat 5
+'''
+from __future__ import print_function
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import grq
+import logs
+import metrics
+import hashing
+import evaluate
+from memory_backend import MemoryBackend
+
+JOBS = ['aoi', 'gunw', 'greylist']
+REPEAT = 3
+
+def load_corpus(path):
+    '''returns the documents of the ndjson corpus'''
+    with open(path, 'r') as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+def find_input(docs, job):
+    '''returns the first document in the corpus that can be the input of the job type, or None'''
+    dataset = {'aoi': 'area_of_interest', 'gunw': 'S1-GUNW', 'greylist': 'S1-GUNW-GREYLIST'}[job]
+    for doc in docs:
+        if doc['_source'].get('dataset', doc.get('_type')) == dataset:
+            return doc
+    return None
+
+def build_context(doc, job):
+    '''builds the job context the way the hysds-io files fill it from the input product'''
+    src = doc['_source']
+    met = src.get('metadata', {})
+    ctx = {'uid': src.get('id', doc['_id']), 'prod_type': src.get('dataset', doc.get('_type')), 'version': src.get('version')}
+    if job == 'aoi':
+        ctx.update({'location': src.get('location'), 'starttime': src.get('starttime'), 'endtime': src.get('endtime')})
+    else:
+        ctx.update({'track_number': met.get('track_number'), 'full_id_hash': met.get('full_id_hash', False),
+                    'orbit_number': met.get('orbit_number')})
+    if job == 'greylist':
+        ctx.update({'S1-GUNW-version': evaluate.S1_GUNW_VERSION, 'S1-GUNW-MERGED-version': evaluate.S1_GUNW_MERGED_VERSION})
+    return ctx
+
+def prepare_job(docs, ctx, workdir):
+    '''loads a fresh copy of the corpus into an in-memory backend installed as the GRQ client & writes the
+    job context into the new work dir. returns the backend'''
+    backend = MemoryBackend()
+    backend.load(copy.deepcopy(docs))
+    grq.set_backend(backend)
+    hashing._memo.clear()
+    metrics.registry.reset()
+    os.makedirs(workdir)
+    ctx = dict(ctx, greylist_cache_dir=os.path.join(workdir, 'cache'), ledger_cache_dir=os.path.join(workdir, 'cache'))
+    with open(os.path.join(workdir, '_context.json'), 'w') as fout:
+        json.dump(ctx, fout)
+    return backend
+
+def run_job(docs, ctx, workdir):
+    '''runs one evaluation against a fresh copy of the corpus. returns (seconds, seconds spent in the backend, backend queries)'''
+    backend = prepare_job(docs, ctx, workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        start = time.time()
+        evaluate.evaluate()
+        elapsed = time.time() - start
+    finally:
+        os.chdir(cwd)
+        grq.set_backend(None)
+    queries = sum(count for name, count in metrics.registry.snapshot()['counters'].items() if name.startswith('queries.'))
+    return elapsed, backend.seconds, queries
+
+def benchmark(paths, jobs=JOBS, repeat=REPEAT):
+    '''times each job type against each corpus. returns a list of result dicts'''
+    results = []
+    tmpdir = tempfile.mkdtemp(prefix='completeness_benchmark_')
+    try:
+        for path in paths:
+            docs = load_corpus(path)
+            for job in jobs:
+                doc = find_input(docs, job)
+                if doc is None:
+                    print('{}: no input product for the {} job, skipping'.format(path, job))
+                    continue
+                ctx = build_context(doc, job)
+                timings = []
+                for i in range(repeat):
+                    elapsed, backend_seconds, queries = run_job(docs, ctx, os.path.join(tmpdir, '{}-{}-{}'.format(len(results), job, i)))
+                    timings.append((elapsed - backend_seconds, backend_seconds))
+                timings.sort()
+                result = {'corpus': path, 'documents': len(docs), 'job': job, 'input': ctx['uid'], 'repeat': repeat,
+                          'min': timings[0][0], 'median': timings[len(timings) // 2][0], 'max': timings[-1][0],
+                          'backend': timings[len(timings) // 2][1], 'queries': queries}
+                print('{corpus} ({documents} docs) {job:8s} evaluator min {min:.3f}s median {median:.3f}s max {max:.3f}s, '
+                      'backend {backend:.3f}s, {queries} get_objects queries'.format(**result))
+                results.append(result)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the completeness evaluator against in-memory corpora')
+    parser.add_argument('corpora', nargs='+', help='newline delimited json corpus files, eg one per corpus size')
+    parser.add_argument('--jobs', default=','.join(JOBS), help='comma separated job types to time ({})'.format(', '.join(JOBS)))
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs per job & corpus')
+    parser.add_argument('--output', help='also write the results as json to this file')
+    args = parser.parse_args()
+    logs.set_level('WARNING')
+    results = benchmark(args.corpora, jobs=args.jobs.split(','), repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,27 +11,24 @@ import json
 import pytz
 import shutil
 import pickle
-import hashlib
 import dateutil
 import dateutil.parser
-from shapely.geometry import shape, Polygon, MultiPolygon, mapping
-from shapely.ops import cascaded_union
-from shapely.validation import explain_validity
-import shapely.ops
-from shapely import speedups
 from hysds.celery import app
 from hysds.dataset_ingest import ingest
-import util
+import geometry
+import logs
+import metrics
+from hashing import hash_all
 
+logger = logs.get_logger('build')
+
+@metrics.timed('build_validated_product.build')
 def build(ifg_list, version, product_prefix, aoi, track, orbit):
     '''Builds and submits a aoi-track product.'''
     ds = build_dataset(ifg_list, version, product_prefix, aoi, track, orbit)
     met = build_met(ifg_list, version, product_prefix, aoi, track, orbit)
-    print('Publishing Product: {0}'.format(ds['label']))
-    print('    version:        {0}'.format(ds['version']))
-    print('    starttime:      {0}'.format(ds['starttime']))
-    print('    endtime:        {0}'.format(ds['endtime']))
-    print('    location:       {0}'.format(ds['location']))
+    logger.info('Publishing Product: %s version: %s starttime: %s endtime: %s', ds['label'], ds['version'], ds['starttime'], ds['endtime'])
+    logger.debug('    location:       %s', ds['location'])
     #print('    master_scenes:  {0}'.format(met['master_scenes']))
     #print('    slave_scenes:   {0}'.format(met['slave_scenes']))
     build_product_dir(ds, met)
@@ -42,38 +39,6 @@ def build_id(version, product_prefix, aoi, track, orbit, date_pair):
     uid = '{}-{}-T{}-{}-{}'.format(product_prefix, aoi.get('_id', 'AOI'), str(track).zfill(3), date_pair, version)
     return uid
 
-def get_hash(es_obj):
-    '''retrieves the full_id_hash. if it doesn't exists, it
-        attempts to generate one'''
-    full_id_hash = es_obj.get('_source', {}).get('metadata', {}).get('full_id_hash', False)
-    if full_id_hash:
-        return full_id_hash
-    return gen_hash(es_obj)
-
-def gen_hash(es_obj):
-    '''copy of hash used in the enumerator'''
-    met = es_obj.get('_source', {}).get('metadata', {})
-    master_slcs = met.get('master_scenes', met.get('reference_scenes', False))
-    slave_slcs = met.get('slave_scenes', met.get('secondary_scenes', False))
-    master_ids_str = ""
-    slave_ids_str = ""
-    for slc in sorted(master_slcs):
-        if isinstance(slc, tuple) or isinstance(slc, list):
-            slc = slc[0]
-        if master_ids_str == "":
-            master_ids_str = slc
-        else:
-            master_ids_str += " "+slc
-    for slc in sorted(slave_slcs):
-        if isinstance(slc, tuple) or isinstance(slc, list):
-            slc = slc[0]
-        if slave_ids_str == "":
-            slave_ids_str = slc
-        else:
-            slave_ids_str += " "+slc
-    id_hash = hashlib.md5(json.dumps([master_ids_str, slave_ids_str]).encode("utf8")).hexdigest()
-    return id_hash
-
 def get_times(ifg_list, minimum=True):
     '''returns the minimum or the maximum start/end time'''
     times = [dateutil.parser.parse(get_secondary_time(x)).replace(tzinfo=pytz.UTC) for x in ifg_list] + [dateutil.parser.parse(get_reference_time(x)).replace(tzinfo=pytz.UTC) for x in ifg_list]
@@ -115,18 +80,6 @@ def build_dataset(ifg_list, version, product_prefix, aoi, track, orbit):
     uid = build_id(version, product_prefix, aoi, track, orbit, date_pair)
     #print('uid: {}'.format(uid))
     location = get_location(ifg_list)
-    print("location:{}".format(location))
-    print("validate geojson")
-    location = util.validate_geojson(location)
-    print("location after validate_geojson: {}".format(location))
-    #except Exception as err:
-    #    print(str(err))
-    try:
-        location = util.change_union_coordinate_direction(location)
-        print("location after change_union_coordinate_direction: {}".format(location))
-    except Exception as err:
-        print(str(err))
-    print("Final location : {}".format(location))
     ds = {'label':uid, 'starttime':starttime, 'endtime':endtime, 'location':location, 'version':version}
     return ds
 
@@ -143,7 +96,7 @@ def build_met(ifg_list, version, product_prefix, aoi, track, orbit):
     s1_gunw_ids = []
     s1_gunws = []
     s1_gunw_urls = []
-    hashes = [get_hash(x) for x in ifg_list]
+    hashes = hash_all(ifg_list)
     for ifg in ifg_list:
         ifg_id = ifg.get('_id')
         s1_gunw_ids.append(ifg_id)
@@ -166,12 +119,9 @@ def build_met(ifg_list, version, product_prefix, aoi, track, orbit):
     return met
 
 def get_location(ifg_list):
-    '''generates the union of the ifg_list extent'''
-    polygons = []
-    for ifg in ifg_list:
-        polygons.append(Polygon(ifg['_source']['location']['coordinates'][0]))
-    multi = MultiPolygon(polygons)
-    return mapping(cascaded_union(multi))
+    '''generates the union of the ifg_list extent, with clockwise exterior rings'''
+    grid_size = app.conf.get('AOI_TRACK_GRID_SIZE', geometry.GRID_SIZE)
+    return geometry.footprint([ifg['_source']['location'] for ifg in ifg_list], grid_size=grid_size)
 
 '''
 def get_union_geojson_ifgs(ifg_list):
@@ -205,4 +155,4 @@ def submit_product(ds):
         if os.path.exists(uid):
             shutil.rmtree(uid)
     except:
-        print('failed on submission of {0} with {1}'.format(uid))
+        logger.exception('failed on submission of %s', uid)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+'''
+generates a synthetic, internally consistent S1 corpus for scaling tests: AOIs, acq-lists,
+audit-trail products, GUNWs, GUNW-MERGED & greylists with matching full_id_hashes, tracks,
+orbit pairs, footprints & creation timestamps. Written as newline delimited
+{_index, _type, _id, _source} documents (as loaded by the in-memory backend & benchmark.py)
+or as an elasticsearch _bulk file.
+
+    python corpus.py corpus.ndjson --aois 100 --tracks 2 --orbit-pairs 10 --completeness 0.8
+'''
+from __future__ import print_function
+from builtins import range
+from builtins import object
+import sys
+import json
+import random
+import argparse
+import datetime
+import hashing
+
+VERSIONS = {'area_of_interest': 'v2.0', 'S1-GUNW-acq-list': 'v2.0', 'S1-GUNW-acqlist-audit_trail': 'v2.0',
+            'S1-GUNW': 'v2.0.2', 'S1-GUNW-MERGED': 'v2.0.2', 'S1-GUNW-GREYLIST': 'v2.0'}
+INDICES = {'area_of_interest': 'grq_{}_area_of_interest', 'S1-GUNW-acq-list': 'grq_{}_s1-gunw-acq-list',
+           'S1-GUNW-acqlist-audit_trail': 'grq_{}_s1-gunw-acqlist-audit_trail', 'S1-GUNW': 'grq_{}_s1-gunw',
+           'S1-GUNW-MERGED': 'grq_{}_s1-gunw-merged', 'S1-GUNW-GREYLIST': 'grq_{}_s1-gunw-greylist'}
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+START_DATE = datetime.datetime(2019, 1, 1)
+REPEAT_DAYS = 12 # days between passes of the same track
+ORBITS_PER_CYCLE = 175 # S1 relative orbits (tracks) per repeat cycle
+
+class CorpusConfig(object):
+    '''parameters of the generated corpus'''
+    def __init__(self, aois=10, tracks=2, orbit_pairs=5, frames=3, completeness=0.8, duplicates=0.05,
+                 merged=0.5, greylisted=0.02, seed=0):
+        self.aois = aois # number of AOIs
+        self.tracks = tracks # tracks crossing each AOI
+        self.orbit_pairs = orbit_pairs # reference/secondary orbit pairs per track
+        self.frames = frames # acq-lists (& so GUNWs) per (aoi, track, orbit pair)
+        self.completeness = completeness # fraction of (aoi, track, orbit pair) groups with every GUNW present
+        self.duplicates = duplicates # fraction of GUNWs that also have an older duplicate with the same full_id_hash
+        self.merged = merged # fraction of GUNWs that also have a GUNW-MERGED
+        self.greylisted = greylisted # fraction of acq-list hashes that are greylisted
+        self.seed = seed
+
+def generate(config):
+    '''yields the corpus documents'''
+    rand = random.Random(config.seed)
+    counter = [0]
+    def created(date):
+        counter[0] += 1
+        return (date + datetime.timedelta(days=1, seconds=counter[0])).strftime(TIME_FORMAT + '.%f')
+    for aoi_num in range(config.aois):
+        aoi_id = 'AOI_synthetic_{:06d}'.format(aoi_num)
+        lon = rand.uniform(-170.0, 165.0)
+        lat = rand.uniform(-60.0, 55.0)
+        aoi_box = box(lon, lat, lon + 4.0, lat + 3.0)
+        end_date = START_DATE + datetime.timedelta(days=REPEAT_DAYS * (config.orbit_pairs + 1))
+        yield doc('area_of_interest', aoi_id, {
+            'starttime': START_DATE.strftime(TIME_FORMAT), 'endtime': end_date.strftime(TIME_FORMAT), 'location': aoi_box,
+            'creation_timestamp': created(START_DATE),
+            'metadata': {'starttime': START_DATE.strftime(TIME_FORMAT), 'endtime': end_date.strftime(TIME_FORMAT)}})
+        for track in rand.sample(range(1, ORBITS_PER_CYCLE + 1), config.tracks):
+            for pair in range(config.orbit_pairs):
+                secondary_date = START_DATE + datetime.timedelta(days=REPEAT_DAYS * pair)
+                reference_date = secondary_date + datetime.timedelta(days=REPEAT_DAYS)
+                secondary_orbit = 20000 + ORBITS_PER_CYCLE * pair + track
+                reference_orbit = secondary_orbit + ORBITS_PER_CYCLE
+                orbits = [reference_orbit, secondary_orbit]
+                complete = rand.random() < config.completeness
+                missing = set() if complete else set(rand.sample(range(config.frames), rand.randint(1, config.frames)))
+                for frame in range(config.frames):
+                    for gen in generate_frame(rand, config, created, aoi_id, lon, lat, track, orbits, frame, frame in missing,
+                                              reference_date, secondary_date):
+                        yield gen
+
+def generate_frame(rand, config, created, aoi_id, lon, lat, track, orbits, frame, missing, reference_date, secondary_date):
+    '''yields the acq-list, audit-trail, gunw(s), gunw-merged & greylist documents for one frame'''
+    reference_orbit, secondary_orbit = orbits
+    step = 3.0 / config.frames # frames tile the aoi along track, overlapping slightly
+    footprint = box(lon + 0.2, lat + frame * step, lon + 3.8, lat + (frame + 1.1) * step)
+    reference_scenes = [scene_id(reference_date, track, frame, i) for i in range(2)]
+    secondary_scenes = [scene_id(secondary_date, track, frame, i) for i in range(2)]
+    met = {'track_number': track, 'master_scenes': reference_scenes, 'slave_scenes': secondary_scenes}
+    full_id_hash = hashing.gen_hash({'_source': {'metadata': met}})
+    met['full_id_hash'] = full_id_hash
+    suffix = '{}-T{:03d}-{}-{}-f{}'.format(aoi_id, track, reference_orbit, secondary_orbit, frame)
+    times = {'starttime': secondary_date.strftime(TIME_FORMAT), 'endtime': reference_date.strftime(TIME_FORMAT)}
+    yield doc('S1-GUNW-acq-list', 'acq-list-' + suffix, dict(times, location=footprint, creation_timestamp=created(secondary_date),
+              metadata=dict(met, orbitNumber=orbits, aoi=aoi_id, tags=[])))
+    yield doc('S1-GUNW-acqlist-audit_trail', 'audit_trail-' + suffix, dict(times, location=footprint, creation_timestamp=created(secondary_date),
+              metadata=dict(met, aoi=aoi_id, reference_orbit=str(reference_orbit), secondary_orbit=str(secondary_orbit))))
+    if rand.random() < config.greylisted:
+        yield doc('S1-GUNW-GREYLIST', 'greylist-' + suffix, dict(times, location=footprint, creation_timestamp=created(reference_date),
+                  metadata=dict(met, orbit_number=orbits)))
+    if missing:
+        return
+    date_pair = '{}_{}'.format(reference_date.strftime('%Y%m%d'), secondary_date.strftime('%Y%m%d'))
+    gunw_met = dict(met, orbit_number=orbits, reference_date=reference_date.strftime(TIME_FORMAT),
+                    secondary_date=secondary_date.strftime(TIME_FORMAT), tags=[])
+    for prod_type in ['S1-GUNW', 'S1-GUNW-MERGED']:
+        if prod_type == 'S1-GUNW-MERGED' and rand.random() >= config.merged:
+            continue
+        uid = '{}-{}-{}'.format(prod_type, date_pair, suffix)
+        source = dict(times, location=footprint, urls=['s3://synthetic/{}'.format(uid)], metadata=dict(gunw_met))
+        if rand.random() < config.duplicates:
+            yield doc(prod_type, uid + '-dup', dict(source, creation_timestamp=created(reference_date)))
+        yield doc(prod_type, uid, dict(source, creation_timestamp=created(reference_date + datetime.timedelta(days=1))))
+
+def doc(prod_type, uid, source):
+    '''wraps the _source into a document of the given product type'''
+    version = VERSIONS[prod_type]
+    source = dict(source, id=uid, dataset=prod_type, version=version)
+    return {'_index': INDICES[prod_type].format(version), '_type': prod_type, '_id': uid, '_source': source}
+
+def box(min_lon, min_lat, max_lon, max_lat):
+    '''returns a clockwise geojson polygon for the bounding box'''
+    return {'type': 'Polygon', 'coordinates': [[[min_lon, min_lat], [min_lon, max_lat], [max_lon, max_lat],
+                                                [max_lon, min_lat], [min_lon, min_lat]]]}
+
+def scene_id(date, track, frame, i):
+    '''returns a plausible S1 SLC scene id'''
+    start = date + datetime.timedelta(seconds=track * 60 + frame * 25 + i * 12)
+    stop = start + datetime.timedelta(seconds=27)
+    return 'S1A_IW_SLC__1SDV_{}_{}_{:06d}_{:06X}_{:04X}'.format(start.strftime('%Y%m%dT%H%M%S'), stop.strftime('%Y%m%dT%H%M%S'),
+                                                                 track, frame, i)
+
+def write(docs, fout, fmt='ndjson'):
+    '''writes the documents as ndjson or as an elasticsearch _bulk file. returns the number written'''
+    count = 0
+    for document in docs:
+        if fmt == 'bulk':
+            fout.write(json.dumps({'index': {'_index': document['_index'], '_type': document['_type'], '_id': document['_id']}}) + '\n')
+            fout.write(json.dumps(document['_source']) + '\n')
+        else:
+            fout.write(json.dumps(document) + '\n')
+        count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a synthetic S1 corpus for the completeness evaluator')
+    parser.add_argument('output', help='output file, or - for stdout')
+    parser.add_argument('--format', choices=['ndjson', 'bulk'], default='ndjson')
+    parser.add_argument('--aois', type=int, default=10)
+    parser.add_argument('--tracks', type=int, default=2, help='tracks per AOI')
+    parser.add_argument('--orbit-pairs', type=int, default=5, help='orbit pairs per track')
+    parser.add_argument('--frames', type=int, default=3, help='acq-lists per AOI, track & orbit pair')
+    parser.add_argument('--completeness', type=float, default=0.8, help='fraction of complete AOI/track/orbit groups')
+    parser.add_argument('--duplicates', type=float, default=0.05, help='fraction of GUNWs with an older duplicate')
+    parser.add_argument('--merged', type=float, default=0.5, help='fraction of GUNWs with a GUNW-MERGED')
+    parser.add_argument('--greylisted', type=float, default=0.02, help='fraction of greylisted acq-lists')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    config = CorpusConfig(aois=args.aois, tracks=args.tracks, orbit_pairs=args.orbit_pairs, frames=args.frames,
+                          completeness=args.completeness, duplicates=args.duplicates, merged=args.merged,
+                          greylisted=args.greylisted, seed=args.seed)
+    if args.output == '-':
+        count = write(generate(config), sys.stdout, args.format)
+    else:
+        with open(args.output, 'w') as fout:
+            count = write(generate(config), fout, args.format)
+    sys.stderr.write('wrote {} documents\n'.format(count))
+
+if __name__ == '__main__':
+    main()
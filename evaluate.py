@@ -9,28 +9,39 @@ for all GUNWs along that track/orbit pairing.
 
 from __future__ import print_function
 from builtins import str
-from builtins import range
 from builtins import object
 import re, sys, os
 import json
-import hashlib
+from collections import OrderedDict
+import sqlite3
+import threading
 import urllib3
-import requests
 import warnings
-import dateutil
-import dateutil.parser
-from hysds.celery import app
+import grq
+import query_cache
+import greylist_store
+import ledger
+import aggregations
+import parallel
 import tagger
 import traceback
 import build_validated_product
+import logs
+import metrics
+import profiler
+import replay
+from products import ProductIndex, as_record, to_records, get_track, get_orbit, get_hash, stringify_orbit
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+logger = logs.get_logger('evaluate')
 
 AOI_TRACK_PREFIX = 'S1-GUNW-AOI_TRACK'
 AOI_TRACK_MERGED_PREFIX = 'S1-GUNW-MERGED-AOI_TRACK'
 AOI_TRACK_VERSION = 'v2.0'
 S1_GUNW_VERSION = "v2.0.2"
 S1_GUNW_MERGED_VERSION = "v2.0.2"
+AOI_WORKERS = 1 # aois evaluated concurrently by gunw & greylist jobs, serial unless the submitter raises it
+ENGINES = ['documents', 'aggregate'] # compare hashes of fetched gunw documents, or of server-side aggregation buckets
 
 ALLOWED_PROD_TYPES = ['S1-GUNW', "S1-GUNW-MERGED", "area_of_interest", "S1-GUNW-GREYLIST"]
 INDEX_MAPPING = {'S1-GUNW-acq-list': 'grq_*_s1-gunw-acq-list',
@@ -41,12 +52,26 @@ INDEX_MAPPING = {'S1-GUNW-acq-list': 'grq_*_s1-gunw-acq-list',
                  'S1-GUNW-MERGED-AOI_TRACK': 'grq_*_s1-gunw-merged-aoi_track',
                  'S1-GUNW-GREYLIST': 'grq_*_s1-gunw-greylist',
                  'area_of_interest': 'grq_*_area_of_interest'}
+# _source fields needed to evaluate completeness. full documents are only fetched for products being published
+EVALUATION_FIELDS = ['id', 'creation_timestamp', 'version', 'starttime', 'endtime',
+                     'track_number', 'track', 'trackNumber', 'track_Number', 'orbit_number', 'orbitNumber', 'orbit',
+                     'metadata.full_id_hash', 'metadata.tags', 'metadata.aoi',
+                     'metadata.track_number', 'metadata.track', 'metadata.trackNumber', 'metadata.track_Number',
+                     'metadata.orbit_number', 'metadata.orbitNumber', 'metadata.orbit',
+                     'metadata.master_scenes', 'metadata.slave_scenes', 'metadata.reference_scenes', 'metadata.secondary_scenes']
+# product types held as compact product records rather than raw hits
+RECORD_TYPES = ['S1-GUNW-acq-list', 'S1-GUNW', 'S1-GUNW-MERGED', 'S1-GUNW-acqlist-audit_trail', 'S1-GUNW-AOI_TRACK',
+                'S1-GUNW-MERGED-AOI_TRACK', 'S1-GUNW-GREYLIST']
+GREYLIST_FIELDS = ['id', 'creation_timestamp', 'metadata.full_id_hash', 'metadata.master_scenes', 'metadata.slave_scenes',
+                   'metadata.reference_scenes', 'metadata.secondary_scenes']
 
 class evaluate(object):
     '''evaluates input product for completeness. Tags GUNWs/GUNW-merged & publishes AOI_TRACK products'''
     def __init__(self):
         '''fill values from context, error if invalid inputs, then kickoff evaluation'''
         self.ctx = load_context()
+        if self.ctx.get('log_level', False):
+            logs.set_level(self.ctx.get('log_level'))
         self.prod_type = self.ctx.get('prod_type', False)
         self.track_number = self.ctx.get('track_number', False)
         self.full_id_hash = self.ctx.get('full_id_hash', False)
@@ -58,10 +83,26 @@ class evaluate(object):
         self.orbit_number = self.ctx.get('orbit_number', False)
         self.s1_gunw_version = self.ctx.get("S1-GUNW-version", S1_GUNW_VERSION)
         self.s1_gunw_merged_version = self.ctx.get("S1-GUNW-MERGED-version", S1_GUNW_MERGED_VERSION)
+        self.local_state = not replay.active() # recorded & replayed runs must not depend on worker-local stores
+        self.tags_written = {} # shared by the tag queues, so each sees the writes made for other aois
+        self.tag_queues = threading.local() # the tag queue of the aoi each thread is evaluating
+        self.query_cache = query_cache.QueryCache(max_entries=context_int(self.ctx, 'query_cache_entries', query_cache.MAX_ENTRIES),
+                                                  max_hits=context_int(self.ctx, 'query_cache_hits', query_cache.MAX_HITS))
+        self.ledger = None # completeness ledger, opened by the first gunw query
+        self.published_keys = set() # (aoi_track type, aoi, track, orbit) of the products published by this run
+        self.published_lock = threading.Lock()
+        self.ledger_lock = threading.Lock()
+        self.ledger_starts = {} # feed -> creation_timestamp the feed is fetched from (False for all)
+        self.ledger_feeds = {} # feed -> the feed's products, merged into the ledger
+        self.engine = self.ctx.get('engine', 'documents')
+        self.buckets = {} # query key -> HashBuckets, for the aggregate engine
+        self.buckets_lock = threading.Lock()
 
         # exit if invalid input product type
         if not self.prod_type in ALLOWED_PROD_TYPES:
             raise Exception('input product type: {} not in allowed product types for PGE'.format(self.prod_type))
+        if not self.engine in ENGINES:
+            raise Exception('evaluation engine: {} not in {}'.format(self.engine, ', '.join(ENGINES)))
         if not self.prod_type == 'area_of_interest' and not self.full_id_hash:
             warnings.warn('Warning: full_id_hash not found in metadata. Will attempt to generate')
         #if not self.prod_type is 'area_of_interest' and self.track_number is False:
@@ -73,20 +114,149 @@ class evaluate(object):
             self.run_greylist_evaluation()
         else:
             self.run_gunw_evaluation()
+        if self.ledger is not None:
+            self.ledger.close()
+        cache_stats = self.query_cache.stats()
+        logger.info('query cache: %s', cache_stats)
+        for name in ['hits', 'misses', 'evictions']:
+            metrics.incr('query_cache.{}'.format(name), cache_stats[name])
+
+    def get_objects(self, prod_type, **kwargs):
+        '''get_objects, answering repeated identical queries within this run from the query cache'''
+        key = query_cache.make_key(prod_type, **kwargs)
+        return self.query_cache.get_or_fetch(key, lambda: get_objects(prod_type, **kwargs))
+
+    def prefetch(self, queries):
+        '''
+        runs the (prod_type, kwargs) queries that are not already cached as batched _msearch
+        requests, placing the results in the query cache for the get_objects calls that follow
+        '''
+        pending = OrderedDict()
+        for prod_type, kwargs in queries:
+            key = query_cache.make_key(prod_type, **kwargs)
+            if key in pending or key in self.query_cache:
+                continue
+            pending[key] = (prod_type, build_query(prod_type, **kwargs)[1])
+        if not pending:
+            return
+        logger.info('prefetching %d queries with _msearch', len(pending))
+        searches = [(INDEX_MAPPING.get(prod_type), grq_query) for prod_type, grq_query in pending.values()]
+        try:
+            all_results = grq.get_client().msearch(searches)
+        except Exception as err:
+            # prefetching is only an optimization; get_objects will run the queries individually
+            logger.warning('_msearch prefetch failed, falling back to individual queries: %s', err)
+            return
+        for (key, (prod_type, _)), results in zip(pending.items(), all_results):
+            results = ingest(prod_type, results)
+            metrics.incr('hits.{}'.format(prod_type), len(results))
+            logger.debug('found %d %s products matching query.', len(results), prod_type)
+            if prod_type in ["S1-GUNW-acqlist-audit_trail", "S1-GUNW-acq-list"] and len(results) == 0:
+                continue # left uncached so get_objects raises as usual
+            self.query_cache.put(key, results)
+
+    def prefetch_aois(self, aoi_ids):
+        '''prefetches the per-aoi queries for all the aois: the aoi, audit-trail & gunw queries in one
+        batch, then the acq-list queries (which depend on the aoi documents) in a second'''
+        gunw_queries = self.gunw_queries() if self.engine == 'documents' else []
+        self.prefetch([self.aoi_query(x) for x in aoi_ids] + [self.audit_trail_query(x) for x in aoi_ids] + gunw_queries)
+        acq_list_queries = []
+        for aoi_id in aoi_ids:
+            prod_type, kwargs = self.aoi_query(aoi_id)
+            aois = self.get_objects(prod_type, **kwargs)
+            if len(aois) == 1:
+                acq_list_queries.append(self.acq_list_query(aois[0]))
+        self.prefetch(acq_list_queries)
+
+    def aoi_query(self, aoi_id, version=False):
+        '''returns the (prod_type, kwargs) query for the aoi'''
+        return 'area_of_interest', {'uid': aoi_id, 'version': version}
+
+    def audit_trail_query(self, aoi_id):
+        '''returns the (prod_type, kwargs) query for audit-trail products along the input track over the aoi'''
+        return 'S1-GUNW-acqlist-audit_trail', {'track_number': self.track_number, 'aoi': aoi_id, 'fields': EVALUATION_FIELDS}
+
+    def acq_list_query(self, aoi):
+        '''returns the (prod_type, kwargs) query for acq-lists over the aoi'''
+        aoi_met = aoi.get('_source', {}).get('metadata', {})
+        return 'S1-GUNW-acq-list', {'starttime': aoi_met.get('starttime', False), 'endtime': aoi_met.get('endtime', False),
+                                    'location': aoi.get('_source', {}).get('location', False), 'fields': EVALUATION_FIELDS}
+
+    def gunw_queries(self):
+        '''returns the (prod_type, kwargs) queries for the gunws & gunw-merged along the input track & orbit'''
+        if self.prod_type == 'S1-GUNW-GREYLIST':
+            versions = [('S1-GUNW', self.s1_gunw_version), ('S1-GUNW-MERGED', self.s1_gunw_merged_version)]
+        else:
+            versions = [(self.prod_type, self.version)]
+        return [(prod_type, {'track_number': self.track_number, 'orbit_numbers': self.orbit_number, 'version': version,
+                             'created_after': self.ledger_start(prod_type, version), 'fields': EVALUATION_FIELDS})
+                for prod_type, version in versions]
+
+    def ledger_feed(self, prod_type, version):
+        '''returns the ledger key of the input track & orbit's gunws (or gunw-merged) of the version'''
+        return prod_type, self.track_number, stringify_orbit(self.orbit_number), version
+
+    def ledger_start(self, prod_type, version):
+        '''returns the creation_timestamp to query the feed's gunws from: the completeness ledger's
+        last seen product, or False to query them all'''
+        feed = self.ledger_feed(prod_type, version)
+        with self.ledger_lock:
+            if feed not in self.ledger_starts:
+                self.ledger_starts[feed] = False
+                if context_flag(self.ctx, 'completeness_ledger') and self.orbit_number and self.engine == 'documents' and self.local_state:
+                    try:
+                        if self.ledger is None:
+                            self.ledger = ledger.CompletenessLedger(self.ctx.get('ledger_cache_dir') or greylist_store.CACHE_DIR)
+                        self.ledger_starts[feed] = self.ledger.last_seen(*feed)
+                    except (sqlite3.Error, OSError) as err:
+                        logger.warning('completeness ledger unavailable (%s), querying all %s products', err, prod_type)
+            return self.ledger_starts[feed]
+
+    def get_gunws(self, prod_type, kwargs):
+        '''returns the gunws (or gunw-merged) for the gunw query. When the query only fetched the products
+        created since the ledger last saw the feed, they are merged into the ledger & all the feed's products returned.
+        The aggregate engine returns the HashBuckets of the query instead'''
+        if self.engine == 'aggregate':
+            return self.get_buckets(prod_type, kwargs)
+        gunws = self.get_objects(prod_type, **kwargs)
+        if self.ledger is None:
+            return gunws
+        feed = self.ledger_feed(prod_type, kwargs.get('version'))
+        with self.ledger_lock:
+            if feed not in self.ledger_feeds:
+                try:
+                    self.ledger.update_products(*feed, products=gunws, full_refresh=not kwargs.get('created_after'))
+                    self.ledger_feeds[feed] = self.confirm_ledger_products(feed, self.ledger.products(*feed), gunws)
+                except (sqlite3.Error, OSError) as err:
+                    logger.warning('completeness ledger unavailable (%s), querying all %s products', err, prod_type)
+                    self.ledger_feeds[feed] = self.get_objects(prod_type, **dict(kwargs, created_after=False))
+                logger.info('%s ledger: %d products (%d new) for track: %s orbit: %s', prod_type, len(self.ledger_feeds[feed]),
+                            len(gunws), feed[1], feed[2])
+            return self.ledger_feeds[feed]
 
     def run_aoi_evaluation(self):
         '''runs the evaluation & publishing for an aoi'''
+        gunw_kwargs = {'location': self.location, 'starttime': self.starttime, 'endtime': self.endtime, 'fields': EVALUATION_FIELDS}
+        # the location based gunw queries are not prefetched: they usually exceed one page, and are
+        # better streamed by a scroll than decoded whole from an _msearch response
+        self.prefetch([('S1-GUNW-acqlist-audit_trail', {'aoi': self.uid, 'fields': EVALUATION_FIELDS}), self.aoi_query(self.uid, self.version)])
         # get all audit_trail products over the aoi
-        audit_trail_list = get_objects('S1-GUNW-acqlist-audit_trail', aoi=self.uid)
-        # determine all full_id_hashes from all audit_trail products
-        full_id_hashes = list(sort_by_hash(audit_trail_list).keys())
-        # retrieve associated gunws from the full_id_hash list
-        s1_gunw = filter_hashes(get_objects('S1-GUNW', location=self.location, starttime=self.starttime, endtime=self.endtime), full_id_hashes)
-        s1_gunw_merged = filter_hashes(get_objects('S1-GUNW-MERGED', location=self.location, starttime=self.starttime, endtime=self.endtime), full_id_hashes)
-        # get all greylist hashes
-        greylist_hashes = list(sort_by_hash(get_objects('S1-GUNW-GREYLIST', location=self.location)).keys()) 
+        audit_trail_list = self.get_objects('S1-GUNW-acqlist-audit_trail', aoi=self.uid, fields=EVALUATION_FIELDS)
+        if self.engine == 'aggregate':
+            # only the gunw hashes per track & orbit; acq-lists are matched against the audit trail below
+            s1_gunw = self.get_buckets('S1-GUNW', gunw_kwargs)
+            s1_gunw_merged = self.get_buckets('S1-GUNW-MERGED', gunw_kwargs)
+        else:
+            # determine all full_id_hashes from all audit_trail products
+            full_id_hashes = ProductIndex(audit_trail_list)
+            # retrieve associated gunws from the full_id_hash list
+            s1_gunw = filter_hashes(self.get_objects('S1-GUNW', **gunw_kwargs), full_id_hashes)
+            s1_gunw_merged = filter_hashes(self.get_objects('S1-GUNW-MERGED', **gunw_kwargs), full_id_hashes)
+        # get all greylist hashes over the aoi
+        greylist_hashes = self.get_greylist_hashes(location=self.location)
         # get the full aoi product
-        aois = get_objects('area_of_interest', uid=self.uid, version=self.version)
+        prod_type, kwargs = self.aoi_query(self.uid, self.version)
+        aois = self.get_objects(prod_type, **kwargs)
         if len(aois) > 1:
             raise Exception('unable to distinguish between multiple AOIs with same uid but different version: {}}'.format(self.uid))
         if len(aois) == 0:
@@ -101,199 +271,326 @@ class evaluate(object):
     def run_greylist_evaluation(self):
         '''runs the evaluation and publishing for a greylist'''
         # fill the hash if it doesn't exist
-        if self.full_id_hash is False:
-            print('attempting to fill hash for submitted product...')
-            self.full_id_hash = gen_hash(get_objects(self.prod_type, uid=self.uid)[0])
-            print('Found hash {}'.format(self.full_id_hash))
+        if not self.full_id_hash:
+            logger.info('attempting to fill hash for submitted product...')
+            self.full_id_hash = get_hash(self.get_objects(self.prod_type, uid=self.uid, fields=EVALUATION_FIELDS)[0])
+            logger.info('Found hash %s', self.full_id_hash)
         # get all the greylists
-        greylist_hashes = list(sort_by_hash(get_objects('S1-GUNW-GREYLIST')).keys())
+        greylist_hashes = self.get_greylist_hashes()
         # determine which AOI(s) the gunw corresponds to
-        all_audit_trail = get_objects('S1-GUNW-acqlist-audit_trail', full_id_hash=self.full_id_hash)
-        audit_by_aoi = sort_by_aoi(all_audit_trail)
-        for aoi_id in list(audit_by_aoi.keys()):
-            print('Evaluating associated GUNWs over AOI: {}'.format(aoi_id))
-            aois = get_objects('area_of_interest', uid=aoi_id)
-            if len(aois) > 1:
-                raise Exception('unable to distinguish between multiple AOIs with same uid but different version: {}}'.format(aoi_id))
-            if len(aois) == 0:
-                warnings.warn('unable to find referenced AOI: {}'.format(aoi_id))
-                continue
-            aoi = aois[0]
-            # get all audit-trail products that match orbit and track
-            matching_audit_trail_list = get_objects('S1-GUNW-acqlist-audit_trail', track_number=self.track_number, aoi=aoi_id)
-            print('Found {} audit trail products matching track: {}'.format(len(matching_audit_trail_list), self.track_number))
-            if len(matching_audit_trail_list) < 1:
-                continue
-            #get all acq-list products that match the audit trail
-            acq_lists = self.get_matching_acq_lists(aoi, matching_audit_trail_list, greylist_hashes)
-            if len(acq_lists) < 1:
-                print('Found {} acq-lists.'.format(len(acq_lists)))
-                continue
-            #filter invalid orbits
-            acq_lists = sort_by_orbit(acq_lists).get(stringify_orbit(self.orbit_number))
-            # get all associated gunw or gunw-merged products
-            gunws = get_objects('S1-GUNW', track_number=self.track_number, orbit_numbers=self.orbit_number, version=self.s1_gunw_version)
+        all_audit_trail = self.get_objects('S1-GUNW-acqlist-audit_trail', full_id_hash=self.full_id_hash, fields=EVALUATION_FIELDS)
+        aoi_ids = list(ProductIndex(all_audit_trail).by_aoi.keys())
+        self.prefetch_aois(aoi_ids)
+        self.evaluate_aois(aoi_ids, self.evaluate_greylist_aoi, greylist_hashes)
+
+    def evaluate_greylist_aoi(self, aoi_id, greylist_hashes):
+        '''evaluates the gunws & gunw-merged along the greylist's track & orbit over a single aoi'''
+        aoi, acq_lists = self.get_aoi_acq_lists(aoi_id, greylist_hashes)
+        if aoi is None:
+            return
+        # get all associated gunw & gunw-merged products
+        for prod_type, kwargs in self.gunw_queries():
+            gunws = self.get_gunws(prod_type, kwargs)
             if len(gunws) < 1:
-                print("No S1-GUNW FOUND for track_number={}, orbit_numbers={}, s1-gunw-version={}".format(self.track_number, self.orbit_number, self.s1_gunw_version))
+                logger.info('No %s FOUND for track_number=%s, orbit_numbers=%s, version=%s', prod_type, self.track_number, self.orbit_number, kwargs.get('version'))
             else:
                 # evaluate to determine which products are complete, tagging & publishing complete products
                 self.gen_completed(gunws, acq_lists, aoi)
 
-            gunws_merged = get_objects('S1-GUNW-MERGED', track_number=self.track_number, orbit_numbers=self.orbit_number, version=self.s1_gunw_merged_version)
-            if len(gunws_merged) < 1:
-                print("No S1-GUNW-MERGED FOUND for track_number={}, orbit_numbers={}, s1-gunw-version={}".format(self.track_number, self.orbit_number, self.s1_gunw_merged_version))
-            else:
-                # evaluate to determine which products are complete, tagging & publishing complete products
-                self.gen_completed(gunws_merged, acq_lists, aoi)
-
     def run_gunw_evaluation(self):
         '''runs the evaluation and publishing for a gunw or gunw-merged'''
         # fill the hash if it doesn't exist
-        if self.full_id_hash is False:
-            print('attempting to fill hash for submitted product...')
-            self.full_id_hash = gen_hash(get_objects(self.prod_type, uid=self.uid)[0])
-            print('Found hash {}'.format(self.full_id_hash))
+        if not self.full_id_hash:
+            logger.info('attempting to fill hash for submitted product...')
+            self.full_id_hash = get_hash(self.get_objects(self.prod_type, uid=self.uid, fields=EVALUATION_FIELDS)[0])
+            logger.info('Found hash %s', self.full_id_hash)
         # get all the greylists
-        greylist_hashes = list(sort_by_hash(get_objects('S1-GUNW-GREYLIST')).keys())
+        greylist_hashes = self.get_greylist_hashes()
         # determine which AOI(s) the gunw corresponds to
-        all_audit_trail = get_objects('S1-GUNW-acqlist-audit_trail', full_id_hash=self.full_id_hash)
-        audit_by_aoi = sort_by_aoi(all_audit_trail)
-        for aoi_id in list(audit_by_aoi.keys()):
-            print('Evaluating associated GUNWs over AOI: {}'.format(aoi_id))
-            aois = get_objects('area_of_interest', uid=aoi_id)
-            if len(aois) > 1:
-                raise Exception('unable to distinguish between multiple AOIs with same uid but different version: {}}'.format(aoi_id))
-            if len(aois) == 0:
-                warnings.warn('unable to find referenced AOI: {}'.format(aoi_id))
-                continue
-            aoi = aois[0]
-            # get all audit-trail products that match orbit and track
-            matching_audit_trail_list = get_objects('S1-GUNW-acqlist-audit_trail', track_number=self.track_number, aoi=aoi_id)
-            print('Found {} audit trail products matching track: {}'.format(len(matching_audit_trail_list), self.track_number))
-            if len(matching_audit_trail_list) < 1:
-                continue
-            #get all acq-list products that match the audit trail
-            acq_lists = self.get_matching_acq_lists(aoi, matching_audit_trail_list, greylist_hashes)
-            if len(acq_lists) < 1:
-                print('Found {} acq-lists.'.format(len(acq_lists)))
-                continue
-            #filter invalid orbits
-            print("self.orbit_number : {}".format(self.orbit_number))
-            acq_lists = sort_by_orbit(acq_lists).get(stringify_orbit(self.orbit_number))
-            # get all associated gunw or gunw-merged products
-            gunws = get_objects(self.prod_type, track_number=self.track_number, orbit_numbers=self.orbit_number, version=self.version)
-            # evaluate to determine which products are complete, tagging & publishing complete products
-            completed = self.gen_completed(gunws, acq_lists, aoi)
-            if not completed:
-                logger.info("Not Completed : {}".format(self.uid))
+        all_audit_trail = self.get_objects('S1-GUNW-acqlist-audit_trail', full_id_hash=self.full_id_hash, fields=EVALUATION_FIELDS)
+        aoi_ids = list(ProductIndex(all_audit_trail).by_aoi.keys())
+        self.prefetch_aois(aoi_ids)
+        self.evaluate_aois(aoi_ids, self.evaluate_gunw_aoi, greylist_hashes)
+
+    def evaluate_gunw_aoi(self, aoi_id, greylist_hashes):
+        '''evaluates the gunws (or gunw-merged) along the input product's track & orbit over a single aoi'''
+        aoi, acq_lists = self.get_aoi_acq_lists(aoi_id, greylist_hashes)
+        if aoi is None:
+            return
+        # get all associated gunw or gunw-merged products
+        prod_type, kwargs = self.gunw_queries()[0]
+        gunws = self.get_gunws(prod_type, kwargs)
+        # evaluate to determine which products are complete, tagging & publishing complete products
+        completed = self.gen_completed(gunws, acq_lists, aoi)
+        if not completed:
+            logger.info('Not Completed : %s', self.uid)
+
+    def get_aoi_acq_lists(self, aoi_id, greylist_hashes):
+        '''returns the aoi & its acq-lists matching the input product's track & orbit.
+        returns (None, None) if there is nothing to evaluate over the aoi'''
+        logger.info('Evaluating associated GUNWs over AOI: %s', aoi_id)
+        prod_type, kwargs = self.aoi_query(aoi_id)
+        aois = self.get_objects(prod_type, **kwargs)
+        if len(aois) > 1:
+            raise Exception('unable to distinguish between multiple AOIs with same uid but different version: {}}'.format(aoi_id))
+        if len(aois) == 0:
+            warnings.warn('unable to find referenced AOI: {}'.format(aoi_id))
+            return None, None
+        aoi = aois[0]
+        # get all audit-trail products that match orbit and track
+        prod_type, kwargs = self.audit_trail_query(aoi_id)
+        matching_audit_trail_list = self.get_objects(prod_type, **kwargs)
+        logger.info('Found %d audit trail products matching track: %s', len(matching_audit_trail_list), self.track_number)
+        if len(matching_audit_trail_list) < 1:
+            return None, None
+        #get all acq-list products that match the audit trail
+        acq_lists = self.get_matching_acq_lists(aoi, matching_audit_trail_list, greylist_hashes)
+        if len(acq_lists) < 1:
+            logger.info('Found %d acq-lists.', len(acq_lists))
+            return None, None
+        #filter invalid orbits
+        logger.debug('self.orbit_number : %s', self.orbit_number)
+        acq_lists = ProductIndex(acq_lists).by_orbit.get(stringify_orbit(self.orbit_number), [])
+        return aoi, acq_lists
+
+    def evaluate_aois(self, aoi_ids, evaluate_aoi, *args):
+        '''runs evaluate_aoi(aoi_id, *args) for each aoi, concurrently on a bounded thread pool
+        when aoi_workers > 1. output is buffered per aoi & written in aoi order. each aoi
+        queues its tag changes in its own tag queue'''
+        def run(aoi_id):
+            self.tag_queues.queue = self.new_tag_queue()
+            try:
+                evaluate_aoi(aoi_id, *args)
+            finally:
+                self.tag_queues.queue = None
+        workers = min(context_int(self.ctx, 'aoi_workers', AOI_WORKERS), len(aoi_ids))
+        if workers <= 1:
+            for aoi_id in aoi_ids:
+                run(aoi_id)
+            return
+        logger.info('Evaluating %d AOIs with %d workers', len(aoi_ids), workers)
+        parallel.map_grouped(run, aoi_ids, workers)
+
+    def new_tag_queue(self):
+        '''returns an empty tag queue sharing this run's record of written tags'''
+        return tagger.TagQueue(batch_size=context_int(self.ctx, 'tag_batch_size', tagger.BULK_BATCH_SIZE), written=self.tags_written)
+
+    @property
+    def tag_queue(self):
+        '''the tag queue of the aoi being evaluated by this thread'''
+        queue = getattr(self.tag_queues, 'queue', None)
+        if queue is None:
+            queue = self.tag_queues.queue = self.new_tag_queue()
+        return queue
+
+    def get_greylist_hashes(self, location=False):
+        '''returns the set of greylisted full_id_hashes, over the location if given. With the greylist_store
+        context flag, the whole greylist is kept in the local greylist store & only the greylist products
+        created since its last refresh are fetched'''
+        if not context_flag(self.ctx, 'greylist_store') or not self.local_state:
+            return set(ProductIndex(self.get_objects('S1-GUNW-GREYLIST', location=location, fields=GREYLIST_FIELDS, match_all=True)).hashes())
+        try:
+            store = greylist_store.GreylistStore(self.ctx.get('greylist_cache_dir') or greylist_store.CACHE_DIR)
+            last_seen = store.last_seen()
+            greylists = self.get_objects('S1-GUNW-GREYLIST', created_after=last_seen, fields=GREYLIST_FIELDS, match_all=True)
+            store.update(greylists, full_refresh=not last_seen)
+            self.confirm_greylist_products(store, greylists)
+            greylist_hashes = store.hashes()
+            store.close()
+        except (sqlite3.Error, OSError) as err:
+            logger.warning('greylist store unavailable (%s), querying full greylist', err)
+            return set(ProductIndex(self.get_objects('S1-GUNW-GREYLIST', location=location, fields=GREYLIST_FIELDS, match_all=True)).hashes())
+        logger.info('found %d greylisted hashes (%d new)', len(greylist_hashes), len(greylists))
+        return greylist_hashes
+
+    def confirm_greylist_products(self, store, fetched):
+        '''checks the stored greylist products that this run's query did not return still exist, with one _mget,
+        removing those gone from GRQ so their hashes are expected again'''
+        fetched_ids = set(x.id for x in fetched)
+        held = [key for key in store.keys() if key[2] not in fetched_ids]
+        if not held:
+            return
+        state = tagger.read_tags(held)
+        gone = [uid for index, prod_type, uid in held if (index, prod_type, uid) not in state]
+        if gone:
+            logger.info('dropping %d greylist products no longer in GRQ from the greylist store', len(gone))
+            store.remove(gone)
 
+    @metrics.timed('gen_completed')
     def gen_completed(self, gunws, acq_lists, aoi):
-        '''determines which gunws (or gunw-merged) products are complete along track & orbit,
-        tags and publishes TRACK_AOI products for those that are complete'''
-        complete = []
-        hashed_acq_dct = sort_duplicates_by_hash(acq_lists)
-        hashed_gunw_dct = sort_duplicates_by_hash(gunws) # iterates through the list & removes older gunws with duplicate full_id_hash
-        track_dct = sort_by_track(acq_lists)
-        for track in list(track_dct.keys()):
-            track_list = track_dct.get(track, [])
-            orbit_dct = sort_by_orbit(track_list)
-            for orbit in list(orbit_dct.keys()):
-                print('------------------------------')
-                orbit_list = orbit_dct.get(orbit, [])
-                print('Found {} ACQ-lists over aoi: {} & track: {} & orbit: {}'.format(len(orbit_list), aoi.get('_source').get('id'), track, orbit))
-                print('Evaluating GUNWs and Acquisitions over track: {} and orbit: {}'.format(track, orbit))
-                # get all full_id_hashes in the acquisition list
-                all_hashes = [get_hash(x) for x in orbit_list]
-                print('all relevant ids over AOI: {}'.format(', '.join([x.get('_source').get('id') for x in orbit_list])))
-                print('all relevant hashes over AOI: {}'.format(', '.join(all_hashes)))
-                # if all of them are in the list of gunw hashes, they are complete
-                complete = True
-                complete_acq_lists = []
-                incomplete_acq_lists = []
-                missing_hashes = []
-                for full_id_hash in all_hashes:
-                    if hashed_gunw_dct.get(full_id_hash, False) is False:
-                        complete = False
-                        missing_hashes.append(full_id_hash)
-                        print('hash: {} is missing... products are incomplete.'.format(full_id_hash))
-                        incomplete_acq_lists.append(hashed_acq_dct.get(full_id_hash))
-                    else:
-                        complete_acq_lists.append(hashed_acq_dct.get(full_id_hash))
-                print('found {} complete and {} missing hashes.'.format(len(complete_acq_lists), len(incomplete_acq_lists)))
-                if not complete:
-                    print('missing hashes: {}'.format(', '.join(missing_hashes)))
-                # tag acq-lists if iterating over gunws (not gunw merged')
-                if gunws[0].get('_type', False) == 'S1-GUNW':
-                    print('tagging acq-lists appropriately')
-                    for obj in complete_acq_lists:
-                        tags = obj.get('_source', {}).get('metadata', {}).get('tags', [])
-                        uid = obj.get('_source', {}).get('id', False)
-                        if 'gunw_missing' in tags:
-                            print('removing tag: "gunw_missing" from: {}'.format(uid))
-                            self.remove_obj_tag(obj, 'gunw_missing')
-                        if not 'gunw_generated' in tags:
-                            print('adding tag: "gunw_generated" to: {}'.format(uid))
-                            self.tag_obj(obj, 'gunw_generated')
-                    for obj in incomplete_acq_lists:
-                        tags = obj.get('_source', {}).get('metadata', {}).get('tags', [])
-                        uid = obj.get('_source', {}).get('id', False)
-                        if 'gunw_generated' in tags:
-                            print('removing tag: "gunw_generated" from: {}'.format(uid))
-                            self.remove_obj_tag(obj, 'gunw_generated')
-                        if not 'gunw_missing' in tags:
-                            print('adding tag: "gunw_missing" to: {}'.format(uid))
-                            self.tag_obj(obj, 'gunw_missing')
-                # they are complete. tag & generate products
-                if complete:
-                    gunw_list = []
-                    for hsh in all_hashes:
-                        gunw_list.append(hashed_gunw_dct.get(hsh))
-                    print('found {} products complete over aoi: {} for track: {} and orbit: {}'.format(len(gunw_list), aoi.get('_id'), track, orbit))
-                    self.tag_and_publish(gunw_list, aoi)
-                    return True
+        '''determines which gunws (or gunw-merged) products are complete along each track & orbit,
+        tags the acq-lists and publishes TRACK_AOI products for every complete group. returns a CompletenessResult'''
+        acq_index = ProductIndex(acq_lists)
+        hashed_acq_dct = acq_index.latest_by_hash
+        bucketed = isinstance(gunws, aggregations.HashBuckets)
+        gunw_type = gunws.type if bucketed else (gunws[0].type if gunws else None)
+        hashed_gunw_dct = {} if bucketed else ProductIndex(gunws).latest_by_hash # removes older gunws with duplicate full_id_hash
+        result = CompletenessResult(aoi.get('_id'), gunw_type)
+        for track, orbit, orbit_list in acq_index.track_orbit_groups():
+            logger.debug('Evaluating %d ACQ-lists over aoi: %s & track: %s & orbit: %s', len(orbit_list), aoi.get('_source').get('id'), track, orbit)
+            # get all full_id_hashes in the acquisition list
+            all_hashes = [get_hash(x) for x in orbit_list]
+            self.record_expected(aoi.get('_id'), track, orbit, all_hashes)
+            if logger.isEnabledFor(logs.DEBUG):
+                logger.debug('all relevant ids over AOI: %s', ', '.join([x.id for x in orbit_list]))
+                logger.debug('all relevant hashes over AOI: %s', ', '.join(all_hashes))
+            # if all of them are in the list of gunw hashes, they are complete
+            present = gunws.hashes(track, orbit) if bucketed else hashed_gunw_dct
+            complete_acq_lists = []
+            incomplete_acq_lists = []
+            missing_hashes = []
+            for full_id_hash in all_hashes:
+                if full_id_hash not in present:
+                    missing_hashes.append(full_id_hash)
+                    incomplete_acq_lists.append(hashed_acq_dct.get(full_id_hash))
                 else:
-                    return False
+                    complete_acq_lists.append(hashed_acq_dct.get(full_id_hash))
+            complete = not missing_hashes
+            # one summary record per (aoi, track, orbit) group
+            logger.info('aoi: %s track: %s orbit: %s type: %s acq-lists: %d complete: %d missing: %d status: %s',
+                        aoi.get('_id'), track, orbit, gunw_type, len(orbit_list),
+                        len(complete_acq_lists), len(incomplete_acq_lists), 'complete' if complete else 'incomplete')
+            if not complete and logger.isEnabledFor(logs.DEBUG):
+                logger.debug('missing hashes: %s', ', '.join(missing_hashes))
+            # tag acq-lists if iterating over gunws (not gunw merged')
+            if gunw_type == 'S1-GUNW':
+                for obj in complete_acq_lists:
+                    tags = obj.tags
+                    uid = obj.id
+                    if 'gunw_missing' in tags:
+                        logger.debug('removing tag: "gunw_missing" from: %s', uid)
+                        self.remove_obj_tag(obj, 'gunw_missing')
+                    if not 'gunw_generated' in tags:
+                        logger.debug('adding tag: "gunw_generated" to: %s', uid)
+                        self.tag_obj(obj, 'gunw_generated')
+                for obj in incomplete_acq_lists:
+                    tags = obj.tags
+                    uid = obj.id
+                    if 'gunw_generated' in tags:
+                        logger.debug('removing tag: "gunw_generated" from: %s', uid)
+                        self.remove_obj_tag(obj, 'gunw_generated')
+                    if not 'gunw_missing' in tags:
+                        logger.debug('adding tag: "gunw_missing" to: %s', uid)
+                        self.tag_obj(obj, 'gunw_missing')
+            if complete:
+                result.complete.append((track, orbit, all_hashes))
+            else:
+                result.incomplete.append((track, orbit, missing_hashes))
+        # acq-list tags for every group are written together
+        self.flush_tags()
+        # which complete groups already have an AOI_TRACK product, in one request
+        aoi_id = aoi.get('_source').get('id')
+        published = get_published(aoi_track_type(gunw_type), [(aoi_id, track, orbit) for track, orbit, _ in result.complete])
+        # they are complete. tag & generate products
+        for track, orbit, all_hashes in result.complete:
+            if bucketed:
+                gunw_list = gunws.products(all_hashes)
+            else:
+                gunw_list = [hashed_gunw_dct.get(hsh) for hsh in all_hashes]
+            logger.info('found %d products complete over aoi: %s for track: %s and orbit: %s', len(gunw_list), aoi.get('_id'), track, orbit)
+            if self.tag_and_publish(gunw_list, aoi, published=published):
+                result.published.append((track, orbit))
+        logger.info('%s', result)
+        return result
+
+    def confirm_ledger_products(self, feed, products, fetched):
+        '''checks the ledger's products that this run's query did not return still exist, with one _mget.
+        products gone from GRQ are dropped from the ledger & the tags & versions of the rest refreshed.
+        returns the products that exist'''
+        fetched_ids = set(x.id for x in fetched)
+        held = [x for x in products if x.id not in fetched_ids]
+        if not held:
+            return products
+        state = tagger.read_tags([(x.index, x.type, x.id) for x in held])
+        gone = set()
+        for rec in held:
+            key = (rec.index, rec.type, rec.id)
+            if key in state:
+                rec.tags, rec.doc_version = state[key]
+            else:
+                gone.add(rec.id)
+        self.ledger.update_products(*feed, products=[x for x in held if x.id not in gone])
+        if gone:
+            logger.info('dropping %d %s products no longer in GRQ from the ledger', len(gone), feed[0])
+            self.ledger.remove_products(feed[0], gone)
+        return [x for x in products if x.id not in gone]
+
+    def get_buckets(self, prod_type, kwargs):
+        '''returns the HashBuckets of the gunws (or gunw-merged) matching the query, aggregating once per run'''
+        kwargs = dict(kwargs, created_after=False, fields=False)
+        key = query_cache.make_key(prod_type, **kwargs)
+        with self.buckets_lock:
+            if key not in self.buckets:
+                fetch = lambda hashes: self.get_objects(prod_type, **dict(kwargs, full_id_hash=hashes, fields=EVALUATION_FIELDS))
+                self.buckets[key] = get_buckets(prod_type, fetch, **kwargs)
+            return self.buckets[key]
+
+    def record_expected(self, aoi_id, track, orbit, hashes):
+        '''records the group's expected full_id_hashes in the completeness ledger, if open, for its missing command'''
+        if self.ledger is None:
+            return
+        with self.ledger_lock:
+            try:
+                self.ledger.set_expected(aoi_id, track, orbit, hashes)
+            except sqlite3.Error as err:
+                logger.warning('unable to record expected hashes in the completeness ledger: %s', err)
 
-    def tag_and_publish(self, gunws, aoi):
+    def tag_and_publish(self, gunws, aoi, published=None):
         '''tags each object in the input list, then publishes an appropriate
-           aoi-track product'''
+           aoi-track product. published is the set of (aoi, track, orbit) keys known to be
+           published already, as returned by get_published. returns True if a product was published'''
         if len(gunws) < 1:
-            return
-        if self.aoi_track_is_published(gunws, aoi.get('_source').get('id')):
-            print('AOI_TRACK product is already published... skipping.')
-            return
-        print('AOI_TRACK product has not been published. Publishing product...')
+            return False
+        aoi_id = aoi.get('_source').get('id')
+        if published is not None:
+            is_published = published_key(aoi_id, get_track(gunws[-1]), get_orbit(gunws[-1])) in published
+        else:
+            is_published = self.aoi_track_is_published(gunws, aoi_id)
+        if is_published:
+            logger.info('AOI_TRACK product is already published... skipping.')
+            return False
+        # products published by this run are only ingested after the job ends, so GRQ cannot report them
+        key = (aoi_track_type(gunws[-1].type),) + published_key(aoi_id, get_track(gunws[-1]), get_orbit(gunws[-1]))
+        with self.published_lock:
+            if key in self.published_keys:
+                logger.info('AOI_TRACK product was already published by this job... skipping.')
+                return False
+            self.published_keys.add(key)
+        logger.info('AOI_TRACK product has not been published. Publishing product...')
         for obj in gunws:
             tag = aoi.get('_source').get('id')
             self.tag_obj(obj, tag)
+        self.flush_tags()
         prefix = AOI_TRACK_PREFIX
-        if gunws[0].get('_type') == 'S1-GUNW-MERGED':
+        if gunws[0].type == 'S1-GUNW-MERGED':
             prefix = AOI_TRACK_MERGED_PREFIX
+        # evaluation only fetched a projection of each gunw; the product needs the full documents
+        gunws = get_full_objects(gunws)
         build_validated_product.build(gunws, AOI_TRACK_VERSION, prefix, aoi, get_track(gunws[0]), get_orbit(gunws[0]))
+        return True
 
     def tag_obj(self, obj, tag):
-        '''tags the object with the given tag'''
-        uid = obj.get('_source').get('id')
-        prod_type = obj.get('_type')
-        index = obj.get('_index')
-        tagger.add_tag(index, uid, prod_type, tag)
+        '''queues the tag to be added to the object'''
+        rec = as_record(obj)
+        self.tag_queue.add(rec.index, rec.id, rec.type, tag, known_tags=rec.tags, version=rec.doc_version)
 
     def remove_obj_tag(self, obj, tag):
-        '''removes the tag from the given object'''
-        uid = obj.get('_source').get('id')
-        prod_type = obj.get('_type')
-        index = obj.get('_index')
-        tagger.remove_tag(index, uid, prod_type, tag)
+        '''queues the tag to be removed from the given object'''
+        rec = as_record(obj)
+        self.tag_queue.remove(rec.index, rec.id, rec.type, tag, known_tags=rec.tags, version=rec.doc_version)
+
+    def flush_tags(self):
+        '''applies all queued tag changes in bulk, erroring if any product failed to update'''
+        failures = self.tag_queue.flush()
+        if failures:
+            raise Exception('failed to update tags for {} products: {}'.format(len(failures), ', '.join([str(uid) for uid, _ in failures])))
 
     def get_matching_acq_lists(self, aoi, audit_trail_list, greylist_hashes):
         '''returns all acquisition lists matching the audit trail products under the given aoi'''
-        aoi_met = aoi.get('_source', {}).get('metadata', {})
-        start = aoi_met.get('starttime', False)
-        end = aoi_met.get('endtime', False)
-        location = aoi.get('_source', {}).get('location', False)
-        audit_dct = sort_by_hash(audit_trail_list)
+        audit_dct = ProductIndex(audit_trail_list).by_hash
         matching = []
-        all_acq_lists = get_objects('S1-GUNW-acq-list', starttime=start, endtime=end, location=location)
+        prod_type, kwargs = self.acq_list_query(aoi)
+        all_acq_lists = self.get_objects(prod_type, **kwargs)
         for acq_list in all_acq_lists:
             hsh = get_hash(acq_list)
             if audit_dct.get(hsh, False) and hsh not in greylist_hashes:
@@ -303,27 +600,113 @@ class evaluate(object):
     def aoi_track_is_published(self, gunws, aoi_id):
         '''determines if the aoi_track product is published already. Returns True/False'''
         gunw = gunws[-1]
-        gunw_type = gunw.get('_type')
-        prod_type = 'S1-GUNW-AOI_TRACK'
-        if gunw_type == 'S1-GUNW-MERGED':
-            prod_type = 'S1-GUNW-MERGED-AOI_TRACK'
-        matches = get_objects(prod_type, track_number=get_track(gunw), orbit_numbers=gunw.get('_source').get('metadata').get('orbit_number'), aoi=aoi_id)
+        prod_type = aoi_track_type(gunw.type)
+        # products published by this run are not in GRQ yet; tag_and_publish remembers those
+        matches = get_objects(prod_type, track_number=get_track(gunw), orbit_numbers=gunw.orbit_numbers, aoi=aoi_id, fields=['id'])
         if matches:
             return True
         return False
 
-def get_objects(prod_type, location=False, starttime=False, endtime=False, full_id_hash=False, track_number=False, orbit_numbers=False, version=False, uid=False, aoi=False):
+class CompletenessResult(object):
+    '''summary of a gen_completed pass over one aoi & product type'''
+    def __init__(self, aoi_id, prod_type):
+        self.aoi_id = aoi_id
+        self.prod_type = prod_type
+        self.complete = [] # (track, orbit, full_id_hashes) of the complete groups
+        self.incomplete = [] # (track, orbit, missing full_id_hashes) of the incomplete groups
+        self.published = [] # (track, orbit) of the groups an AOI_TRACK product was published for
+
+    def __bool__(self):
+        return len(self.complete) > 0
+
+    def __str__(self):
+        return 'aoi: {} type: {} groups: {} complete: {} incomplete: {} published: {}'.format(
+            self.aoi_id, self.prod_type, len(self.complete) + len(self.incomplete), len(self.complete),
+            len(self.incomplete), len(self.published))
+
+def aoi_track_type(gunw_type):
+    '''returns the AOI_TRACK product type published for the gunw type'''
+    if gunw_type == 'S1-GUNW-MERGED':
+        return 'S1-GUNW-MERGED-AOI_TRACK'
+    return 'S1-GUNW-AOI_TRACK'
+
+def published_key(aoi_id, track, orbit):
+    '''returns the (aoi, track, orbit) key of an AOI_TRACK product'''
+    return aoi_id, str(track), orbit
+
+@metrics.timed('get_published')
+def get_published(prod_type, keys):
+    '''
+    returns the set of (aoi, track, orbit) keys that already have a published product of the
+    AOI_TRACK type, checking every key in a single _msearch. Products this job publishes are only
+    ingested after it ends, so they are never found here; tag_and_publish tracks them in memory.
+    returns None if the check failed
+    '''
+    keys = list(OrderedDict.fromkeys(published_key(*key) for key in keys))
+    if not keys:
+        return set()
+    searches = [(INDEX_MAPPING.get(prod_type), build_query(prod_type, track_number=track, orbit_numbers=[int(x) for x in orbit.split('_')],
+                                                           aoi=aoi_id, fields=['id'])[1]) for aoi_id, track, orbit in keys]
+    try:
+        all_results = grq.get_client().msearch(searches)
+    except Exception as err:
+        # tag_and_publish falls back to checking each group individually
+        logger.warning('batched published check failed, checking groups individually: %s', err)
+        return None
+    metrics.incr('queries.{}'.format(prod_type))
+    published = set(key for key, results in zip(keys, all_results) if results)
+    logger.info('%d of %d complete groups already have a %s product', len(published), len(keys), prod_type)
+    return published
+
+@metrics.timed('get_objects')
+def get_objects(prod_type, location=False, starttime=False, endtime=False, full_id_hash=False, track_number=False, orbit_numbers=False, version=False, uid=False, aoi=False, created_after=False, fields=False, match_all=False):
     '''returns all objects of the object type that intersect both
     temporally and spatially with the aoi'''
+    grq_url, grq_query = build_query(prod_type, location, starttime, endtime, full_id_hash, track_number, orbit_numbers, version, uid, aoi, created_after, fields, match_all)
+    if logger.isEnabledFor(logs.DEBUG):
+        logger.debug('query_es query: \n%s', json.dumps(grq_query))
+    with metrics.timer('query_es'):
+        results = ingest(prod_type, grq.iter_es(grq_url, grq_query))
+    # if it's an orbit, filter out the bad orbits client-side
+    #if orbit_numbers:
+    #    orbit_key = stringify_orbit(orbit_numbers)
+    #    results = sort_by_orbit(results).get(orbit_key, [])
+    metrics.incr('queries.{}'.format(prod_type))
+    metrics.incr('hits.{}'.format(prod_type), len(results))
+    logger.debug('found %d %s products matching query.', len(results), prod_type)
+    if prod_type in ["S1-GUNW-acqlist-audit_trail", "S1-GUNW-acq-list"]  and len(results) == 0:
+        raise RuntimeError("0 matching found for {} with full_id_hash {} in {} with query :\n{}".format(prod_type, full_id_hash, grq_url, json.dumps(grq_query)))
+
+    #print(results)
+    return results
+
+@metrics.timed('get_buckets')
+def get_buckets(prod_type, fetch, **kwargs):
+    '''returns the HashBuckets of the objects matching the query, from a single terms aggregation'''
+    _, grq_query = build_query(prod_type, **kwargs)
+    es_query = aggregations.build_aggregation(grq_query, 'metadata.{}'.format(resolve_orbit_field(prod_type)))
+    buckets = aggregations.HashBuckets(prod_type, grq.get_client().aggregate(INDEX_MAPPING.get(prod_type), es_query), fetch)
+    metrics.incr('aggregations.{}'.format(prod_type))
+    logger.debug('found %d %s hashes in %d track & orbit groups.', len(buckets), prod_type, len(buckets.groups))
+    return buckets
+
+def ingest(prod_type, es_results):
+    '''converts hits of the record product types into compact product records as they are read'''
+    if prod_type in RECORD_TYPES:
+        return to_records(es_results)
+    return list(es_results)
+
+def build_query(prod_type, location=False, starttime=False, endtime=False, full_id_hash=False, track_number=False, orbit_numbers=False, version=False, uid=False, aoi=False, created_after=False, fields=False, match_all=False):
+    '''builds the GRQ search url & es query for the given parameters. a query without any filter
+    matches every product of the type, so it errors unless match_all is set'''
     idx = INDEX_MAPPING.get(prod_type) # mapping of the product type to the index
-    print_query(prod_type, location, starttime, endtime, full_id_hash, track_number, orbit_numbers, version, uid, aoi)
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, idx)
+    print_query(prod_type, location, starttime, endtime, full_id_hash, track_number, orbit_numbers, version, uid, aoi, created_after)
+    grq_url = grq.get_client().url('{0}/_search'.format(idx))
     filtered = {}
     must = []
     if location:
         filtered["query"] = {"geo_shape": {"location": {"shape": location}}}
-    if starttime or endtime or full_id_hash or track_number or version or uid or aoi:
+    if starttime or endtime or full_id_hash or track_number or orbit_numbers or version or uid or aoi or created_after:
         must = []
         if starttime:
             must.append({"range": {"endtime": {"from": starttime}}})
@@ -352,27 +735,35 @@ def get_objects(prod_type, location=False, starttime=False, endtime=False, full_
                     must.append({"term":{"metadata.{}".format(orbit_term): orbit}})
         if aoi:
             must.append({"match_phrase": {"metadata.aoi.raw": aoi}})
+        if created_after:
+            must.append({"range": {"creation_timestamp": {"gte": created_after}}})
         filtered["filter"] = {"bool":{"must":must}}
     if location:
-        grq_query = {"query": {"filtered": filtered}, "from": 0, "size": 1000}
-    else:
+        grq_query = {"query": {"filtered": filtered}}
+    elif must:
         grq_query = {"query": {"bool":{"must": must}}}
-    #print(grq_url)
-    #print(grq_query)
-    results = query_es(grq_url, grq_query)
-    # if it's an orbit, filter out the bad orbits client-side
-    #if orbit_numbers:
-    #    orbit_key = stringify_orbit(orbit_numbers)
-    #    results = sort_by_orbit(results).get(orbit_key, [])
-    print('found {} {} products matching query.'.format(len(results), prod_type))
-    if prod_type in ["S1-GUNW-acqlist-audit_trail", "S1-GUNW-acq-list"]  and len(results) == 0:
-        raise RuntimeError("0 matching found for {} with full_id_hash {} in {} with query :\n{}".format(prod_type, full_id_hash, grq_url, json.dumps(grq_query)))
-
-    #print(results)
+    elif match_all:
+        grq_query = {"query": {"match_all": {}}}
+    else:
+        raise Exception('refusing to query every {} product: no filter was given'.format(prod_type))
+    grq_query["version"] = True # return _version so tag updates can be guarded without re-reading
+    if fields:
+        grq_query["_source"] = {"include": fields}
+    return grq_url, grq_query
+
+def get_full_objects(es_objs):
+    '''returns the full documents for the (projected) input objects, in input order, using a single _mget'''
+    docs = [{'_index': x.index, '_type': x.type, '_id': x.id} for x in [as_record(obj) for obj in es_objs]]
+    results = grq.get_client().mget(docs)
+    missing = [x.get('_id') for x in results if not x.get('found', False)]
+    if missing:
+        raise Exception('unable to retrieve full documents for: {}'.format(', '.join(missing)))
     return results
 
-def print_query(prod_type, location=False, starttime=False, endtime=False, full_id_hash=False, track_number=False, orbit_numbers=False, version=False, uid=False, aoi=False):
-    '''print statement describing grq query'''
+def print_query(prod_type, location=False, starttime=False, endtime=False, full_id_hash=False, track_number=False, orbit_numbers=False, version=False, uid=False, aoi=False, created_after=False):
+    '''logs a statement describing grq query at debug level'''
+    if not logger.isEnabledFor(logs.DEBUG):
+        return
     statement = 'Querying for products of type: {}'.format(prod_type)
     if location:
         statement += '\nwith location:     {}'.format(location)
@@ -392,7 +783,9 @@ def print_query(prod_type, location=False, starttime=False, endtime=False, full_
         statement += '\nwith uid:          {}'.format(uid)
     if aoi:
         statement += '\nwith metadata.aoi: {}'.format(aoi)
-    print(statement)
+    if created_after:
+        statement += '\ncreated after:     {}'.format(created_after)
+    logger.debug(statement)
 
 def load_context():
     '''loads the context file into a dict'''
@@ -404,195 +797,24 @@ def load_context():
     except:
         raise Exception('unable to parse _context.json from work directory')
 
-def query_es(grq_url, es_query):
-    '''
-    Runs the query through Elasticsearch, iterates until
-    all results are generated, & returns the compiled result
-    '''
-    print("query_es query: \n{}".format(json.dumps(es_query)))
+def context_flag(ctx, name):
+    '''returns True if the boolean context field is set. submitter params may arrive as strings'''
+    value = ctx.get(name, False)
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
 
-    if 'size' in list(es_query.keys()):
-        iterator_size = es_query['size']
-    else:
-        iterator_size = 10
-        es_query['size'] = iterator_size
-    if 'from' in list(es_query.keys()):
-        from_position = es_query['from']
-    else:
-        from_position = 0
-        es_query['from'] = from_position
-    response = requests.post(grq_url, data=json.dumps(es_query), verify=False)
-    response.raise_for_status()
-    results = json.loads(response.text, encoding='ascii')
-    results_list = results.get('hits', {}).get('hits', [])
-    total_count = results.get('hits', {}).get('total', 0)
-    for i in range(iterator_size, total_count, iterator_size):
-        es_query['from'] = i
-        response = requests.post(grq_url, data=json.dumps(es_query), timeout=60, verify=False)
-        response.raise_for_status()
-        results = json.loads(response.text, encoding='ascii')
-        results_list.extend(results.get('hits', {}).get('hits', []))
-    return results_list
-
-def sort_by_orbit(es_result_list):
-    '''
-    Goes through the objects in the result list, and places them in an dict where key is orbit
-    '''
-    sorted_dict = {}
-    for result in es_result_list:
-        orbit = get_orbit(result)
-        if orbit in list(sorted_dict.keys()):
-            sorted_dict[orbit].append(result)
-        else:
-            sorted_dict[orbit] = [result]
-
-    print("sort_by_orbit : orbits found : {}".format(list(sorted_dict.keys())))
-    return sorted_dict
-
-def sort_by_hash(es_results_list):
-    '''
-    Goes through the objects in the result list, and places them in an dict where key is full_id_hash (or generated version of hash)
-    '''
-    sorted_dict = {}
-    for result in es_results_list:
-        idhash = get_hash(result)
-        if idhash in list(sorted_dict.keys()):
-            sorted_dict.get(idhash, []).append(result)
-        else:
-            sorted_dict[idhash] = [result]
-
-    print("sort_by_hash : hash found : {}".format(list(sorted_dict.keys())))
-    return sorted_dict
-
-def sort_by_track(es_result_list):
-    '''
-    Goes through the objects in the result list, and places them in an dict where key is track
-    '''
-    #print('found {} results'.format(len(es_result_list)))
-    sorted_dict = {}
-    for result in es_result_list:
-        track = get_track(result)
-        if track in list(sorted_dict.keys()):
-            sorted_dict.get(track, []).append(result)
-        else:
-            sorted_dict[track] = [result]
-
-    print("sort_by_track : tracks found : {}".format(list(sorted_dict.keys())))
-    return sorted_dict
-
-def sort_by_aoi(es_result_list):
-    '''
-    Goes through the objects in the result list, and places them in an dict where key is aoi_id
-    '''
-    #print('found {} results'.format(len(es_result_list)))
-    sorted_dict = {}
-    for result in es_result_list:
-        aoi_ids = result.get('_source', {}).get('metadata', {}).get('aoi', False)
-        if not aoi_ids:
-            continue
-
-        if isinstance(aoi_ids, list) or isinstance(aoi_ids, tuple):
-            for aoi_id in aoi_ids:
-                if aoi_id in sorted_dict.keys():
-                    sorted_dict.get(aoi_id, []).append(result)
-                else:
-                    sorted_dict[aoi_id] = [result]
- 
-        else:
-            if aoi_ids in sorted_dict.keys():
-                sorted_dict.get(aoi_ids, []).append(result)
-            else:
-                sorted_dict[aoi_ids] = [result]
-
-    print("sort_by_aoi : aois found : {}".format(sorted_dict.keys()))
-    return sorted_dict
-
-def get_track(es_obj):
-    '''returns the track from the elasticsearch object'''
-    es_ds = es_obj.get('_source', {})
-    #iterate through ds
-    track_met_options = ['track_number', 'track', 'trackNumber', 'track_Number']
-    for tkey in track_met_options:
-        track = es_ds.get(tkey, False)
-        if track:
-            return track
-    #if that doesn't work try metadata
-    es_met = es_ds.get('metadata', {})
-    for tkey in track_met_options:
-        track = es_met.get(tkey, False)
-        if track:
-            return track
-    raise Exception('unable to find track for: {}'.format(es_obj.get('_id', '')))
-
-def get_orbit(es_obj):
-    '''returns the orbit as a string from the elasticsearch object'''
-    es_ds = es_obj.get('_source', {})
-    #iterate through ds
-    options = ['orbit_number', 'orbitNumber', 'orbit']
-    for tkey in options:
-        orbit = es_ds.get(tkey, False)
-        if orbit:
-            return stringify_orbit(orbit)
-    #if that doesn't work try metadata
-    es_met = es_ds.get('metadata', {})
-    for tkey in options:
-        orbit = es_met.get(tkey, False)
-        if orbit:
-            return stringify_orbit(orbit)
-    raise Exception('unable to find orbit for: {}'.format(es_obj.get('_id', '')))
-
-def get_hash(es_obj):
-    '''retrieves the full_id_hash. if it doesn't exists, it
-        attempts to generate one'''
-    full_id_hash = es_obj.get('_source', {}).get('metadata', {}).get('full_id_hash', False)
-    if full_id_hash:
-        return full_id_hash
-    return gen_hash(es_obj)
-
-def gen_hash(es_obj):
-    '''copy of hash used in the enumerator'''
-    met = es_obj.get('_source', {}).get('metadata', {})
-    master_slcs = met.get('master_scenes', met.get('reference_scenes', False))
-    slave_slcs = met.get('slave_scenes', met.get('secondary_scenes', False))
-    master_ids_str = ""
-    slave_ids_str = ""
-    for slc in sorted(master_slcs):
-        if isinstance(slc, tuple) or isinstance(slc, list):
-            slc = slc[0]
-        if master_ids_str == "":
-            master_ids_str = slc
-        else:
-            master_ids_str += " "+slc
-    for slc in sorted(slave_slcs):
-        if isinstance(slc, tuple) or isinstance(slc, list):
-            slc = slc[0]
-        if slave_ids_str == "":
-            slave_ids_str = slc
-        else:
-            slave_ids_str += " "+slc
-    id_hash = hashlib.md5(json.dumps([master_ids_str, slave_ids_str]).encode("utf8")).hexdigest()
-    return id_hash
-
-def sort_duplicates_by_hash(es_results_list):
-    '''
-    iterates through the list of products and removes products with duplicate full_id_hash
-    (using creation time) and returns a dict sorted by full_id_hash.
-    '''
-    sorted_dict = {}
-    for result in es_results_list:
-        idhash = get_hash(result)
-        if idhash in list(sorted_dict.keys()):
-            latest_result = get_most_recent(result, sorted_dict.get(idhash))
-            print('found duplicate gunws: {}, {}'.format(result.get('_source').get('id'), sorted_dict.get(idhash).get('_source').get('id')))
-            sorted_dict[idhash] = latest_result
-        else:
-            sorted_dict[idhash] = result
-    return sorted_dict
+def context_int(ctx, name, default):
+    '''returns the integer context field, or the default when unset. optional submitter params arrive as empty strings'''
+    value = ctx.get(name)
+    if value is None or value is False or str(value).strip() == '':
+        return default
+    return int(value)
 
 def filter_hashes(es_results_list, full_id_hash_list):
     '''
     filters out objects in the es_results_list that don't contain a 
-    full_id_hash from full_id_hash_list. Returns the filtered list.
+    full_id_hash from full_id_hash_list (any container, eg a set or ProductIndex). Returns the filtered list.
     '''
     filtered_list = []
     for es_result in es_results_list:
@@ -601,14 +823,6 @@ def filter_hashes(es_results_list, full_id_hash_list):
             filtered_list.append(es_result)
     return filtered_list
 
-def get_most_recent(obj1, obj2):
-    '''returns the object with the most recent ingest time'''
-    ctime1 = dateutil.parser.parse(obj1.get('_source', {}).get('creation_timestamp', False))
-    ctime2 = dateutil.parser.parse(obj2.get('_source', {}).get('creation_timestamp', False))
-    if ctime1 > ctime2:
-        return obj1
-    return obj2
-
 def resolve_orbit_field(prod_type):
     '''resolves the orbit metadata field by product type'''
     orbit_mapping = {'S1-GUNW-acq-list': 'orbitNumber',
@@ -619,12 +833,6 @@ def resolve_orbit_field(prod_type):
                  'S1-GUNW-MERGED-AOI_TRACK': 'orbit'}
     return orbit_mapping.get(prod_type, False)
 
-def stringify_orbit(orbit_list):
-    '''converts the list into a string'''
-    if len(orbit_list) == 0:
-        raise RuntimeError("Orbit List is EMPTY")
-    return '_'.join([str(x).zfill(3) for x in sorted(orbit_list)])
-
 def get_version(es_obj):
     '''returns the version of the index. Since we are ignoring the subversions, only returns the main version.
     eg, v2.0.1 returns v2.0'''
@@ -633,13 +841,19 @@ def get_version(es_obj):
     return version
 
 if __name__ == '__main__':
+    recording = None
     try:
-        evaluate()
+        job_ctx = load_context()
+        recording = replay.install(job_ctx)
+        profiler.run(evaluate, enabled=profiler.requested(job_ctx))
     except (Exception, SystemExit) as e:
         with open('_alt_error.txt', 'w') as f:
             f.write("%s\n" % str(e))
         with open('_alt_traceback.txt', 'w') as f:
             f.write("%s\n" % traceback.format_exc())
         raise
+    finally:
+        replay.finish(recording)
+        metrics.write()
     sys.exit(0)
 
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+'''
+footprint geometry for AOI_TRACK products: unions GUNW footprints in one vectorized
+operation & returns a valid polygon with clockwise exteriors & counterclockwise holes
+'''
+from __future__ import print_function
+from shapely.geometry import shape, mapping, Polygon, MultiPolygon
+from shapely.geometry.polygon import orient
+from shapely.validation import explain_validity
+try:
+    from shapely import union_all
+    GRID_SUPPORTED = True
+except ImportError: # shapely < 2 has no vectorized union or precision grid
+    from shapely.ops import unary_union as union_all
+    GRID_SUPPORTED = False
+
+GRID_SIZE = None # precision grid (degrees) vertices are snapped to. None keeps full precision
+EXTERIOR_SIGN = -1.0 # orient() sign giving clockwise exterior rings & counterclockwise holes
+
+def footprint(geojsons, grid_size=GRID_SIZE):
+    '''returns the union of the geojson geometries as an oriented geojson dict'''
+    return mapping(union(geojsons, grid_size=grid_size))
+
+def union(geojsons, grid_size=GRID_SIZE):
+    '''unions the geojson geometries into a single valid, oriented (Multi)Polygon'''
+    geoms = [shape(geojson) for geojson in geojsons]
+    if not geoms:
+        raise Exception('no geometries to union')
+    if grid_size and GRID_SUPPORTED:
+        geom = union_all(geoms, grid_size=grid_size)
+    else:
+        geom = union_all(geoms)
+    geom = clean(geom)
+    return orient_rings(geom)
+
+def clean(geom):
+    '''repairs invalid results, drops redundant collinear vertices & anything that is not a polygon'''
+    geom = geom.simplify(0)
+    if not geom.is_valid:
+        geom = geom.buffer(0) # handle self-intersection
+        if not geom.is_valid:
+            raise Exception('footprint is not valid: {}'.format(explain_validity(geom)))
+    if isinstance(geom, (Polygon, MultiPolygon)):
+        return geom
+    polygons = [part for part in getattr(geom, 'geoms', []) if isinstance(part, Polygon)]
+    if not polygons:
+        raise Exception('footprint union has no polygonal area: {}'.format(geom.geom_type))
+    if len(polygons) == 1:
+        return polygons[0]
+    return MultiPolygon(polygons)
+
+def orient_rings(geom):
+    '''orients the exterior ring of every polygon clockwise & holes counterclockwise'''
+    if isinstance(geom, MultiPolygon):
+        return MultiPolygon([orient(polygon, sign=EXTERIOR_SIGN) for polygon in geom.geoms])
+    return orient(geom, sign=EXTERIOR_SIGN)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+'''
+persistent local store of S1-GUNW-GREYLIST products & their full_id_hashes. Lets jobs with a
+persistent cache dir fetch only the greylist products created since the last refresh
+'''
+from __future__ import print_function
+from builtins import object
+import os
+import sqlite3
+import datetime
+import dateutil.parser
+
+CACHE_DIR = os.environ.get('COMPLETENESS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'standard_product_completeness_evaluator'))
+STORE_NAME = 'greylist_products.sqlite'
+FULL_REFRESH_DAYS = 7 # rebuild from scratch periodically
+OVERLAP = datetime.timedelta(hours=1) # re-read window behind last_seen, for products indexed late
+
+class GreylistStore(object):
+    '''sqlite backed set of greylist products, their full_id_hashes & the newest creation_timestamp seen'''
+    def __init__(self, cache_dir=CACHE_DIR):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.path = os.path.join(cache_dir, STORE_NAME)
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS products (id TEXT PRIMARY KEY, idx TEXT, prod_type TEXT, '
+                              'full_id_hash TEXT, creation_timestamp TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def last_seen(self):
+        '''returns the newest creation_timestamp in the store less the overlap window, or False if the
+        store needs a full refresh'''
+        refreshed = self.get_meta('last_full_refresh')
+        if not refreshed:
+            return False
+        age = datetime.datetime.utcnow() - datetime.datetime.strptime(refreshed, '%Y-%m-%dT%H:%M:%S')
+        if age > datetime.timedelta(days=FULL_REFRESH_DAYS):
+            return False
+        last_seen = self.get_meta('last_seen')
+        if not last_seen:
+            return False
+        return (dateutil.parser.parse(last_seen) - OVERLAP).strftime('%Y-%m-%dT%H:%M:%S')
+
+    def update(self, products, full_refresh=False):
+        '''adds the greylist product records. a full refresh replaces the store contents'''
+        rows = [(x.id, x.index, x.type, x.full_id_hash, x.creation_timestamp) for x in products]
+        with self.conn:
+            if full_refresh:
+                self.conn.execute('DELETE FROM products')
+                self.set_meta('last_full_refresh', datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'))
+                self.conn.execute('DELETE FROM meta WHERE key = ?', ('last_seen',))
+            self.conn.executemany('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)', rows)
+            newest = self.conn.execute('SELECT MAX(creation_timestamp) FROM products').fetchone()[0]
+            if newest:
+                self.set_meta('last_seen', newest)
+
+    def keys(self):
+        '''returns the (index, prod_type, id) of every stored greylist product'''
+        return [tuple(row) for row in self.conn.execute('SELECT idx, prod_type, id FROM products')]
+
+    def remove(self, uids):
+        '''removes the products, eg once they are found to be gone from GRQ'''
+        with self.conn:
+            self.conn.executemany('DELETE FROM products WHERE id = ?', [(uid,) for uid in uids])
+
+    def hashes(self):
+        '''returns the set of greylisted full_id_hashes'''
+        return set(row[0] for row in self.conn.execute('SELECT full_id_hash FROM products'))
+
+    def get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+
+'''
+shared GRQ elasticsearch client. all GRQ traffic goes through a single backend, by default a
+pooled keep-alive session where search results are streamed using a scroll cursor.
+Other backends (eg the in-memory backend used for benchmarks) are installed with set_backend.
+When ijson is installed, search pages are decoded incrementally & hits are yielded as
+they are parsed; otherwise each page is decoded whole with orjson (if installed) or json
+'''
+from __future__ import print_function
+from builtins import range
+from builtins import object
+import json
+import zlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from hysds.celery import app
+import logs
+import metrics
+try:
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PAGE_SIZE = 1000 # hits returned per scroll page
+SCROLL_TIMEOUT = '2m' # how long the cluster keeps the cursor alive between pages
+POOL_SIZE = 10 # keep-alive connections held open to GRQ
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+MAX_RETRIES = 3
+GZIP_MIN_BYTES = 1024 # request bodies smaller than this are sent uncompressed
+MSEARCH_BATCH = 50 # searches sent per _msearch request
+
+logger = logs.get_logger('grq')
+
+_client = None
+_client_lock = threading.Lock()
+
+class VersionConflict(Exception):
+    '''raised when a versioned update is rejected because the document has changed'''
+    pass
+
+class Backend(object):
+    '''
+    the operations the evaluator, tagger & product builder perform against GRQ. Search urls are
+    built with url() & passed back in, so a backend is free to choose its own url scheme
+    '''
+    def url(self, path):
+        '''returns the url for the given es path'''
+        raise NotImplementedError()
+
+    def iter_search(self, grq_url, es_query, page_size=PAGE_SIZE):
+        '''yields every hit matching the query'''
+        raise NotImplementedError()
+
+    def msearch(self, searches, page_size=PAGE_SIZE):
+        '''runs the [(index, es_query)] searches & returns a list of hit lists in the same order'''
+        raise NotImplementedError()
+
+    def aggregate(self, index, es_query):
+        '''runs the query's aggregations over the index pattern & returns the aggregations response, without hits'''
+        raise NotImplementedError()
+
+    def mget(self, docs):
+        '''returns the documents for the [{_index, _type, _id, (_source)}] requests, in order'''
+        raise NotImplementedError()
+
+    def bulk(self, actions):
+        '''applies the bulk action & document lines, returning the _bulk response'''
+        raise NotImplementedError()
+
+    def update(self, index, prod_type, uid, doc, version=None):
+        '''partially updates the document. raises VersionConflict if version is given & stale'''
+        raise NotImplementedError()
+
+class GRQClient(Backend):
+    '''pooled HTTP session for GRQ with optional gzip request compression'''
+    def __init__(self, grq_ip, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, gzip_requests=False, stream_json=True):
+        self.grq_ip = grq_ip
+        self.timeout = (connect_timeout, read_timeout)
+        self.gzip_requests = gzip_requests
+        self.stream_json = stream_json and ijson is not None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.verify = False
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+
+    def url(self, path):
+        '''returns the full GRQ url for the given es path'''
+        return '{0}/es/{1}'.format(self.grq_ip, path.lstrip('/'))
+
+    def request(self, method, url, data=None, params=None, stream=False):
+        '''sends the request over the pooled session & raises on http errors'''
+        headers = {}
+        if data is not None and not isinstance(data, (str, bytes)):
+            data = json.dumps(data)
+        if data is not None and self.gzip_requests and len(data) >= GZIP_MIN_BYTES:
+            data = gzip_body(data)
+            headers['Content-Encoding'] = 'gzip'
+        metrics.incr('grq.requests')
+        metrics.incr('grq.bytes_sent', len(data) if data is not None else 0)
+        with metrics.timer('grq.request'):
+            response = self.session.request(method, url, data=data, params=params, headers=headers, timeout=self.timeout, stream=stream)
+        if not stream:
+            metrics.incr('grq.bytes_received', received_bytes(response))
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            response.close()
+            raise
+        return response
+
+    def post(self, url, data=None, params=None, stream=False):
+        '''posts the data to the given url'''
+        return self.request('POST', url, data=data, params=params, stream=stream)
+
+    def delete(self, url, data=None, params=None):
+        '''sends a delete to the given url'''
+        return self.request('DELETE', url, data=data, params=params)
+
+    def iter_search(self, grq_url, es_query, page_size=PAGE_SIZE):
+        '''
+        Runs the query through Elasticsearch, yielding each hit as its page arrives. The first
+        page is a plain search, so results that fit in it never open a scroll cursor. The rest
+        are read with a scroll over the documents not already received. Avoids from/size deep pagination.
+        '''
+        es_query = dict(es_query)
+        es_query.pop('from', None)
+        es_query.setdefault('size', page_size)
+        page = self.search_page(grq_url, es_query, scroll=False)
+        received = []
+        try:
+            for hit in page['hits']:
+                received.append(hit['_id'])
+                yield hit
+        finally:
+            page['close']()
+        if not received or len(received) >= page['total']:
+            return
+        scroll_url = get_scroll_url(grq_url)
+        page = self.search_page(grq_url, exclude_ids(es_query, received))
+        scroll_id = False
+        try:
+            seen = 0
+            while True:
+                count = 0
+                for hit in page['hits']:
+                    count += 1
+                    yield hit
+                scroll_id = page['_scroll_id'] or scroll_id
+                seen += count
+                if not count or seen >= page['total'] or not scroll_id:
+                    break
+                page['close']()
+                page = self.search_page(scroll_url, scroll_id)
+        finally:
+            page['close']()
+            self.clear_scroll(scroll_url, scroll_id or page['_scroll_id'])
+
+    def search_page(self, url, data, scroll=True):
+        '''
+        posts one search or scroll request & returns the page as a dict of _scroll_id, total,
+        hits & close. When streaming, hits is a generator & _scroll_id/total are filled in as
+        the response is parsed, so they are only final once hits has been exhausted. A search
+        posted with scroll=False opens no scroll cursor.
+        '''
+        metrics.incr('grq.pages')
+        params = {'scroll': SCROLL_TIMEOUT} if scroll else None
+        if not self.stream_json:
+            results = decode(self.post(url, data=data, params=params))
+            return {'_scroll_id': results.get('_scroll_id', False), 'total': get_total(results),
+                    'hits': results.get('hits', {}).get('hits', []), 'close': lambda: None}
+        response = self.post(url, data=data, params=params, stream=True)
+        response.raw.decode_content = True
+        closed = []
+        def close():
+            if closed:
+                return
+            closed.append(True)
+            metrics.incr('grq.bytes_received', received_bytes(response))
+            response.close()
+        page = {'_scroll_id': False, 'total': 0, 'close': close}
+        page['hits'] = iter_hits(response.raw, page)
+        return page
+
+    def msearch(self, searches, page_size=PAGE_SIZE):
+        '''
+        runs the [(index, es_query)] searches as batched _msearch requests & returns a list of
+        hit lists in the same order. A search with more hits than fit in one page is completed with a
+        scroll over the documents not already received.
+        '''
+        results = []
+        for i in range(0, len(searches), MSEARCH_BATCH):
+            batch = searches[i:i + MSEARCH_BATCH]
+            lines = []
+            for index, es_query in batch:
+                es_query = dict(es_query)
+                es_query.pop('from', None)
+                es_query.setdefault('size', page_size)
+                lines.append(json.dumps({'index': index}))
+                lines.append(json.dumps(es_query))
+            responses = decode(self.post(self.url('_msearch'), data='\n'.join(lines) + '\n')).get('responses', [])
+            if len(responses) != len(batch):
+                raise Exception('_msearch returned {} responses for {} searches'.format(len(responses), len(batch)))
+            for (index, es_query), response in zip(batch, responses):
+                if response.get('error'):
+                    raise Exception('_msearch failed for index {}: {}'.format(index, response.get('error')))
+                hits = response.get('hits', {}).get('hits', [])
+                if get_total(response) > len(hits):
+                    hits.extend(self.iter_search(self.url('{}/_search'.format(index)), exclude_ids(es_query, [hit['_id'] for hit in hits]), page_size=page_size))
+                results.append(hits)
+        return results
+
+    def aggregate(self, index, es_query):
+        '''runs the query's aggregations over the index pattern in one size 0 search'''
+        es_query = dict(es_query, size=0)
+        es_query.pop('_source', None)
+        es_query.pop('version', None)
+        return decode(self.post(self.url('{}/_search'.format(index)), data=es_query)).get('aggregations', {})
+
+    def mget(self, docs):
+        '''returns the documents for the [{_index, _type, _id, (_source)}] requests using one _mget'''
+        return decode(self.post(self.url('_mget'), data={'docs': docs})).get('docs', [])
+
+    def bulk(self, actions):
+        '''sends the bulk action & document lines as one _bulk request'''
+        lines = [json.dumps(action) for action in actions]
+        return decode(self.post(self.url('_bulk'), data='\n'.join(lines) + '\n'))
+
+    def update(self, index, prod_type, uid, doc, version=None):
+        '''partially updates the document, guarded by version when given'''
+        params = {'version': version} if version else None
+        grq_url = self.url('{0}/{1}/{2}/_update'.format(index, prod_type, uid))
+        try:
+            self.post(grq_url, data={'doc': doc}, params=params)
+        except requests.exceptions.HTTPError as err:
+            if err.response is not None and err.response.status_code == 409:
+                raise VersionConflict('{} has changed since version {}'.format(uid, version))
+            raise
+
+    def clear_scroll(self, scroll_url, scroll_id):
+        '''releases the scroll cursor on the cluster. failures are not fatal'''
+        if not scroll_id:
+            return
+        try:
+            self.delete(scroll_url, data=scroll_id)
+        except requests.exceptions.RequestException as err:
+            logger.warning('failed to clear scroll: %s', err)
+
+def set_backend(backend):
+    '''installs the backend returned by get_client. None restores the default GRQ client'''
+    global _client
+    with _client_lock:
+        _client = backend
+
+def get_client():
+    '''returns the GRQ backend shared by the evaluator, tagger & product builder'''
+    global _client
+    with _client_lock:
+        if _client is None:
+            grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+            _client = GRQClient(grq_ip,
+                                pool_size=int(app.conf.get('GRQ_POOL_SIZE', POOL_SIZE)),
+                                connect_timeout=float(app.conf.get('GRQ_CONNECT_TIMEOUT', CONNECT_TIMEOUT)),
+                                read_timeout=float(app.conf.get('GRQ_READ_TIMEOUT', READ_TIMEOUT)),
+                                gzip_requests=bool(app.conf.get('GRQ_GZIP_REQUESTS', False)),
+                                stream_json=bool(app.conf.get('GRQ_STREAM_JSON', True)))
+        return _client
+
+def iter_es(grq_url, es_query, page_size=PAGE_SIZE):
+    '''streams all hits for the query using the shared client'''
+    return get_client().iter_search(grq_url, es_query, page_size=page_size)
+
+def exclude_ids(es_query, ids):
+    '''returns the query restricted to the documents not among the ids'''
+    es_query = dict(es_query)
+    es_query['query'] = {'bool': {'must': [es_query.get('query', {'match_all': {}})],
+                                  'must_not': [{'ids': {'values': list(ids)}}]}}
+    return es_query
+
+def get_scroll_url(grq_url):
+    '''returns the scroll endpoint for the given GRQ search url'''
+    prefix, sep, _ = grq_url.partition('/es/')
+    if not sep:
+        raise Exception('unable to determine scroll endpoint for: {}'.format(grq_url))
+    return '{}/es/_search/scroll'.format(prefix)
+
+def get_total(results):
+    '''returns the total hit count from a search response'''
+    total_count = results.get('hits', {}).get('total', 0)
+    if isinstance(total_count, dict):
+        return total_count.get('value', 0)
+    return total_count
+
+def decode(response):
+    '''decodes a whole JSON response body, using orjson when it is installed'''
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+def iter_hits(stream, page):
+    '''
+    incrementally parses a search response from the stream, yielding each hit once it has been
+    fully decoded. Only one hit is materialized at a time. _scroll_id & hits.total are stored into page
+    '''
+    builder = None
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if prefix == 'hits.hits.item':
+            if event == 'start_map':
+                builder = ijson.common.ObjectBuilder()
+            builder.event(event, value)
+            if event == 'end_map':
+                yield builder.value
+                builder = None
+        elif builder is not None:
+            builder.event(event, value)
+        elif prefix == '_scroll_id':
+            page['_scroll_id'] = value
+        elif prefix in ('hits.total', 'hits.total.value') and event == 'number':
+            page['total'] = value
+
+def received_bytes(response):
+    '''returns the number of bytes read off the wire for the response (compressed size if gzipped)'''
+    try:
+        return response.raw.tell()
+    except (AttributeError, IOError):
+        return len(response.content)
+
+def gzip_body(data):
+    '''gzip compresses the request body'''
+    if not isinstance(data, bytes):
+        data = data.encode('utf8')
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits 31 writes a gzip container
+    return compressor.compress(data) + compressor.flush()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+'''
+full_id_hash generation shared by the evaluator & product builder. Generated hashes are
+memoized per document (index, id & version) so each document is hashed at most once per run
+'''
+from __future__ import print_function
+import json
+import hashlib
+import threading
+
+MEMO_SIZE = 100000 # generated hashes remembered before the memo is reset
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+def get_hash(es_obj):
+    '''retrieves the full_id_hash. if it doesn't exists, it
+        attempts to generate one'''
+    full_id_hash = es_obj.get('_source', {}).get('metadata', {}).get('full_id_hash', False)
+    if full_id_hash:
+        return full_id_hash
+    return gen_hash(es_obj)
+
+def find_hash(es_obj):
+    '''returns the full_id_hash, generating it if possible, or False if the object has neither hash nor scenes'''
+    met = es_obj.get('_source', {}).get('metadata', {})
+    if met.get('full_id_hash', False):
+        return met.get('full_id_hash')
+    if met.get('master_scenes', met.get('reference_scenes', False)) is False or met.get('slave_scenes', met.get('secondary_scenes', False)) is False:
+        return False
+    return gen_hash(es_obj)
+
+def hash_all(es_results):
+    '''returns the full_id_hash of every object in the result set, in order. objects without a stored
+    hash are hashed once per unique pair of scene strings in the set, so products sharing scenes
+    (eg re-processed gunws) reuse one hash'''
+    hashes = []
+    by_scenes = {}
+    for es_obj in es_results:
+        full_id_hash = es_obj.get('_source', {}).get('metadata', {}).get('full_id_hash', False)
+        if not full_id_hash:
+            full_id_hash = gen_hash(es_obj, by_scenes)
+        hashes.append(full_id_hash)
+    return hashes
+
+def gen_hash(es_obj, by_scenes=None):
+    '''copy of hash used in the enumerator, memoized per document. by_scenes, if given, maps the
+    scene strings already hashed to their hash'''
+    key = memo_key(es_obj)
+    if key is not None:
+        id_hash = _memo.get(key)
+        if id_hash is not None:
+            return id_hash
+    scenes = scene_strings(es_obj)
+    id_hash = by_scenes.get(scenes) if by_scenes is not None else None
+    if id_hash is None:
+        id_hash = hash_scenes(*scenes)
+        if by_scenes is not None:
+            by_scenes[scenes] = id_hash
+    if key is not None:
+        with _memo_lock:
+            if len(_memo) >= MEMO_SIZE:
+                _memo.clear()
+            _memo[key] = id_hash
+    return id_hash
+
+def scene_strings(es_obj):
+    '''returns the (master, slave) scene id strings the full_id_hash is generated from'''
+    met = es_obj.get('_source', {}).get('metadata', {})
+    master_slcs = met.get('master_scenes', met.get('reference_scenes', False))
+    slave_slcs = met.get('slave_scenes', met.get('secondary_scenes', False))
+    if master_slcs is False or slave_slcs is False:
+        raise Exception('unable to generate full_id_hash for: {}, it has no scene lists'.format(es_obj.get('_id', False)))
+    master_ids_str = ' '.join([scene_id(slc) for slc in sorted(master_slcs)])
+    slave_ids_str = ' '.join([scene_id(slc) for slc in sorted(slave_slcs)])
+    return master_ids_str, slave_ids_str
+
+def hash_scenes(master_ids_str, slave_ids_str):
+    '''returns the full_id_hash of the scene id strings'''
+    return hashlib.md5(json.dumps([master_ids_str, slave_ids_str]).encode("utf8")).hexdigest()
+
+def scene_id(slc):
+    '''scenes may be stored as ids or as (id, ...) pairs'''
+    if isinstance(slc, tuple) or isinstance(slc, list):
+        return slc[0]
+    return slc
+
+def memo_key(es_obj):
+    '''documents are identified by index, id & version. returns None if the object has no id'''
+    uid = es_obj.get('_id', False)
+    if not uid:
+        return None
+    return (es_obj.get('_index'), uid, es_obj.get('_version'))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+'''
+persistent local cache of GUNW & GUNW-MERGED feeds. Per (product type, track, orbit key, version)
+it holds the products seen so far, so a job only fetches the products created since the ledger
+last saw that track & orbit. Completeness is still decided by the evaluator from the acq-lists;
+the full_id_hashes they expect per (aoi, track, orbit key) are recorded for the missing command
+only. The ledger can be exported to & imported from newline delimited json.
+'''
+from __future__ import print_function
+from builtins import object
+import os
+import sys
+import json
+import sqlite3
+import datetime
+import threading
+import dateutil.parser
+from greylist_store import CACHE_DIR, OVERLAP
+from products import Product
+
+LEDGER_NAME = 'completeness_ledger.sqlite'
+EXPORT_FORMAT = 1
+FULL_REFRESH_DAYS = 7 # refetch each feed from scratch periodically so removed products drop out
+TABLES = {'expected': ['aoi', 'track', 'orbit', 'full_id_hash'],
+          'products': ['prod_type', 'track', 'orbit', 'version', 'id', 'idx', 'full_id_hash', 'creation_timestamp',
+                       'doc_version', 'tags', 'orbit_numbers', 'aoi'],
+          'feeds': ['prod_type', 'track', 'orbit', 'version', 'last_seen', 'refreshed']}
+
+class CompletenessLedger(object):
+    '''sqlite backed ledger of expected & satisfied full_id_hashes'''
+    def __init__(self, cache_dir=CACHE_DIR):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.path = os.path.join(cache_dir, LEDGER_NAME)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS expected (aoi TEXT, track TEXT, orbit TEXT, full_id_hash TEXT, '
+                              'PRIMARY KEY (aoi, track, orbit, full_id_hash))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS products (prod_type TEXT, track TEXT, orbit TEXT, version TEXT, id TEXT, '
+                              'idx TEXT, full_id_hash TEXT, creation_timestamp TEXT, doc_version INTEGER, tags TEXT, '
+                              'orbit_numbers TEXT, aoi TEXT, PRIMARY KEY (prod_type, id))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS products_feed ON products (prod_type, track, orbit, version)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS feeds (prod_type TEXT, track TEXT, orbit TEXT, version TEXT, '
+                              'last_seen TEXT, refreshed TEXT, PRIMARY KEY (prod_type, track, orbit, version))')
+
+    def set_expected(self, aoi, track, orbit, hashes):
+        '''replaces the full_id_hashes expected over the aoi along the track & orbit'''
+        key = (str(aoi), str(track), str(orbit))
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM expected WHERE aoi = ? AND track = ? AND orbit = ?', key)
+            self.conn.executemany('INSERT OR REPLACE INTO expected VALUES (?, ?, ?, ?)', [key + (hsh,) for hsh in set(hashes)])
+
+    def expected(self, aoi, track, orbit):
+        '''returns the set of full_id_hashes expected over the aoi along the track & orbit'''
+        with self.lock:
+            rows = self.conn.execute('SELECT full_id_hash FROM expected WHERE aoi = ? AND track = ? AND orbit = ?',
+                                     (str(aoi), str(track), str(orbit)))
+            return set(row[0] for row in rows)
+
+    def satisfied(self, prod_type, track, orbit):
+        '''returns the set of full_id_hashes of the products of the type seen along the track & orbit'''
+        with self.lock:
+            rows = self.conn.execute('SELECT full_id_hash FROM products WHERE prod_type = ? AND track = ? AND orbit = ?',
+                                     (prod_type, str(track), str(orbit)))
+            return set(row[0] for row in rows)
+
+    def missing(self, aoi, track, orbit, prod_type):
+        '''returns the expected full_id_hashes with no product of the type yet'''
+        return self.expected(aoi, track, orbit) - self.satisfied(prod_type, track, orbit)
+
+    def last_seen(self, prod_type, track, orbit, version):
+        '''returns the creation_timestamp to fetch the feed's products from (less the overlap window),
+        or False if the feed has not been seen or is due a full refresh'''
+        with self.lock:
+            row = self.conn.execute('SELECT last_seen, refreshed FROM feeds WHERE prod_type = ? AND track = ? AND orbit = ? AND version = ?',
+                                    (prod_type, str(track), str(orbit), str(version))).fetchone()
+        if not row or not row[0] or not row[1]:
+            return False
+        age = datetime.datetime.utcnow() - datetime.datetime.strptime(row[1], '%Y-%m-%dT%H:%M:%S')
+        if age > datetime.timedelta(days=FULL_REFRESH_DAYS):
+            return False
+        return (dateutil.parser.parse(row[0]) - OVERLAP).strftime('%Y-%m-%dT%H:%M:%S')
+
+    def update_products(self, prod_type, track, orbit, version, products, full_refresh=False):
+        '''adds the product records to the feed. a full refresh replaces the feed's products'''
+        feed = (prod_type, str(track), str(orbit), str(version))
+        rows = [feed + (x.id, x.index, x.full_id_hash, x.creation_timestamp, x.doc_version, json.dumps(x.tags),
+                        json.dumps(x.orbit_numbers), json.dumps(x.aoi)) for x in products]
+        with self.lock, self.conn:
+            if full_refresh:
+                self.conn.execute('DELETE FROM products WHERE prod_type = ? AND track = ? AND orbit = ? AND version = ?', feed)
+            self.conn.executemany('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            newest = self.conn.execute('SELECT MAX(creation_timestamp) FROM products WHERE prod_type = ? AND track = ? AND orbit = ? AND version = ?',
+                                       feed).fetchone()[0]
+            refreshed = None
+            if not full_refresh:
+                row = self.conn.execute('SELECT refreshed FROM feeds WHERE prod_type = ? AND track = ? AND orbit = ? AND version = ?', feed).fetchone()
+                refreshed = row[0] if row else None
+            if full_refresh or not refreshed:
+                refreshed = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+            self.conn.execute('INSERT OR REPLACE INTO feeds VALUES (?, ?, ?, ?, ?, ?)', feed + (newest, refreshed))
+
+    def remove_products(self, prod_type, uids):
+        '''removes the products of the type, eg once they are found to be gone from GRQ'''
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM products WHERE prod_type = ? AND id = ?', [(prod_type, uid) for uid in uids])
+
+    def products(self, prod_type, track, orbit, version):
+        '''returns the feed's products as product records'''
+        with self.lock:
+            rows = self.conn.execute('SELECT id, idx, full_id_hash, creation_timestamp, doc_version, tags, orbit_numbers, aoi, track FROM products '
+                                     'WHERE prod_type = ? AND track = ? AND orbit = ? AND version = ? ORDER BY creation_timestamp',
+                                     (prod_type, str(track), str(orbit), str(version))).fetchall()
+        return [Product(uid, idx, prod_type, doc_version=doc_version, full_id_hash=full_id_hash, track=as_track(track_key),
+                        orbit=orbit, orbit_numbers=json.loads(orbit_numbers), creation_timestamp=creation_timestamp,
+                        tags=json.loads(tags), aoi=json.loads(aoi))
+                for uid, idx, full_id_hash, creation_timestamp, doc_version, tags, orbit_numbers, aoi, track_key in rows]
+
+    def export(self, fout):
+        '''writes every ledger row as newline delimited json. returns the number of rows written'''
+        count = 0
+        fout.write(json.dumps({'format': EXPORT_FORMAT}) + '\n')
+        with self.lock:
+            for table, columns in TABLES.items():
+                for row in self.conn.execute('SELECT {} FROM {}'.format(', '.join(columns), table)):
+                    fout.write(json.dumps({'table': table, 'row': dict(zip(columns, row))}) + '\n')
+                    count += 1
+        return count
+
+    def import_rows(self, fin):
+        '''merges rows written by export into the ledger. returns the number of rows imported'''
+        header = json.loads(fin.readline())
+        if header.get('format') != EXPORT_FORMAT:
+            raise Exception('unsupported ledger export format: {}'.format(header.get('format')))
+        count = 0
+        with self.lock, self.conn:
+            for line in fin:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                columns = TABLES[entry['table']]
+                self.conn.execute('INSERT OR REPLACE INTO {} VALUES ({})'.format(entry['table'], ', '.join(['?'] * len(columns))),
+                                  [entry['row'].get(column) for column in columns])
+                count += 1
+        return count
+
+    def close(self):
+        self.conn.close()
+
+def as_track(track_key):
+    '''tracks are stored as text; returns numeric tracks as ints'''
+    try:
+        return int(track_key)
+    except ValueError:
+        return track_key
+
+def main():
+    '''python ledger.py export <file> | import <file> | missing <aoi> <track> <orbit> <prod_type>'''
+    if len(sys.argv) < 3 or sys.argv[1] not in ('export', 'import', 'missing'):
+        print(main.__doc__)
+        return 1
+    ledger = CompletenessLedger(os.environ.get('COMPLETENESS_CACHE_DIR', CACHE_DIR))
+    try:
+        if sys.argv[1] == 'export':
+            with open(sys.argv[2], 'w') as fout:
+                print('exported {} rows'.format(ledger.export(fout)))
+        elif sys.argv[1] == 'import':
+            with open(sys.argv[2], 'r') as fin:
+                print('imported {} rows'.format(ledger.import_rows(fin)))
+        else:
+            for hsh in sorted(ledger.missing(*sys.argv[2:6])):
+                print(hsh)
+    finally:
+        ledger.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
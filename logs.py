@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+'''
+level-gated loggers for the evaluator subsystems. Messages use lazy %-style arguments so
+per-item detail costs nothing unless its level is enabled. The level defaults to INFO &
+can be set with the COMPLETENESS_LOG_LEVEL environment variable or the log_level context field
+'''
+from __future__ import print_function
+import os
+import sys
+import logging
+from logging import DEBUG, INFO, WARNING, ERROR
+
+ROOT_LOGGER = 'completeness'
+LOG_LEVEL = os.environ.get('COMPLETENESS_LOG_LEVEL', 'INFO')
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+class StdoutHandler(logging.StreamHandler):
+    '''writes to whatever sys.stdout is when the record is emitted, so per-thread output capture still applies'''
+    def __init__(self):
+        logging.StreamHandler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+def configure(level=LOG_LEVEL):
+    '''attaches the stdout handler to the root evaluator logger (once) & sets its level'''
+    root = logging.getLogger(ROOT_LOGGER)
+    if not any(isinstance(handler, StdoutHandler) for handler in root.handlers):
+        handler = StdoutHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        root.addHandler(handler)
+        root.propagate = False
+    set_level(level)
+    return root
+
+def set_level(level):
+    '''sets the level of every evaluator logger. accepts a level name or number'''
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+    logging.getLogger(ROOT_LOGGER).setLevel(level)
+
+def get_logger(subsystem):
+    '''returns the logger for the given subsystem, eg get_logger('tagger')'''
+    return logging.getLogger('{}.{}'.format(ROOT_LOGGER, subsystem))
+
+configure()
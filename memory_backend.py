@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+
+'''
+in-memory GRQ backend for offline benchmarking. Holds documents in python dicts & evaluates
+the subset of the elasticsearch query DSL the evaluator uses: filtered, bool, term(s), match,
+match_phrase, range, geo_shape, ids & match_all, and terms aggregations. Index patterns may use wildcards.
+Documents are indexed as they are added: term postings of every field & the parsed geometries. Token
+postings (derived from the distinct terms) & an STRtree per geo_shape field are built on first use. Queries are narrowed to candidate documents
+through them & only the candidates are checked in full, so serving a query does not scan the corpus.
+'''
+from __future__ import print_function
+from builtins import str
+import re
+import json
+import copy
+import time
+import numbers
+import fnmatch
+import threading
+from collections import OrderedDict
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+import grq
+
+URL_PREFIX = 'memory://grq/es/'
+
+class MemoryBackend(grq.Backend):
+    '''GRQ backend serving queries from documents held in memory'''
+    def __init__(self):
+        self.indices = OrderedDict() # index -> OrderedDict(id -> stored document)
+        self.shapes = {} # (index, id) -> {field: parsed geometry}
+        self.query_shapes = {} # geojson string -> parsed query geometry
+        self.order = {} # (index, id) -> (index position, insertion sequence), the order hits are returned in
+        self.by_id = {} # id -> set of (index, id)
+        self.postings = {} # field -> {value: set of (index, id)}
+        self.unhashable = {} # field -> set of (index, id) with values that are neither hashable nor objects, eg nested lists
+        self.token_postings = {} # field -> {analyzed term: set of (index, id)}, derived from the postings on first use
+        self.geoms = {} # field -> set of (index, id) with a geometry in the field
+        self.trees = {} # geo_shape field -> (STRtree, [geometry], [(index, id)]), built on first use
+        self.seconds = 0.0 # time spent serving requests, so callers can tell backend time from their own
+        self.lock = threading.RLock()
+
+    def index(self, index, prod_type, uid, source, version=1):
+        '''adds (or replaces) a document'''
+        with self.lock:
+            key = (index, uid)
+            docs = self.indices.setdefault(index, OrderedDict())
+            if uid in docs:
+                self.unindex(docs[uid])
+            else:
+                self.order[key] = (list(self.indices.keys()).index(index), len(self.order))
+                self.by_id.setdefault(uid, set()).add(key)
+            docs[uid] = {'_index': index, '_type': prod_type, '_id': uid, '_version': version, '_source': source}
+            self.reindex(docs[uid])
+
+    def load(self, docs):
+        '''adds the {_index, _type, _id, _source} documents. returns the number loaded'''
+        count = 0
+        for doc in docs:
+            self.index(doc['_index'], doc.get('_type'), doc['_id'], doc['_source'], version=doc.get('_version', 1))
+            count += 1
+        return count
+
+    def load_ndjson(self, path):
+        '''loads documents from a newline delimited json file, one document per line'''
+        with open(path, 'r') as fin:
+            return self.load(json.loads(line) for line in fin if line.strip())
+
+    def __len__(self):
+        return sum(len(docs) for docs in self.indices.values())
+
+    def url(self, path):
+        return URL_PREFIX + path.lstrip('/')
+
+    def iter_search(self, grq_url, es_query, page_size=grq.PAGE_SIZE):
+        index, prod_type = parse_search_url(grq_url)
+        for hit in self.search(index, es_query, prod_type=prod_type):
+            yield hit
+
+    def msearch(self, searches, page_size=grq.PAGE_SIZE):
+        return [self.search(index, es_query) for index, es_query in searches]
+
+    def search(self, index, es_query, prod_type=None):
+        '''returns every hit matching the query in the indices matching the index pattern'''
+        includes = es_query.get('_source', None)
+        if isinstance(includes, dict):
+            includes = includes.get('include', includes.get('includes'))
+        with self.lock:
+            start = time.time()
+            hits = [make_hit(doc, includes, es_query.get('version', False))
+                    for doc in self.matching_docs(index, es_query.get('query', {'match_all': {}}), prod_type)]
+            self.seconds += time.time() - start
+        return hits
+
+    def aggregate(self, index, es_query):
+        with self.lock:
+            start = time.time()
+            docs = self.matching_docs(index, es_query.get('query', {'match_all': {}}))
+            results = aggregate(es_query.get('aggs', es_query.get('aggregations', {})), docs)
+            self.seconds += time.time() - start
+        return results
+
+    def matching_docs(self, index, query, prod_type=None):
+        '''returns the stored documents matching the query in the indices matching the pattern, in index order'''
+        keys = self.candidates(query)
+        if keys is None:
+            docs = self.iter_docs(index)
+        else:
+            patterns = index.split(',')
+            names = set(name for name in self.indices if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns))
+            docs = [self.indices[key[0]][key[1]] for key in sorted((key for key in keys if key[0] in names), key=self.order.get)]
+        return [doc for doc in docs if (not prod_type or doc['_type'] == prod_type) and matches(query, doc, self)]
+
+    def iter_docs(self, index):
+        '''yields the stored documents of every index matching the (comma separated, wildcard) pattern'''
+        patterns = index.split(',')
+        for name, docs in self.indices.items():
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                for doc in docs.values():
+                    yield doc
+
+    def get_doc(self, index, uid):
+        '''returns the stored document, or None'''
+        return self.indices.get(index, {}).get(uid)
+
+    def mget(self, docs):
+        results = []
+        with self.lock:
+            start = time.time()
+            for request in docs:
+                doc = self.get_doc(request.get('_index'), request.get('_id'))
+                if doc is None:
+                    results.append({'_index': request.get('_index'), '_type': request.get('_type'), '_id': request.get('_id'), 'found': False})
+                    continue
+                hit = make_hit(doc, request.get('_source', None), True)
+                hit['found'] = True
+                results.append(hit)
+            self.seconds += time.time() - start
+        return results
+
+    def bulk(self, actions):
+        items = []
+        actions = list(actions)
+        with self.lock:
+            start = time.time()
+            for i in range(0, len(actions), 2):
+                op, action = list(actions[i].items())[0]
+                body = actions[i + 1]
+                if op != 'update':
+                    raise Exception('unsupported bulk operation: {}'.format(op))
+                try:
+                    version = self.apply_update(action['_index'], action['_id'], body.get('doc', {}), action.get('_version'))
+                    items.append({op: {'_index': action['_index'], '_id': action['_id'], 'status': 200, '_version': version}})
+                except grq.VersionConflict as err:
+                    items.append({op: {'_index': action['_index'], '_id': action['_id'], 'status': 409, 'error': str(err)}})
+                except KeyError as err:
+                    items.append({op: {'_index': action['_index'], '_id': action['_id'], 'status': 404, 'error': str(err)}})
+            self.seconds += time.time() - start
+        return {'errors': any(item[op]['status'] >= 300 for item in items for op in item), 'items': items}
+
+    def update(self, index, prod_type, uid, doc, version=None):
+        with self.lock:
+            self.apply_update(index, uid, doc, version)
+
+    def apply_update(self, index, uid, doc, version=None):
+        '''merges the partial doc into the stored document & bumps its version. returns the new version'''
+        stored = self.get_doc(index, uid)
+        if stored is None:
+            raise KeyError('document not found: {}/{}'.format(index, uid))
+        if version and version != stored['_version']:
+            raise grq.VersionConflict('{} has changed since version {}'.format(uid, version))
+        self.unindex(stored, changed=doc)
+        merge(stored['_source'], doc)
+        stored['_version'] += 1
+        self.reindex(stored, changed=doc)
+        return stored['_version']
+
+    def candidates(self, query):
+        '''
+        returns the set of (index, id) that may match the query, or None if the query cannot be
+        narrowed. Every matching document is a candidate; candidates are then checked in full
+        '''
+        if not query:
+            return None
+        kind, clause = list(query.items())[0]
+        if kind == 'filtered':
+            return intersect([self.candidates(clause.get('query')), self.candidates(clause.get('filter'))])
+        if kind == 'bool':
+            narrowed = intersect([self.candidates(q) for q in as_list(clause.get('must')) + as_list(clause.get('filter'))])
+            should = as_list(clause.get('should'))
+            if should and not (clause.get('must') or clause.get('filter')):
+                options = [self.candidates(q) for q in should]
+                if all(keys is not None for keys in options):
+                    return set().union(*options)
+            return narrowed
+        if kind == 'ids':
+            return self.id_keys(clause.get('values', []))
+        if kind in ('term', 'terms'):
+            field, wanted = field_value(clause)
+            if kind == 'term':
+                wanted = [wanted.get('value') if isinstance(wanted, dict) else wanted]
+            if field == '_id':
+                return self.id_keys(wanted)
+            if field in ('_type', '_index'):
+                return None
+            postings = self.get_postings(field)
+            return set().union(*[postings.get(value, ()) for value in wanted if is_hashable(value)])
+        if kind in ('match', 'match_phrase'):
+            field, value = field_value(clause)
+            if isinstance(value, dict):
+                value = value.get('query')
+            if field == '_id':
+                return self.id_keys([value])
+            if field.endswith('.raw'):
+                return set(self.get_postings(field).get(value, ())) if is_hashable(value) else set()
+            postings = self.get_token_postings(field)
+            phrased = intersect([set(postings.get(tok, ())) for tok in tokens(value)]) or set()
+            return phrased | self.unhashable.get(field, set())
+        if kind == 'geo_shape':
+            field, spec = field_value(clause)
+            if spec.get('relation', 'intersects') == 'disjoint':
+                return None
+            tree, geoms, keys = self.get_tree(field)
+            if tree is None:
+                return set()
+            return set(keys[i] for i in tree_query(tree, geoms, self.get_query_shape(spec['shape'])))
+        return None
+
+    def id_keys(self, uids):
+        '''returns the (index, id) of the documents with any of the ids'''
+        return set().union(*[self.by_id.get(uid, ()) for uid in uids if is_hashable(uid)])
+
+    def get_postings(self, field):
+        '''returns the {value: set of (index, id)} postings of the field's exact values'''
+        if field.endswith('.raw'):
+            field = field[:-4]
+        return self.postings.get(field, {})
+
+    def get_token_postings(self, field):
+        '''returns the {analyzed term: set of (index, id)} postings of the field, deriving them from
+        its distinct values on first use'''
+        postings = self.token_postings.get(field)
+        if postings is None:
+            postings = self.token_postings[field] = {}
+            for value, keys in self.get_postings(field).items():
+                for tok in tokens(value):
+                    postings.setdefault(tok, set()).update(keys)
+        return postings
+
+    def reindex(self, doc, changed=None):
+        '''adds the document's fields to the postings & its geometries to the geo_shape fields. changed limits
+        this to the fields under the top level keys of a partial update'''
+        key = (doc['_index'], doc['_id'])
+        shapes = self.shapes.setdefault(key, {})
+        for field, value in iter_fields(doc['_source'], changed):
+            if isinstance(value, dict):
+                if 'type' in value and 'coordinates' in value and field not in shapes:
+                    shapes[field] = shape(value)
+                    self.geoms.setdefault(field, set()).add(key)
+                    self.trees.pop(field, None)
+            elif is_hashable(value):
+                self.postings.setdefault(field, {}).setdefault(value, set()).add(key)
+                self.token_postings.pop(field, None)
+            else:
+                self.unhashable.setdefault(field, set()).add(key)
+
+    def unindex(self, doc, changed=None):
+        '''removes the document's fields from the postings & its geometries from the geo_shape fields'''
+        key = (doc['_index'], doc['_id'])
+        shapes = self.shapes.get(key, {})
+        for field, value in iter_fields(doc['_source'], changed):
+            if isinstance(value, dict):
+                if shapes.pop(field, None) is not None:
+                    self.geoms.get(field, set()).discard(key)
+                    self.trees.pop(field, None)
+            elif is_hashable(value):
+                self.postings.get(field, {}).get(value, set()).discard(key)
+                self.token_postings.pop(field, None)
+            else:
+                self.unhashable.get(field, set()).discard(key)
+
+    def get_tree(self, field):
+        '''returns (STRtree, [geometry], [(index, id)]) over the geometries of the field, building it
+        on first use. the tree is None if no document has the field'''
+        if field not in self.trees:
+            keys = sorted(self.geoms.get(field, ()), key=self.order.get)
+            geoms = [self.shapes[key][field] for key in keys]
+            self.trees[field] = (STRtree(geoms) if geoms else None, geoms, keys)
+        return self.trees[field]
+
+    def get_shape(self, doc, field):
+        '''returns the geometry of the document field, parsed when the document was indexed'''
+        return self.shapes.get((doc['_index'], doc['_id']), {}).get(field)
+
+    def get_query_shape(self, geojson):
+        '''returns the parsed query geometry, parsing each distinct shape once'''
+        key = json.dumps(geojson, sort_keys=True)
+        geom = self.query_shapes.get(key)
+        if geom is None:
+            geom = self.query_shapes[key] = shape(geojson)
+        return geom
+
+def intersect(key_sets):
+    '''intersects the candidate sets, ignoring those that could not be narrowed (None)'''
+    narrowed = [keys for keys in key_sets if keys is not None]
+    if not narrowed:
+        return None
+    narrowed.sort(key=len)
+    return set(narrowed[0]).intersection(*narrowed[1:])
+
+def tree_query(tree, geoms, geom):
+    '''returns the positions in geoms of the tree geometries whose envelopes intersect the geometry.
+    shapely 2 returns positions, older versions the geometries themselves'''
+    found = tree.query(geom)
+    if len(found) and not isinstance(found[0], numbers.Integral):
+        positions = dict((id(x), i) for i, x in enumerate(geoms))
+        return [positions[id(x)] for x in found]
+    return [int(i) for i in found]
+
+def is_hashable(value):
+    '''lists & dicts (eg geojson) cannot be postings keys'''
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+def iter_fields(source, changed=None, path=''):
+    '''yields (dotted field, value) for every value get_values returns for the field, from the top level
+    keys in changed only if given'''
+    for key, child in source.items():
+        if changed is not None and key not in changed:
+            continue
+        field = path + key
+        for value in (child if isinstance(child, list) else [child]):
+            yield field, value
+            if isinstance(value, dict):
+                for item in iter_fields(value, path=field + '.'):
+                    yield item
+
+def parse_search_url(grq_url):
+    '''returns (index pattern, type or None) from a search url'''
+    path = grq_url.partition('/es/')[2]
+    parts = [part for part in path.split('/') if part and part != '_search']
+    if not parts:
+        return '*', None
+    return parts[0], parts[1] if len(parts) > 1 else None
+
+def make_hit(doc, includes=None, version=False):
+    '''returns the search hit for the stored document, projecting _source onto the include paths'''
+    hit = {'_index': doc['_index'], '_type': doc['_type'], '_id': doc['_id'], '_score': 1.0}
+    if version:
+        hit['_version'] = doc['_version']
+    if includes is None or includes is True:
+        hit['_source'] = copy.deepcopy(doc['_source'])
+    else:
+        hit['_source'] = project(doc['_source'], includes)
+    return hit
+
+def project(source, includes):
+    '''returns a copy of the source holding only the dotted include paths'''
+    if isinstance(includes, str):
+        includes = [includes]
+    projected = {}
+    for path in includes:
+        keys = path.split('.')
+        value = source
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = projected
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = copy.deepcopy(value)
+    return projected
+
+def merge(target, doc):
+    '''recursively merges the partial document into the target, as an es partial update does'''
+    for key, value in doc.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+def get_values(doc, field):
+    '''returns the list of values at the dotted field path. the .raw suffix of not_analyzed sub-fields is ignored'''
+    if field in ('_id', '_type', '_index'):
+        return [doc[field]]
+    if field.endswith('.raw'):
+        field = field[:-4]
+    values = [doc['_source']]
+    for key in field.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict) and key in value:
+                child = value[key]
+                found.extend(child if isinstance(child, list) else [child])
+        values = found
+    return values
+
+def aggregate(aggs, docs):
+    '''evaluates the terms aggregations (& their sub-aggregations) over the documents'''
+    results = {}
+    for name, spec in aggs.items():
+        if 'terms' not in spec:
+            raise Exception('unsupported aggregation for the memory backend: {}'.format(', '.join(spec.keys())))
+        buckets = OrderedDict()
+        for doc in docs:
+            for value in OrderedDict.fromkeys(get_values(doc, spec['terms']['field'])):
+                buckets.setdefault(value, []).append(doc)
+        ordered = sorted(buckets.items(), key=lambda item: -len(item[1]))
+        size = spec['terms'].get('size', 10)
+        if size:
+            ordered = ordered[:size]
+        results[name] = {'buckets': []}
+        for key, bucket_docs in ordered:
+            bucket = {'key': key, 'doc_count': len(bucket_docs)}
+            bucket.update(aggregate(spec.get('aggs', spec.get('aggregations', {})), bucket_docs))
+            results[name]['buckets'].append(bucket)
+    return results
+
+def tokens(value):
+    '''splits the value into lowercase alphanumeric terms, approximating the standard analyzer'''
+    return [tok for tok in re.split(r'[^0-9a-z]+', str(value).lower()) if tok]
+
+def phrase_matches(phrase, value):
+    '''returns True if the phrase's terms appear consecutively in the value's terms'''
+    wanted = tokens(phrase)
+    have = tokens(value)
+    if not wanted:
+        return False
+    for i in range(len(have) - len(wanted) + 1):
+        if have[i:i + len(wanted)] == wanted:
+            return True
+    return False
+
+def in_range(value, bounds):
+    '''returns True if the value lies within the range bounds (from/to are inclusive by default)'''
+    lower = bounds.get('gte', bounds.get('from'))
+    upper = bounds.get('lte', bounds.get('to'))
+    include_lower = 'gt' not in bounds and bounds.get('include_lower', True)
+    include_upper = 'lt' not in bounds and bounds.get('include_upper', True)
+    lower = bounds.get('gt', lower)
+    upper = bounds.get('lt', upper)
+    try:
+        if lower is not None and (value < lower or (value == lower and not include_lower)):
+            return False
+        if upper is not None and (value > upper or (value == upper and not include_upper)):
+            return False
+    except TypeError:
+        return False
+    return True
+
+def as_list(clauses):
+    '''bool clauses may be a single query or a list'''
+    if clauses is None:
+        return []
+    if isinstance(clauses, dict):
+        return [clauses]
+    return clauses
+
+def field_value(clause):
+    '''returns the (field, value) of a single-field query clause'''
+    field, value = list(clause.items())[0]
+    return field, value
+
+def matches(query, doc, backend):
+    '''evaluates the es query against the stored document'''
+    if not query:
+        return True
+    kind, clause = list(query.items())[0]
+    if kind == 'match_all':
+        return True
+    if kind == 'filtered':
+        return matches(clause.get('query'), doc, backend) and matches(clause.get('filter'), doc, backend)
+    if kind == 'bool':
+        if not all(matches(q, doc, backend) for q in as_list(clause.get('must')) + as_list(clause.get('filter'))):
+            return False
+        if any(matches(q, doc, backend) for q in as_list(clause.get('must_not'))):
+            return False
+        should = as_list(clause.get('should'))
+        if should and not (clause.get('must') or clause.get('filter')):
+            return any(matches(q, doc, backend) for q in should)
+        return True
+    if kind == 'ids':
+        return doc['_id'] in clause.get('values', [])
+    if kind == 'term':
+        field, value = field_value(clause)
+        if isinstance(value, dict):
+            value = value.get('value')
+        return value in get_values(doc, field)
+    if kind == 'terms':
+        field, wanted = field_value(clause)
+        return any(value in wanted for value in get_values(doc, field))
+    if kind in ('match', 'match_phrase'):
+        field, value = field_value(clause)
+        if isinstance(value, dict):
+            value = value.get('query')
+        if field == '_id':
+            return doc['_id'] == value
+        if field.endswith('.raw'):
+            # not_analyzed sub-fields only match the exact value
+            return value in get_values(doc, field)
+        return any(phrase_matches(value, have) for have in get_values(doc, field))
+    if kind == 'range':
+        field, bounds = field_value(clause)
+        return any(in_range(value, bounds) for value in get_values(doc, field))
+    if kind == 'geo_shape':
+        field, spec = field_value(clause)
+        geom = backend.get_shape(doc, field)
+        if geom is None:
+            return False
+        query_shape = backend.get_query_shape(spec['shape'])
+        relation = spec.get('relation', 'intersects')
+        if relation == 'within':
+            return geom.within(query_shape)
+        if relation == 'disjoint':
+            return geom.disjoint(query_shape)
+        return geom.intersects(query_shape)
+    raise Exception('unsupported query clause for the memory backend: {}'.format(kind))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+'''
+process-wide counters & latency histograms for an evaluation run, written out as a
+machine-readable _metrics.json artifact when the job exits
+'''
+from __future__ import print_function
+from builtins import object
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+METRICS_FILE = '_metrics.json'
+# upper bounds (seconds) of the latency histogram buckets. the last bucket is unbounded
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+class Histogram(object):
+    '''fixed-bucket latency histogram'''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        '''records one observation'''
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def to_dict(self):
+        '''returns the histogram as a json serializable dict'''
+        bounds = [str(x) for x in self.buckets] + ['+Inf']
+        return {'count': self.count, 'sum': self.total, 'min': self.min, 'max': self.max,
+                'buckets': dict(zip(bounds, self.counts))}
+
+class Registry(object):
+    '''thread-safe collection of named counters & histograms'''
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        '''adds value to the named counter'''
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        '''records a latency observation in the named histogram'''
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        '''returns all metrics as a json serializable dict'''
+        with self.lock:
+            return {'started': self.started, 'elapsed': time.time() - self.started,
+                    'counters': dict(sorted(self.counters.items())),
+                    'latency': dict((name, hist.to_dict()) for name, hist in sorted(self.histograms.items()))}
+
+    def reset(self):
+        '''clears all metrics'''
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+
+registry = Registry()
+
+def incr(name, value=1):
+    '''adds value to the named counter'''
+    registry.incr(name, value)
+
+def observe(name, seconds):
+    '''records a latency observation in the named histogram'''
+    registry.observe(name, seconds)
+
+@contextmanager
+def timer(name):
+    '''times the enclosed block into the named histogram, counting calls & errors'''
+    start = time.time()
+    try:
+        yield
+    except Exception:
+        registry.incr('{}.errors'.format(name))
+        raise
+    finally:
+        registry.incr('{}.calls'.format(name))
+        registry.observe(name, time.time() - start)
+
+def timed(name):
+    '''decorator timing each call of the function into the named histogram'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def write(path=METRICS_FILE):
+    '''writes the metrics snapshot to the given path'''
+    with open(path, 'w') as fout:
+        json.dump(registry.snapshot(), fout, indent=2, sort_keys=True)
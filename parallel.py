@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+'''
+runs independent units of work (eg per-AOI evaluation) on a bounded thread pool,
+keeping each unit's printed output together and in submission order
+'''
+from __future__ import print_function
+from builtins import object
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import profiler
+
+class ThreadOutput(object):
+    '''stdout proxy that sends writes from threads with a capture buffer into that buffer'''
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, 'buffer', None)
+        if buf is None:
+            return self.stream.write(text)
+        return buf.write(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def map_grouped(func, items, workers):
+    '''
+    calls func(item) for each item using at most workers threads. Output from each call is
+    captured & written as one block, in item order. When a call raises, items not yet started
+    are cancelled, the calls already running are waited for, and the first exception is re-raised
+    once the output of every call that ran has been written.
+    '''
+    stdout = sys.stdout
+    proxy = ThreadOutput(stdout)
+    func = profiler.wrap(func) # worker threads are not seen by the main thread's profile
+
+    def run(item):
+        proxy.local.buffer = io.StringIO()
+        try:
+            return func(item), None, proxy.local.buffer.getvalue()
+        except Exception as err:
+            return None, err, proxy.local.buffer.getvalue()
+        finally:
+            proxy.local.buffer = None
+
+    sys.stdout = proxy
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run, item) for item in items]
+            results = []
+            first_err = None
+            for future in futures:
+                if future.cancelled():
+                    continue
+                result, err, output = future.result()
+                stdout.write(output)
+                stdout.flush()
+                if err is not None and first_err is None:
+                    first_err = err
+                    for pending in futures:
+                        pending.cancel()
+                results.append(result)
+            if first_err is not None:
+                raise first_err
+            return results
+    finally:
+        sys.stdout = stdout
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+'''
+compact product records & accessors for GRQ product documents, and a single-pass index
+that groups a result set by full_id_hash, track, orbit, (track, orbit) & aoi
+'''
+from __future__ import print_function
+from builtins import str
+from builtins import object
+import dateutil
+import dateutil.parser
+import hashing
+from hashing import find_hash
+import logs
+
+TRACK_KEYS = ['track_number', 'track', 'trackNumber', 'track_Number']
+ORBIT_KEYS = ['orbit_number', 'orbitNumber', 'orbit']
+
+logger = logs.get_logger('products')
+
+class Product(object):
+    '''
+    compact record of the fields evaluation needs from an acq-list, audit-trail, gunw or
+    greylist hit. Built once at ingest so the raw hit can be dropped; raw is only
+    kept when explicitly requested.
+    '''
+    __slots__ = ('id', 'index', 'type', 'doc_version', 'full_id_hash', 'track', 'orbit', 'orbit_numbers',
+                 'creation_timestamp', '_creation_time', 'tags', 'aoi', 'raw')
+
+    def __init__(self, uid, index, prod_type, doc_version=None, full_id_hash=False, track=False, orbit=False,
+                 orbit_numbers=None, creation_timestamp=None, tags=None, aoi=False, raw=None):
+        self.id = uid
+        self.index = index
+        self.type = prod_type
+        self.doc_version = doc_version
+        self.full_id_hash = full_id_hash
+        self.track = track
+        self.orbit = orbit
+        self.orbit_numbers = orbit_numbers or []
+        self.creation_timestamp = creation_timestamp
+        self._creation_time = None
+        self.tags = tags if isinstance(tags, list) else []
+        self.aoi = aoi
+        self.raw = raw
+
+    @classmethod
+    def from_hit(cls, hit, keep_raw=False):
+        '''builds the record from an elasticsearch hit'''
+        es_ds = hit.get('_source', {})
+        es_met = es_ds.get('metadata', {})
+        orbit_numbers = find_orbit_numbers(hit)
+        return cls(es_ds.get('id', hit.get('_id')), hit.get('_index'), hit.get('_type'), doc_version=hit.get('_version'),
+                   full_id_hash=find_hash(hit), track=find_track(hit),
+                   orbit=stringify_orbit(orbit_numbers) if orbit_numbers else False, orbit_numbers=orbit_numbers or [], creation_timestamp=es_ds.get('creation_timestamp'),
+                   tags=es_met.get('tags', []), aoi=es_met.get('aoi', False), raw=hit if keep_raw else None)
+
+    @property
+    def creation_time(self):
+        '''parsed creation_timestamp, parsed on first use'''
+        if self._creation_time is None:
+            self._creation_time = dateutil.parser.parse(self.creation_timestamp)
+        return self._creation_time
+
+    def __repr__(self):
+        return 'Product({}, {})'.format(self.type, self.id)
+
+class ProductIndex(object):
+    '''
+    groups the products of a result set in one pass, for O(1) lookups by full_id_hash, track,
+    orbit, (track, orbit) & aoi. Products without a track, orbit or aoi are simply not
+    grouped under that key. Groups keep the order in which products were added.
+    '''
+    def __init__(self, es_results=()):
+        self.products = []
+        self.by_hash = {} # full_id_hash -> [products]
+        self.latest_by_hash = {} # full_id_hash -> most recently created product
+        self.by_track = {}
+        self.by_orbit = {}
+        self.by_track_orbit = {}
+        self.by_aoi = {}
+        for es_obj in es_results:
+            self.add(es_obj)
+
+    def add(self, es_obj):
+        '''adds the product to every grouping'''
+        self.products.append(es_obj)
+        idhash = get_hash(es_obj)
+        self.by_hash.setdefault(idhash, []).append(es_obj)
+        latest = self.latest_by_hash.get(idhash)
+        if latest is None:
+            self.latest_by_hash[idhash] = es_obj
+        else:
+            logger.debug('found duplicate products: %s, %s', get_id(es_obj), get_id(latest))
+            self.latest_by_hash[idhash] = get_most_recent(es_obj, latest)
+        track = find_track(es_obj)
+        orbit = find_orbit(es_obj)
+        if track:
+            self.by_track.setdefault(track, []).append(es_obj)
+        if orbit:
+            self.by_orbit.setdefault(orbit, []).append(es_obj)
+        if track and orbit:
+            self.by_track_orbit.setdefault((track, orbit), []).append(es_obj)
+        aoi_ids = get_aoi(es_obj)
+        if aoi_ids:
+            if not isinstance(aoi_ids, (list, tuple)):
+                aoi_ids = [aoi_ids]
+            for aoi_id in aoi_ids:
+                self.by_aoi.setdefault(aoi_id, []).append(es_obj)
+
+    def __contains__(self, full_id_hash):
+        return full_id_hash in self.by_hash
+
+    def __len__(self):
+        return len(self.products)
+
+    def hashes(self):
+        '''returns the full_id_hashes in the index'''
+        return list(self.by_hash.keys())
+
+    def track_orbit_groups(self):
+        '''returns [(track, orbit, products)], ordered by track then orbit, each in first-seen order'''
+        track_rank = dict((track, i) for i, track in enumerate(self.by_track.keys()))
+        return [(track, orbit, products) for (track, orbit), products in
+                sorted(self.by_track_orbit.items(), key=lambda item: track_rank[item[0][0]])]
+
+def as_record(es_obj):
+    '''returns the product record for the hit (or the record itself)'''
+    if isinstance(es_obj, Product):
+        return es_obj
+    return Product.from_hit(es_obj)
+
+def to_records(es_results, keep_raw=False):
+    '''converts a result set into product records'''
+    return [Product.from_hit(hit, keep_raw=keep_raw) for hit in es_results]
+
+def get_id(es_obj):
+    '''returns the product id'''
+    if isinstance(es_obj, Product):
+        return es_obj.id
+    return es_obj.get('_source', {}).get('id', es_obj.get('_id'))
+
+def get_aoi(es_obj):
+    '''returns the aoi id(s) the product was generated for, or False'''
+    if isinstance(es_obj, Product):
+        return es_obj.aoi
+    return es_obj.get('_source', {}).get('metadata', {}).get('aoi', False)
+
+def find_track(es_obj):
+    '''returns the track from the elasticsearch object, or False if it has none'''
+    if isinstance(es_obj, Product):
+        return es_obj.track
+    es_ds = es_obj.get('_source', {})
+    #iterate through ds
+    for tkey in TRACK_KEYS:
+        track = es_ds.get(tkey, False)
+        if track:
+            return track
+    #if that doesn't work try metadata
+    es_met = es_ds.get('metadata', {})
+    for tkey in TRACK_KEYS:
+        track = es_met.get(tkey, False)
+        if track:
+            return track
+    return False
+
+def get_track(es_obj):
+    '''returns the track from the elasticsearch object'''
+    track = find_track(es_obj)
+    if track:
+        return track
+    raise Exception('unable to find track for: {}'.format(get_id(es_obj)))
+
+def find_orbit_numbers(es_obj):
+    '''returns the list of orbit numbers from the elasticsearch object, or False if it has none'''
+    if isinstance(es_obj, Product):
+        return es_obj.orbit_numbers or False
+    es_ds = es_obj.get('_source', {})
+    #iterate through ds
+    for tkey in ORBIT_KEYS:
+        orbit = es_ds.get(tkey, False)
+        if orbit:
+            return orbit
+    #if that doesn't work try metadata
+    es_met = es_ds.get('metadata', {})
+    for tkey in ORBIT_KEYS:
+        orbit = es_met.get(tkey, False)
+        if orbit:
+            return orbit
+    return False
+
+def find_orbit(es_obj):
+    '''returns the orbit as a string from the elasticsearch object, or False if it has none'''
+    if isinstance(es_obj, Product):
+        return es_obj.orbit
+    orbit = find_orbit_numbers(es_obj)
+    if orbit:
+        return stringify_orbit(orbit)
+    return False
+
+def get_orbit(es_obj):
+    '''returns the orbit as a string from the elasticsearch object'''
+    orbit = find_orbit(es_obj)
+    if orbit:
+        return orbit
+    raise Exception('unable to find orbit for: {}'.format(get_id(es_obj)))
+
+def get_hash(es_obj):
+    '''retrieves the full_id_hash. if it doesn't exists, it
+        attempts to generate one. errors if the product has neither hash nor scenes'''
+    if isinstance(es_obj, Product):
+        if es_obj.full_id_hash is False:
+            raise Exception('unable to find or generate full_id_hash for: {}'.format(es_obj.id))
+        return es_obj.full_id_hash
+    return hashing.get_hash(es_obj)
+
+def get_most_recent(obj1, obj2):
+    '''returns the object with the most recent ingest time'''
+    if isinstance(obj1, Product) and isinstance(obj2, Product):
+        return obj1 if obj1.creation_time > obj2.creation_time else obj2
+    ctime1 = dateutil.parser.parse(obj1.get('_source', {}).get('creation_timestamp', False))
+    ctime2 = dateutil.parser.parse(obj2.get('_source', {}).get('creation_timestamp', False))
+    if ctime1 > ctime2:
+        return obj1
+    return obj2
+
+def stringify_orbit(orbit_list):
+    '''converts the list into a string'''
+    if len(orbit_list) == 0:
+        raise RuntimeError("Orbit List is EMPTY")
+    return '_'.join([str(x).zfill(3) for x in sorted(orbit_list)])
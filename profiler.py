@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+'''
+opt-in cProfile hook for evaluation runs. Enabled with the COMPLETENESS_PROFILE environment
+variable or the profile context field, it writes the combined profile of the main & worker
+threads to _profile.prof and a top-N hot-function summary to _profile.txt in the work directory
+'''
+from __future__ import print_function
+from builtins import object
+import io
+import os
+import cProfile
+import pstats
+import threading
+import functools
+
+PROFILE_FILE = '_profile.prof'
+SUMMARY_FILE = '_profile.txt'
+TOP_N = 40 # functions listed in each section of the summary
+
+_session = None
+
+class Session(object):
+    '''the per-thread profiles collected during one profiled run'''
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def new_profile(self):
+        '''returns a new profile for the calling thread'''
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        return profile
+
+    def stats(self, stream=None):
+        '''returns the combined stats of all the profiles'''
+        stats = pstats.Stats(self.profiles[0], stream=stream)
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
+
+def requested(ctx=None):
+    '''returns True if profiling was requested by environment variable or context'''
+    if os.environ.get('COMPLETENESS_PROFILE', '').lower() in ('1', 'true', 'yes'):
+        return True
+    value = (ctx or {}).get('profile', False)
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def wrap(func):
+    '''returns func profiled into the active session, or func unchanged when not profiling.
+    used to profile work handed to other threads'''
+    session = _session
+    if session is None:
+        return func
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = session.new_profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+    return wrapper
+
+def run(func, enabled=True, profile_path=PROFILE_FILE, summary_path=SUMMARY_FILE, top_n=TOP_N):
+    '''calls func(), profiling it when enabled. the profile is written even if func raises'''
+    global _session
+    if not enabled:
+        return func()
+    _session = Session()
+    try:
+        return wrap(func)()
+    finally:
+        session = _session
+        _session = None
+        write(session, profile_path, summary_path, top_n)
+
+def write(session, profile_path=PROFILE_FILE, summary_path=SUMMARY_FILE, top_n=TOP_N):
+    '''dumps the combined profile & writes the hot-function summary'''
+    summary = io.StringIO()
+    stats = session.stats(stream=summary)
+    stats.dump_stats(profile_path)
+    stats.strip_dirs()
+    summary.write(u'profiled {} thread(s)\n\ntop {} functions by cumulative time\n'.format(len(session.profiles), top_n))
+    stats.sort_stats('cumulative').print_stats(top_n)
+    summary.write(u'\ntop {} functions by internal time\n'.format(top_n))
+    stats.sort_stats('tottime').print_stats(top_n)
+    with io.open(summary_path, 'w') as fout:
+        fout.write(summary.getvalue())
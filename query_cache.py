@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+run-scoped memoizing cache for GRQ queries
+'''
+from __future__ import print_function
+from builtins import object
+import json
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 256 # distinct queries held at once
+MAX_HITS = 200000 # total hits held across all cached queries
+
+class QueryCache(object):
+    '''
+    LRU cache of query results keyed on the normalized query arguments. Bounded both by
+    the number of queries & the total number of hits held. Meant to live for one evaluation run.
+    '''
+    def __init__(self, max_entries=MAX_ENTRIES, max_hits=MAX_HITS):
+        self.max_entries = int(max_entries)
+        self.max_hits = int(max_hits)
+        self.entries = OrderedDict() # key -> list of results, most recently used last
+        self.held_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''returns a copy of the cached results for the key, or None'''
+        with self.lock:
+            results = self.entries.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(results)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, results):
+        '''caches the results, evicting least recently used queries to stay within bounds'''
+        results = list(results)
+        if len(results) > self.max_hits:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.held_hits -= len(self.entries.pop(key))
+            self.entries[key] = results
+            self.held_hits += len(results)
+            while len(self.entries) > self.max_entries or self.held_hits > self.max_hits:
+                _, evicted = self.entries.popitem(last=False)
+                self.held_hits -= len(evicted)
+                self.evictions += 1
+
+    def get_or_fetch(self, key, fetch):
+        '''returns the cached results for the key, calling fetch() on a miss'''
+        results = self.get(key)
+        if results is None:
+            results = fetch()
+            self.put(key, results)
+        return list(results)
+
+    def stats(self):
+        '''returns the cache counters'''
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'held_hits': self.held_hits}
+
+def make_key(prod_type, **kwargs):
+    '''normalizes the query arguments into a hashable cache key. unset (False) arguments are dropped'''
+    normalized = {}
+    for name, value in kwargs.items():
+        if value is False or value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = sorted(value, key=lambda x: json.dumps(x, sort_keys=True))
+        normalized[name] = value
+    return '{}|{}'.format(prod_type, json.dumps(normalized, sort_keys=True))
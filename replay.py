@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+'''
+record & replay of GRQ traffic. Recording wraps the live backend & writes every request's
+response & latency to a gzipped archive, keyed by the normalized request. Replaying serves
+those responses from the archive with the recorded (optionally scaled) latency, so a production
+job can be re-run offline, deterministically & repeatedly.
+
+    COMPLETENESS_GRQ_RECORD=job.grq.gz ./evaluate.py          # record a real run
+    python replay.py job.grq.gz --latency 1.0                 # replay it in an empty directory
+'''
+from __future__ import print_function
+import os
+import sys
+import gzip
+import json
+import time
+import hashlib
+import argparse
+import threading
+import grq
+import logs
+import metrics
+
+ARCHIVE_FORMAT = 1
+
+logger = logs.get_logger('replay')
+
+def normalize(op, *args):
+    '''returns (key, request) for the operation. searches are keyed on the index path & the query
+    without its paging parameters, so a search recorded in an _msearch can be replayed by a scroll & vice versa'''
+    if op == 'search':
+        index, es_query = args
+        es_query = dict((k, v) for k, v in es_query.items() if k not in ('size', 'from'))
+        request = [op, index.strip('/'), es_query]
+    else:
+        request = [op] + list(args)
+    return hashlib.md5(json.dumps(request, sort_keys=True).encode('utf8')).hexdigest(), request
+
+def search_path(grq_url):
+    '''returns the es path of a search url, without the host'''
+    path = grq_url.partition('/es/')[2] or grq_url
+    return path.rsplit('/_search', 1)[0]
+
+class RecordingBackend(grq.Backend):
+    '''forwards every call to the wrapped backend, recording each response & its latency'''
+    def __init__(self, backend, path, context=None):
+        self.backend = backend
+        self.path = path
+        self.lock = threading.Lock()
+        self.fout = gzip.open(path, 'wt')
+        self.fout.write(json.dumps({'format': ARCHIVE_FORMAT, 'context': context or {}}) + '\n')
+        self.count = 0
+
+    def record(self, op, args, call):
+        '''calls call(), recording its result (or VersionConflict) under the normalized request'''
+        key, _ = normalize(op, *args)
+        start = time.time()
+        entry = {'key': key, 'op': op}
+        try:
+            result = call()
+            entry['response'] = result
+            return result
+        except grq.VersionConflict as err:
+            entry['conflict'] = str(err)
+            raise
+        finally:
+            entry['latency'] = round(time.time() - start, 6)
+            if 'response' in entry or 'conflict' in entry:
+                with self.lock:
+                    self.fout.write(json.dumps(entry) + '\n')
+                    self.count += 1
+
+    def url(self, path):
+        return self.backend.url(path)
+
+    def iter_search(self, grq_url, es_query, page_size=grq.PAGE_SIZE):
+        hits = self.record('search', (search_path(grq_url), es_query),
+                           lambda: list(self.backend.iter_search(grq_url, es_query, page_size=page_size)))
+        for hit in hits:
+            yield hit
+
+    def msearch(self, searches, page_size=grq.PAGE_SIZE):
+        start = time.time()
+        results = self.backend.msearch(searches, page_size=page_size)
+        # recorded per search, each carrying an equal share of the batch latency
+        latency = round((time.time() - start) / max(len(searches), 1), 6)
+        with self.lock:
+            for (index, es_query), hits in zip(searches, results):
+                key, _ = normalize('search', index, es_query)
+                self.fout.write(json.dumps({'key': key, 'op': 'search', 'response': hits, 'latency': latency}) + '\n')
+                self.count += 1
+        return results
+
+    def aggregate(self, index, es_query):
+        return self.record('aggregate', (index, es_query), lambda: self.backend.aggregate(index, es_query))
+
+    def mget(self, docs):
+        return self.record('mget', (docs,), lambda: self.backend.mget(docs))
+
+    def bulk(self, actions):
+        actions = list(actions)
+        return self.record('bulk', (actions,), lambda: self.backend.bulk(actions))
+
+    def update(self, index, prod_type, uid, doc, version=None):
+        return self.record('update', (index, prod_type, uid, doc, version),
+                           lambda: self.backend.update(index, prod_type, uid, doc, version=version))
+
+    def close(self):
+        '''finishes the archive'''
+        with self.lock:
+            self.fout.close()
+        logger.info('recorded %d GRQ responses to %s', self.count, self.path)
+
+class ReplayBackend(grq.Backend):
+    '''
+    serves recorded responses. Repeated identical requests are answered in the order they were
+    recorded, the last response being repeated once they run out. latency_scale multiplies the
+    recorded latency (0 disables the simulated latency)
+    '''
+    def __init__(self, path, latency_scale=1.0):
+        self.path = path
+        self.latency_scale = float(latency_scale)
+        self.responses = {} # key -> [entries] in recorded order
+        self.served = {} # key -> number of times served
+        self.requests = {} # op -> number of requests served
+        self.lock = threading.Lock()
+        with gzip.open(path, 'rt') as fin:
+            header = json.loads(fin.readline())
+            if header.get('format') != ARCHIVE_FORMAT:
+                raise Exception('unsupported replay archive format: {}'.format(header.get('format')))
+            self.context = header.get('context', {})
+            for line in fin:
+                entry = json.loads(line)
+                self.responses.setdefault(entry['key'], []).append(entry)
+
+    def respond(self, op, *args):
+        '''returns the next recorded response for the request, after the simulated latency'''
+        key, request = normalize(op, *args)
+        with self.lock:
+            entries = self.responses.get(key)
+            if not entries:
+                raise Exception('no recorded response for {} request: {}'.format(op, json.dumps(request)[:500]))
+            i = self.served.get(key, 0)
+            self.served[key] = i + 1
+            self.requests[op] = self.requests.get(op, 0) + 1
+            entry = entries[min(i, len(entries) - 1)]
+        metrics.incr('replay.{}'.format(op))
+        if self.latency_scale > 0:
+            time.sleep(entry.get('latency', 0) * self.latency_scale)
+        if 'conflict' in entry:
+            raise grq.VersionConflict(entry['conflict'])
+        return entry['response']
+
+    def url(self, path):
+        return 'replay://grq/es/' + path.lstrip('/')
+
+    def iter_search(self, grq_url, es_query, page_size=grq.PAGE_SIZE):
+        for hit in self.respond('search', search_path(grq_url), es_query):
+            yield hit
+
+    def msearch(self, searches, page_size=grq.PAGE_SIZE):
+        return [self.respond('search', index, es_query) for index, es_query in searches]
+
+    def aggregate(self, index, es_query):
+        return self.respond('aggregate', index, es_query)
+
+    def mget(self, docs):
+        return self.respond('mget', docs)
+
+    def bulk(self, actions):
+        return self.respond('bulk', list(actions))
+
+    def update(self, index, prod_type, uid, doc, version=None):
+        return self.respond('update', index, prod_type, uid, doc, version)
+
+def install(ctx=None):
+    '''
+    installs a recording or replaying backend when requested by the COMPLETENESS_GRQ_RECORD /
+    COMPLETENESS_GRQ_REPLAY environment variables or the grq_record / grq_replay context fields.
+    returns the installed backend, or None
+    '''
+    ctx = ctx or {}
+    replay_path = os.environ.get('COMPLETENESS_GRQ_REPLAY', ctx.get('grq_replay', False))
+    record_path = os.environ.get('COMPLETENESS_GRQ_RECORD', ctx.get('grq_record', False))
+    if replay_path:
+        latency_scale = os.environ.get('COMPLETENESS_REPLAY_LATENCY', ctx.get('replay_latency', 1.0))
+        backend = ReplayBackend(replay_path, latency_scale=latency_scale)
+    elif record_path:
+        backend = RecordingBackend(grq.get_client(), record_path, context=ctx)
+    else:
+        return None
+    grq.set_backend(backend)
+    return backend
+
+def active():
+    '''
+    returns True while a recording or replaying backend is installed. Such runs fetch everything
+    rather than using worker-local state (the greylist store & completeness ledger), so the recorded
+    queries are the same wherever the archive is replayed
+    '''
+    return isinstance(grq.get_client(), (RecordingBackend, ReplayBackend))
+
+def finish(backend):
+    '''closes a recording started by install'''
+    if isinstance(backend, RecordingBackend):
+        backend.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='replay a recorded evaluation offline')
+    parser.add_argument('archive', help='archive written with COMPLETENESS_GRQ_RECORD')
+    parser.add_argument('--latency', type=float, default=1.0, help='recorded latency multiplier, 0 for none')
+    args = parser.parse_args()
+    import evaluate
+    backend = ReplayBackend(args.archive, latency_scale=args.latency)
+    if not os.path.exists('_context.json'):
+        with open('_context.json', 'w') as fout:
+            json.dump(dict(backend.context, grq_record=False, grq_replay=False), fout)
+    grq.set_backend(backend)
+    start = time.time()
+    evaluate.evaluate()
+    print('replayed in {:.3f}s: {}'.format(time.time() - start, ', '.join(
+        '{} {} requests'.format(count, op) for op, count in sorted(backend.requests.items()))))
+
+if __name__ == '__main__':
+    sys.exit(main())
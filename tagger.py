@@ -5,10 +5,18 @@ updates product grq metadata with the machine tag
 '''
 from __future__ import print_function
 from builtins import range
-import json
-import requests
-from hysds.celery import app
+from builtins import object
+import threading
+from collections import OrderedDict
+import grq
+import logs
+import metrics
 
+BULK_BATCH_SIZE = 500 # documents per _bulk request
+
+logger = logs.get_logger('tagger')
+
+@metrics.timed('tagger.add_tag')
 def add_tag(index, uid, prod_type, tag):
     '''updates the product with the given tag'''
     if tag is None:
@@ -16,19 +24,16 @@ def add_tag(index, uid, prod_type, tag):
     else:
         existing_tags = get_current_tags(uid, prod_type, index)
         if not tag is False and tag in existing_tags:
-            print('tag: {} already in tags for: {}'.format(tag, uid))
+            logger.debug('tag: %s already in tags for: %s', tag, uid)
             return
         tag_list = tag.split(',')
         if not type(existing_tags) is list:
             existing_tags = []
         tag_list = list(set(existing_tags + tag_list))
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/{2}/{3}/_update'.format(grq_ip, index, prod_type, uid)
-    es_query = {"doc" : {"metadata": {"tags" : tag_list}}}
-    response = requests.post(grq_url, data=json.dumps(es_query), timeout=60, verify=False)
-    response.raise_for_status()
-    print('successfully updated {} with tag {}'.format(uid, tag))
+    grq.get_client().update(index, prod_type, uid, {"metadata": {"tags" : tag_list}})
+    logger.debug('successfully updated %s with tag %s', uid, tag)
 
+@metrics.timed('tagger.remove_tag')
 def remove_tag(index, uid, prod_type, tag):
     '''removes the tag from the product'''
     if tag is False:
@@ -36,27 +41,22 @@ def remove_tag(index, uid, prod_type, tag):
     else:
         existing_tags = get_current_tags(uid, prod_type, index)
         if not tag in existing_tags:
-            print('tag: {} does not exist in tags for: {}'.format(tag, uid))
+            logger.debug('tag: %s does not exist in tags for: %s', tag, uid)
             return
         tag_list = tag.split(',')
         if not type(existing_tags) is list:
             existing_tags = []
         existing_tags.remove(tag)
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/{2}/{3}/_update'.format(grq_ip, index, prod_type, uid)
-    es_query = {"doc" : {"metadata": {"tags" : existing_tags}}}
-    response = requests.post(grq_url, data=json.dumps(es_query), timeout=60, verify=False)
-    response.raise_for_status()
-    print('successfully removed tag {} from {}'.format(tag, uid))
+    grq.get_client().update(index, prod_type, uid, {"metadata": {"tags" : existing_tags}})
+    logger.debug('successfully removed tag %s from %s', tag, uid)
 
 def get_current_tags(uid, prod_type, index):
     '''gets the current tags of the object'''
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/{2}/_search'.format(grq_ip, index, prod_type)
+    grq_url = grq.get_client().url('{0}/{1}/_search'.format(index, prod_type))
     grq_query = {"query": {"bool": {"must": {"match": {"_id": uid}}}}}
     results = query_es(grq_url, grq_query)
     tags = results[0].get('_source', {}).get('metadata', {}).get('tags', [])
-    print('{} has current tags: {}'.format(uid, tags))
+    logger.debug('%s has current tags: %s', uid, tags)
     return tags
 
 def query_es(grq_url, es_query):
@@ -64,26 +64,140 @@ def query_es(grq_url, es_query):
     Runs the query through Elasticsearch, iterates until
     all results are generated, & returns the compiled result
     '''
-    # make sure the fields from & size are in the es_query
-    if 'size' in list(es_query.keys()):
-        iterator_size = es_query['size']
-    else:
-        iterator_size = 1000
-        es_query['size'] = iterator_size
-    if 'from' in list(es_query.keys()):
-        from_position = es_query['from']
-    else:
-        from_position = 0
-        es_query['from'] = from_position
-    response = requests.post(grq_url, data=json.dumps(es_query), verify=False)
-    response.raise_for_status()
-    results = json.loads(response.text, encoding='ascii')
-    results_list = results.get('hits', {}).get('hits', [])
-    total_count = results.get('hits', {}).get('total', 0)
-    for i in range(iterator_size, total_count, iterator_size):
-        es_query['from'] = i
-        response = requests.post(grq_url, data=json.dumps(es_query), timeout=60, verify=False)
-        response.raise_for_status()
-        results = json.loads(response.text, encoding='ascii')
-        results_list.extend(results.get('hits', {}).get('hits', []))
-    return results_list
+    return list(grq.iter_es(grq_url, es_query))
+
+def apply_changes(existing_tags, changes):
+    '''returns the tag list after applying the {tag: add (True) or remove (False)} changes'''
+    tag_list = [tg for tg in existing_tags if changes.get(tg, True)]
+    tag_list.extend([tg for tg, present in changes.items() if present and not tg in tag_list])
+    return tag_list
+
+class TagQueue(object):
+    '''
+    collects tag additions & removals during evaluation, then applies them
+    through the elasticsearch _bulk api in batches. When the caller passes the tags
+    (and _version) it already holds from the search hit, no read is needed & the write
+    is guarded by the document version. Queues used for separate units of work may share
+    the written dict, so each sees the others' writes.
+    '''
+    def __init__(self, batch_size=BULK_BATCH_SIZE, written=None):
+        self.batch_size = int(batch_size)
+        self.pending = OrderedDict() # (index, prod_type, uid) -> queued changes & known tag state
+        self.written = written if written is not None else {} # (index, prod_type, uid) -> (tags, version) as of the last successful write
+        self.lock = threading.Lock()
+
+    def add(self, index, uid, prod_type, tag, known_tags=None, version=None):
+        '''queues the tag to be added to the product'''
+        self._queue(index, uid, prod_type, tag, True, known_tags, version)
+
+    def remove(self, index, uid, prod_type, tag, known_tags=None, version=None):
+        '''queues the tag to be removed from the product'''
+        self._queue(index, uid, prod_type, tag, False, known_tags, version)
+
+    def _queue(self, index, uid, prod_type, tag, present, known_tags, version):
+        if tag is None or tag is False:
+            return
+        key = (index, prod_type, uid)
+        with self.lock:
+            if key in self.written:
+                # our own earlier write is newer than the caller's copy of the document
+                known_tags, version = self.written[key]
+            entry = self.pending.setdefault(key, {'changes': OrderedDict(), 'tags': None, 'version': None})
+            if entry['tags'] is None and known_tags is not None:
+                entry['tags'] = list(known_tags) if isinstance(known_tags, list) else []
+                entry['version'] = version
+            for tg in tag.split(','):
+                entry['changes'][tg] = present
+
+    def __len__(self):
+        return len(self.pending)
+
+    def flush(self):
+        '''applies all queued changes. returns a list of (uid, error) for documents that failed'''
+        with self.lock:
+            pending = list(self.pending.items())
+            self.pending = OrderedDict()
+        failures = []
+        for i in range(0, len(pending), self.batch_size):
+            written, batch_failures = apply_tag_changes(pending[i:i + self.batch_size])
+            failures.extend(batch_failures)
+            with self.lock:
+                self.written.update(written)
+        if pending:
+            logger.info('flushed tag changes for %d products with %d failures', len(pending), len(failures))
+        for uid, error in failures:
+            logger.error('failed to update tags for %s: %s', uid, error)
+        return failures
+
+def apply_tag_changes(batch):
+    '''
+    writes the changed tag lists for the batch in one _bulk request. Tags are only read (in one
+    _mget) for documents queued without known tags, or whose version changed under us.
+    returns ({key: (tags, version)} for written documents, [(uid, error)] for failures)
+    '''
+    state = dict((key, (entry['tags'], entry['version'])) for key, entry in batch if entry['tags'] is not None)
+    state.update(read_tags([key for key, entry in batch if entry['tags'] is None]))
+    written = {}
+    failures = []
+    for attempt in range(2):
+        updates = []
+        for key, entry in batch:
+            if not key in state:
+                failures.append((key[2], 'document not found'))
+                continue
+            existing_tags, version = state[key]
+            tag_list = apply_changes(existing_tags, entry['changes'])
+            if tag_list != existing_tags:
+                updates.append((key, tag_list, version))
+        written_batch, failed, conflicts = bulk_update(updates)
+        written.update(written_batch)
+        failures.extend(failed)
+        if not conflicts or attempt > 0:
+            failures.extend([(key[2], 'version conflict') for key in conflicts])
+            break
+        # documents changed since they were read: re-read just those & retry once
+        logger.info('re-reading tags for %d products that changed since they were read', len(conflicts))
+        batch = [(key, entry) for key, entry in batch if key in conflicts]
+        state = read_tags(conflicts)
+    return written, failures
+
+@metrics.timed('tagger.read_tags')
+def read_tags(keys):
+    '''returns {key: (tags, version)} for the (index, prod_type, uid) keys, using a single _mget'''
+    if not keys:
+        return {}
+    docs = [{'_index': index, '_type': prod_type, '_id': uid, '_source': ['metadata.tags']} for index, prod_type, uid in keys]
+    state = {}
+    for doc in grq.get_client().mget(docs):
+        if doc.get('found', False):
+            tags = doc.get('_source', {}).get('metadata', {}).get('tags', [])
+            state[(doc.get('_index'), doc.get('_type'), doc.get('_id'))] = (tags if isinstance(tags, list) else [], doc.get('_version'))
+    return state
+
+@metrics.timed('tagger.bulk_update')
+def bulk_update(updates):
+    '''
+    writes [(key, tag_list, version)] in one _bulk request. returns the written
+    {key: (tags, new version)}, [(uid, error)] failures & a list of version-conflicted keys
+    '''
+    written, failures, conflicts = {}, [], []
+    if not updates:
+        return written, failures, conflicts
+    actions = []
+    for (index, prod_type, uid), tag_list, version in updates:
+        action = {'_index': index, '_type': prod_type, '_id': uid}
+        if version:
+            action['_version'] = version
+        actions.append({'update': action})
+        actions.append({'doc': {'metadata': {'tags': tag_list}}})
+    results = grq.get_client().bulk(actions)
+    for (key, tag_list, _), item in zip(updates, results.get('items', [])):
+        action = item.get('update', {})
+        status = action.get('status', 200)
+        if status == 409:
+            conflicts.append(key)
+        elif action.get('error') or status >= 300:
+            failures.append((key[2], action.get('error', status)))
+        else:
+            written[key] = (tag_list, action.get('_version'))
+    return written, failures, conflicts
@@ -0,0 +1,66 @@
+import os
+import sys
+import types
+
+# the evaluator's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import hysds.celery
+    import hysds.dataset_ingest
+except ImportError:
+    # outside a HySDS worker: the tests run against the in-memory backend & never reach the
+    # cluster, so stand-ins for the configuration & ingest entry points are enough
+    class _Conf(dict):
+        def __getattr__(self, name):
+            return self[name]
+    hysds = types.ModuleType('hysds')
+    celery = types.ModuleType('hysds.celery')
+    celery.app = types.SimpleNamespace(conf=_Conf(GRQ_ES_URL='http://localhost:9200'))
+    dataset_ingest = types.ModuleType('hysds.dataset_ingest')
+    dataset_ingest.ingest = lambda *args, **kwargs: None
+    hysds.celery = celery
+    hysds.dataset_ingest = dataset_ingest
+    sys.modules.update({'hysds': hysds, 'hysds.celery': celery, 'hysds.dataset_ingest': dataset_ingest})
+
+import json
+import pytest
+import grq
+import hashing
+import evaluate
+import build_validated_product
+from memory_backend import MemoryBackend
+
+@pytest.fixture
+def backend():
+    '''an empty in-memory backend, installed as the GRQ client'''
+    backend = MemoryBackend()
+    grq.set_backend(backend)
+    hashing._memo.clear()
+    yield backend
+    grq.set_backend(None)
+
+@pytest.fixture
+def run_evaluation(monkeypatch):
+    '''returns run(docs, ctx, workdir), which runs the evaluator with the job context against a fresh in-memory
+    copy of the documents & returns the published [(prefix, aoi, track, orbit, gunw ids)]'''
+    def run(docs, ctx, workdir):
+        backend = MemoryBackend()
+        backend.load(json.loads(json.dumps(docs)))
+        grq.set_backend(backend)
+        hashing._memo.clear()
+        published = []
+        monkeypatch.setattr(build_validated_product, 'build', lambda gunws, version, prefix, aoi, track, orbit:
+                            published.append((prefix, aoi['_id'], track, orbit, sorted(x['_id'] for x in gunws))))
+        workdir.mkdir()
+        monkeypatch.chdir(workdir)
+        with open('_context.json', 'w') as fout:
+            settings = {'greylist_cache_dir': str(workdir / 'cache'), 'ledger_cache_dir': str(workdir / 'cache')}
+            settings.update(ctx)
+            json.dump(settings, fout)
+        try:
+            evaluate.evaluate()
+        finally:
+            grq.set_backend(None)
+        return sorted(published)
+    return run
@@ -0,0 +1,25 @@
+import aggregations
+from products import Product
+
+def gunw(uid, track, orbits, full_id_hash, created='2020-01-01T00:00:00'):
+    return {'id': uid, 'creation_timestamp': created,
+            'metadata': {'track_number': track, 'orbit_number': orbits, 'full_id_hash': full_id_hash, 'tags': []}}
+
+def test_hash_buckets_group_by_track_and_orbit(backend):
+    backend.index('idx', 'S1-GUNW', 'g1', gunw('g1', 10, [200, 100], 'h1', '2020-01-01T00:00:00'))
+    backend.index('idx', 'S1-GUNW', 'g1-dup', gunw('g1-dup', 10, [200, 100], 'h1', '2020-02-01T00:00:00'))
+    backend.index('idx', 'S1-GUNW', 'g2', gunw('g2', 10, [200, 100], 'h2'))
+    backend.index('idx', 'S1-GUNW', 'g3', gunw('g3', 11, [300, 400], 'h3'))
+    es_query = aggregations.build_aggregation({'query': {'match_all': {}}}, 'metadata.orbit_number')
+    fetched = []
+    def fetch(hashes):
+        fetched.append(hashes)
+        hits = backend.search('idx', {'query': {'terms': {'metadata.full_id_hash.raw': hashes}}})
+        return [Product.from_hit(hit) for hit in hits]
+    buckets = aggregations.HashBuckets('S1-GUNW', backend.aggregate('idx', es_query), fetch)
+    assert buckets.hashes(10, '100_200') == set(['h1', 'h2'])
+    assert buckets.hashes('11', '300_400') == set(['h3'])
+    assert buckets.hashes(10, '300_400') == set()
+    assert len(buckets) == 3
+    assert [x.id for x in buckets.products(['h2', 'h1'])] == ['g2', 'g1-dup']
+    assert fetched == [['h1', 'h2']]
@@ -0,0 +1,27 @@
+import pytest
+import corpus
+import evaluate
+import benchmark as completeness_benchmark
+
+pytest.importorskip('pytest_benchmark')
+
+CORPUS_SIZES = [5, 20, 80] # aois in the generated corpus
+ROUNDS = 3
+
+@pytest.fixture(scope='module', params=CORPUS_SIZES, ids=lambda aois: '{}aois'.format(aois))
+def docs(request):
+    return list(corpus.generate(corpus.CorpusConfig(aois=request.param, tracks=2, orbit_pairs=5, seed=1)))
+
+@pytest.mark.parametrize('job', completeness_benchmark.JOBS)
+def test_evaluation(benchmark, docs, job, tmp_path, monkeypatch):
+    '''times the job. each round gets a freshly loaded backend, loaded outside the timing; the time
+    the backend spent serving the job is recorded as backend_seconds'''
+    ctx = completeness_benchmark.build_context(completeness_benchmark.find_input(docs, job), job)
+    rounds = []
+    def setup():
+        workdir = str(tmp_path / 'round{}'.format(len(rounds)))
+        rounds.append(completeness_benchmark.prepare_job(docs, ctx, workdir))
+        monkeypatch.chdir(workdir)
+    benchmark.pedantic(evaluate.evaluate, setup=setup, rounds=ROUNDS)
+    benchmark.extra_info['documents'] = len(docs)
+    benchmark.extra_info['backend_seconds'] = max(backend.seconds for backend in rounds)
@@ -0,0 +1,55 @@
+import pytest
+import corpus
+import evaluate
+import benchmark
+from products import Product, get_hash
+
+def test_build_query_refuses_to_match_everything(backend):
+    with pytest.raises(Exception, match='no filter'):
+        evaluate.build_query('S1-GUNW-acqlist-audit_trail', full_id_hash=False, fields=['id'])
+    _, grq_query = evaluate.build_query('S1-GUNW-GREYLIST', match_all=True)
+    assert grq_query['query'] == {'match_all': {}}
+    _, grq_query = evaluate.build_query('S1-GUNW', orbit_numbers=[100, 200])
+    assert grq_query['query']['bool']['must'] == [{'term': {'metadata.orbit_number': 100}}, {'term': {'metadata.orbit_number': 200}}]
+
+def test_submitter_params():
+    ctx = {'aoi_workers': '4', 'tag_batch_size': '', 'query_cache_hits': 0, 'greylist_store': 'false', 'profile': True}
+    assert evaluate.context_int(ctx, 'aoi_workers', evaluate.AOI_WORKERS) == 4
+    assert evaluate.context_int(ctx, 'tag_batch_size', 500) == 500
+    assert evaluate.context_int(ctx, 'query_cache_hits', 200000) == 0
+    assert evaluate.context_int(ctx, 'query_cache_entries', 256) == 256
+    assert evaluate.AOI_WORKERS == 1
+    assert not evaluate.context_flag(ctx, 'greylist_store')
+    assert evaluate.context_flag(ctx, 'profile')
+
+def test_groups_are_published_once_per_run(monkeypatch):
+    built = []
+    monkeypatch.setattr(evaluate, 'get_full_objects', lambda gunws: gunws)
+    monkeypatch.setattr(evaluate.build_validated_product, 'build', lambda gunws, version, prefix, aoi, track, orbit: built.append((track, orbit)))
+    job = evaluate.evaluate.__new__(evaluate.evaluate)
+    job.published_keys, job.published_lock = set(), evaluate.threading.Lock()
+    job.tag_obj = lambda obj, tag: None
+    job.flush_tags = lambda: None
+    gunw = Product('g1', 'idx', 'S1-GUNW', full_id_hash='h1', track=10, orbit='100_200')
+    aoi = {'_id': 'AOI_x', '_source': {'id': 'AOI_x'}}
+    assert job.tag_and_publish([gunw], aoi, published=set())
+    assert not job.tag_and_publish([gunw], aoi, published=set())
+    assert built == [(10, '100_200')]
+
+def test_unhashable_products_error():
+    with pytest.raises(Exception, match='full_id_hash'):
+        get_hash(Product('g1', 'idx', 'S1-GUNW'))
+    with pytest.raises(Exception, match='scene lists'):
+        get_hash({'_id': 'g1', '_source': {'metadata': {'master_scenes': ['a']}}})
+    assert Product.from_hit({'_id': 'g1', '_source': {'metadata': {}}}).full_id_hash is False
+
+@pytest.mark.parametrize('job', ['aoi', 'gunw', 'greylist'])
+def test_engines_publish_the_same_products(job, tmp_path, run_evaluation):
+    config = corpus.CorpusConfig(aois=2, tracks=2, orbit_pairs=4, frames=3, completeness=0.6, greylisted=0.1, seed=3)
+    docs = list(corpus.generate(config))
+    ctx = benchmark.build_context(benchmark.find_input(docs, job), job)
+    documents = run_evaluation(docs, dict(ctx, engine='documents'), tmp_path / 'documents')
+    aggregate = run_evaluation(docs, dict(ctx, engine='aggregate'), tmp_path / 'aggregate')
+    assert documents == aggregate
+    if job == 'aoi':
+        assert documents # the corpus has complete groups over the aoi
@@ -0,0 +1,16 @@
+import corpus
+import benchmark
+
+def test_greylist_store_drops_products_purged_from_grq(tmp_path, run_evaluation):
+    config = corpus.CorpusConfig(aois=1, tracks=1, orbit_pairs=1, frames=3, completeness=1.0, duplicates=0, merged=0, greylisted=0)
+    docs = list(corpus.generate(config))
+    gunws = [doc for doc in docs if doc['_type'] == 'S1-GUNW']
+    acq_list = [doc for doc in docs if doc['_type'] == 'S1-GUNW-acq-list'][0]
+    greylist = corpus.doc('S1-GUNW-GREYLIST', 'greylist-f0', {'creation_timestamp': acq_list['_source']['creation_timestamp'],
+                                                              'metadata': dict(acq_list['_source']['metadata'], tags=[])})
+    ctx = dict(benchmark.build_context(gunws[1], 'gunw'), greylist_store=True, greylist_cache_dir=str(tmp_path / 'greylists'))
+    # frame 0 has no gunw; while it is greylisted the other two frames are complete
+    first = [doc for doc in docs if doc is not gunws[0]] + [greylist]
+    second = [doc for doc in docs if doc is not gunws[0]]
+    assert len(run_evaluation(first, ctx, tmp_path / 'first')) == 1
+    assert run_evaluation(second, ctx, tmp_path / 'second') == []
@@ -0,0 +1,43 @@
+import json
+import grq
+
+class Response(object):
+    def __init__(self, body):
+        self.content = json.dumps(body).encode('utf8')
+
+    def json(self):
+        return json.loads(self.content)
+
+def client(pages):
+    '''a GRQ client answering each post with the next of the pages & recording the requests it sends'''
+    sent = []
+    grq_client = grq.GRQClient('https://grq', stream_json=False)
+    def post(url, data=None, params=None, stream=False):
+        sent.append(('POST', url, data, params))
+        return Response(pages.pop(0))
+    grq_client.post = post
+    grq_client.delete = lambda url, data=None, params=None: sent.append(('DELETE', url, data, params))
+    return grq_client, sent
+
+def page(ids, total, scroll_id=None):
+    body = {'hits': {'total': total, 'hits': [{'_id': uid} for uid in ids]}}
+    if scroll_id:
+        body['_scroll_id'] = scroll_id
+    return body
+
+def test_results_in_one_page_open_no_scroll():
+    grq_client, sent = client([page(['a', 'b'], 2)])
+    hits = list(grq_client.iter_search('https://grq/es/idx/_search', {'query': {'match_all': {}}}))
+    assert [hit['_id'] for hit in hits] == ['a', 'b']
+    assert [(method, params) for method, url, data, params in sent] == [('POST', None)]
+
+def test_larger_results_scroll_over_the_rest():
+    grq_client, sent = client([page(['a', 'b'], 5), page(['c', 'd'], 3, 's1'), page(['e'], 3, 's2')])
+    hits = list(grq_client.iter_search('https://grq/es/idx/_search', {'query': {'match_all': {}}}, page_size=2))
+    assert [hit['_id'] for hit in hits] == ['a', 'b', 'c', 'd', 'e']
+    assert [(method, url) for method, url, data, params in sent] == [
+        ('POST', 'https://grq/es/idx/_search'), ('POST', 'https://grq/es/idx/_search'),
+        ('POST', 'https://grq/es/_search/scroll'), ('DELETE', 'https://grq/es/_search/scroll')]
+    assert sent[1][2]['query']['bool']['must_not'] == [{'ids': {'values': ['a', 'b']}}]
+    assert sent[1][3] == {'scroll': grq.SCROLL_TIMEOUT}
+    assert sent[3][2] == 's2'
@@ -0,0 +1,17 @@
+import hashing
+
+def gunw(uid, master, slave):
+    return {'_index': 'idx', '_id': uid, '_version': 1, '_source': {'metadata': {'master_scenes': master, 'slave_scenes': slave}}}
+
+def test_hash_all_hashes_each_scene_pair_once(monkeypatch):
+    hashing._memo.clear()
+    hashed = []
+    hash_scenes = hashing.hash_scenes
+    monkeypatch.setattr(hashing, 'hash_scenes', lambda *scenes: hashed.append(scenes) or hash_scenes(*scenes))
+    stored = {'_id': 'g0', '_source': {'metadata': {'full_id_hash': 'h0'}}}
+    results = [stored, gunw('g1', ['b', 'a'], ['c']), gunw('g2', ['a', 'b'], ['c']), gunw('g3', ['a'], ['d'])]
+    hashes = hashing.hash_all(results)
+    assert hashed == [('a b', 'c'), ('a', 'd')]
+    assert hashes[0] == 'h0' and hashes[1] == hashes[2] != hashes[3]
+    assert hashes[1:] == [hashing.gen_hash(doc) for doc in results[1:]]
+    hashing._memo.clear()
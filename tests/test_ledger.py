@@ -0,0 +1,47 @@
+import corpus
+import ledger
+import evaluate
+import benchmark
+from products import Product
+
+def test_ledger_refresh(tmp_path):
+    store = ledger.CompletenessLedger(str(tmp_path))
+    feed = ('S1-GUNW', 10, '100_200', 'v2.0.2')
+    assert store.last_seen(*feed) is False
+    old = Product('g1', 'idx', 'S1-GUNW', full_id_hash='h1', track=10, orbit='100_200', creation_timestamp='2020-01-01T12:00:00')
+    new = Product('g2', 'idx', 'S1-GUNW', full_id_hash='h2', track=10, orbit='100_200', creation_timestamp='2020-01-02T12:00:00')
+    store.update_products(*feed, products=[old, new], full_refresh=True)
+    assert store.last_seen(*feed) == '2020-01-02T11:00:00' # less the overlap window
+    assert [x.id for x in store.products(*feed)] == ['g1', 'g2']
+    # a full refresh replaces the feed, dropping products no longer in GRQ
+    store.update_products(*feed, products=[new], full_refresh=True)
+    assert [x.id for x in store.products(*feed)] == ['g2']
+    # feeds not fully refreshed for FULL_REFRESH_DAYS are refetched from scratch
+    with store.conn:
+        store.conn.execute("UPDATE feeds SET refreshed = '2000-01-01T00:00:00'")
+    assert store.last_seen(*feed) is False
+    store.close()
+
+def test_ledger_drops_products_purged_from_grq(tmp_path, run_evaluation):
+    config = corpus.CorpusConfig(aois=1, tracks=1, orbit_pairs=1, frames=3, completeness=1.0, duplicates=0, merged=0, greylisted=0)
+    docs = list(corpus.generate(config))
+    gunws = [doc for doc in docs if doc['_type'] == 'S1-GUNW']
+    ctx = dict(benchmark.build_context(gunws[1], 'gunw'), completeness_ledger=True, ledger_cache_dir=str(tmp_path / 'ledger'))
+    # run 1 sees only frame 0, which is then purged as frames 1 & 2 arrive
+    first = [doc for doc in docs if doc not in gunws[1:]]
+    second = [doc for doc in docs if doc is not gunws[0]]
+    assert run_evaluation(first, ctx, tmp_path / 'first') == []
+    assert run_evaluation(second, ctx, tmp_path / 'second') == []
+    store = ledger.CompletenessLedger(str(tmp_path / 'ledger'))
+    feed = ('S1-GUNW', gunws[1]['_source']['metadata']['track_number'], evaluate.stringify_orbit(ctx['orbit_number']), ctx['version'])
+    assert sorted(x.id for x in store.products(*feed)) == sorted(doc['_id'] for doc in gunws[1:])
+    store.close()
+
+def test_ledger_is_opt_in(tmp_path, run_evaluation):
+    config = corpus.CorpusConfig(aois=1, tracks=1, orbit_pairs=1, frames=3, completeness=1.0, duplicates=0, merged=0, greylisted=0)
+    docs = list(corpus.generate(config))
+    gunw = [doc for doc in docs if doc['_type'] == 'S1-GUNW'][0]
+    # the submitter's boolean arrives as a string
+    ctx = dict(benchmark.build_context(gunw, 'gunw'), completeness_ledger='false', ledger_cache_dir=str(tmp_path / 'ledger'))
+    run_evaluation(docs, ctx, tmp_path / 'run')
+    assert not (tmp_path / 'ledger').exists()
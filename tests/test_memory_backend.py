@@ -0,0 +1,55 @@
+import corpus
+import memory_backend
+
+def test_raw_fields_match_exactly(backend):
+    backend.index('idx', 't', 'a', {'metadata': {'aoi': 'AOI_x'}})
+    backend.index('idx', 't', 'b', {'metadata': {'aoi': 'AOI_x_2'}})
+    raw = backend.search('idx', {'query': {'match_phrase': {'metadata.aoi.raw': 'AOI_x'}}})
+    analyzed = backend.search('idx', {'query': {'match_phrase': {'metadata.aoi': 'AOI_x'}}})
+    assert [hit['_id'] for hit in raw] == ['a']
+    assert sorted(hit['_id'] for hit in analyzed) == ['a', 'b']
+
+def scan(backend, index, query):
+    '''the ids of the documents matching the query, checking every document'''
+    return [doc['_id'] for doc in backend.iter_docs(index) if memory_backend.matches(query, doc, backend)]
+
+def corpus_queries(docs):
+    '''queries of each kind the evaluator sends, over the first aoi & gunw of the corpus'''
+    aoi = [doc for doc in docs if doc['_type'] == 'area_of_interest'][0]['_source']
+    gunw = [doc for doc in docs if doc['_type'] == 'S1-GUNW'][0]['_source']
+    met = gunw['metadata']
+    return [
+        {'match_all': {}},
+        {'filtered': {'query': {'geo_shape': {'location': {'shape': aoi['location']}}},
+                      'filter': {'bool': {'must': [{'range': {'endtime': {'from': aoi['starttime']}}}]}}}},
+        {'bool': {'must': [{'match_phrase': {'metadata.track_number': met['track_number']}},
+                           {'term': {'metadata.orbit_number': met['orbit_number'][0]}}, {'term': {'version.raw': gunw['version']}}]}},
+        {'bool': {'must': [{'terms': {'metadata.full_id_hash.raw': [met['full_id_hash'], 'missing']}}]}},
+        {'bool': {'must': [{'match_phrase': {'metadata.aoi.raw': aoi['id']}}]}},
+        {'bool': {'must': [{'match_phrase': {'metadata.aoi': aoi['id']}}]}},
+        {'bool': {'must': [{'term': {'id.raw': gunw['id']}}], 'must_not': [{'ids': {'values': [gunw['id']]}}]}},
+        {'bool': {'should': [{'ids': {'values': [gunw['id']]}}, {'term': {'id.raw': aoi['id']}}]}},
+        {'bool': {'must': [{'range': {'creation_timestamp': {'gte': gunw['creation_timestamp']}}}]}},
+    ]
+
+def test_indexed_search_matches_a_full_scan(backend):
+    docs = list(corpus.generate(corpus.CorpusConfig(aois=3, tracks=2, orbit_pairs=3, greylisted=0.2, seed=5)))
+    backend.load(docs)
+    for index in ['*', 'grq_*_s1-gunw', 'grq_*_s1-gunw-acq-list,grq_*_area_of_interest']:
+        for query in corpus_queries(docs):
+            assert [hit['_id'] for hit in backend.search(index, {'query': query})] == scan(backend, index, query)
+
+def test_updates_keep_the_indexes_current(backend):
+    square = corpus.box(0, 0, 1, 1)
+    backend.index('idx', 't', 'a', {'location': corpus.box(0, 0, 1, 1), 'metadata': {'tags': ['old'], 'track_number': 10}})
+    near = {'geo_shape': {'location': {'shape': square}}}
+    assert [hit['_id'] for hit in backend.search('idx', {'query': near})] == ['a']
+    backend.update('idx', 't', 'a', {'metadata': {'tags': ['new']}})
+    assert backend.search('idx', {'query': {'term': {'metadata.tags': 'old'}}}) == []
+    assert [hit['_id'] for hit in backend.search('idx', {'query': {'term': {'metadata.tags': 'new'}}})] == ['a']
+    assert [hit['_id'] for hit in backend.search('idx', {'query': {'match_phrase': {'metadata.track_number': '10'}}})] == ['a']
+    backend.update('idx', 't', 'a', {'location': corpus.box(5, 5, 6, 6)})
+    assert backend.search('idx', {'query': near}) == []
+    backend.index('idx', 't', 'a', {'location': corpus.box(0, 0, 1, 1), 'metadata': {'tags': []}})
+    assert [hit['_id'] for hit in backend.search('idx', {'query': near})] == ['a']
+    assert backend.search('idx', {'query': {'term': {'metadata.tags': 'new'}}}) == []
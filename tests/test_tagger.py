@@ -0,0 +1,11 @@
+import tagger
+
+def test_tag_queue_retries_version_conflicts(backend):
+    backend.index('idx', 'S1-GUNW', 'g1', {'metadata': {'tags': []}})
+    queue = tagger.TagQueue()
+    queue.add('idx', 'g1', 'S1-GUNW', 'AOI_a', known_tags=[], version=1)
+    backend.update('idx', 'S1-GUNW', 'g1', {'metadata': {'tags': ['other']}}) # changed since it was read
+    assert queue.flush() == []
+    stored = backend.get_doc('idx', 'g1')
+    assert stored['_source']['metadata']['tags'] == ['other', 'AOI_a']
+    assert stored['_version'] == 3
@@ -0,0 +1,43 @@
+import util
+
+SQUARE_CW = [[0.0, 0.0], [0.0, 1.0], [1.0, 1.0], [1.0, 0.0], [0.0, 0.0]]
+HOLE_CW = [[0.25, 0.25], [0.25, 0.75], [0.75, 0.75], [0.75, 0.25], [0.25, 0.25]]
+
+def loop_area(coords):
+    '''the shoelace loop util.get_area replaced'''
+    total = 0.0
+    for i in range(len(coords)):
+        x1, y1 = coords[i][:2]
+        x2, y2 = coords[(i + 1) % len(coords)][:2]
+        total += y1 * x2 - y2 * x1
+    return total / 2
+
+def test_check_fix_removes_every_run_of_duplicates():
+    ring = [(0, 0), (0, 0), (1, 0), (1, 0), (1, 0), (1, 1), (1, 1), (0, 0)]
+    assert list(util.check_fix(ring)) == [(0, 0), (1, 0), (1, 1), (0, 0)]
+
+def test_check_fix_returns_clean_ring_unchanged():
+    assert util.check_fix(SQUARE_CW) is SQUARE_CW
+
+def test_ring_areas_match_the_loop():
+    rings = [SQUARE_CW, SQUARE_CW[::-1], HOLE_CW, [[0, 0], [2, 3], [5, 1], [4, -2], [0, 0]]]
+    areas = util.ring_areas(rings)
+    assert [round(x, 9) for x in areas] == [round(loop_area(ring), 9) for ring in rings]
+    assert util.get_area(SQUARE_CW) > 0 > util.get_area(SQUARE_CW[::-1])
+
+def test_change_coordinate_direction_makes_rings_clockwise():
+    assert util.change_coordinate_direction(SQUARE_CW[::-1]) == SQUARE_CW
+    assert util.change_coordinate_direction(SQUARE_CW) == SQUARE_CW
+
+def test_change_union_coordinate_direction_orients_multipolygons():
+    shifted = [[x + 2, y] for x, y in SQUARE_CW[::-1]]
+    geom = {'type': 'MultiPolygon', 'coordinates': [[SQUARE_CW[::-1], HOLE_CW], [shifted]]}
+    oriented = util.change_union_coordinate_direction(geom)
+    (exterior, hole), (second,) = oriented['coordinates']
+    assert util.get_area(exterior) > 0 and util.get_area(second) > 0
+    assert util.get_area(hole) < 0
+
+def test_validate_geojson_dedupes_multipolygon_rings():
+    ring = [SQUARE_CW[0]] + SQUARE_CW
+    geom = util.validate_geojson({'type': 'MultiPolygon', 'coordinates': [[ring]]})
+    assert [list(map(list, r)) for r in geom['coordinates'][0]] == [SQUARE_CW]
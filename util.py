@@ -1,82 +1,64 @@
+'''
+geojson helpers for cleaning & orienting polygon rings. The evaluator itself does not call
+them; they are kept as a public API for the scripts & PGEs that import util
+'''
 from __future__ import division
-from builtins import range
-from past.utils import old_div
 import os
+import json
+import numpy as np
 from shapely.geometry import shape, Polygon, MultiPolygon, mapping
-from shapely.ops import cascaded_union
 from shapely.validation import explain_validity
 import shapely.ops
 
 def validate_geojson(geom):
+    '''removes consecutive duplicate vertices from every ring of a (Multi)Polygon geojson'''
     A = {}
     A['type'] = geom['type']
-    A['coordinates']=validate_coord(geom['coordinates'])
+    if geom['type'] == 'MultiPolygon':
+        A['coordinates'] = tuple(validate_coord(polygon) for polygon in geom['coordinates'])
+    else:
+        A['coordinates'] = validate_coord(geom['coordinates'])
     return A
 
 def validate_coord(coord):
-    B=[]
-
-    print("validate_geojson : coord : {}".format(coord))
-    for C in  coord:
-        print("validate_geojson : C : {}".format(C))
-        if C is not None:
-            C_updated = check_fix(C)
-            print("new_length : {}".format(len(C_updated)))
-            B.append(C_updated)
-    return tuple(B)
+    '''removes consecutive duplicate vertices from each ring in the list of rings'''
+    return tuple(check_fix(C) for C in coord if C is not None)
 
 def check_fix(C):
-    n = len(C)
-    print("orig_length :{}".format(n))
-    i=1
-    while(i<n):
-
-        if C[i]==C[i-1]:
-            print("List updated as two same consecutive points : {}".format(C[i]))
-            return fix_tuple(C, i)
-        i = i+1
-    print("List unchanged")
-    return C
-
-
-def fix_tuple(A, i):
-    B = list(A)
-    del(B[i])
-    return tuple(B)
+    '''removes all runs of consecutive duplicate vertices. returns the ring unchanged if there are none'''
+    if len(C) < 2:
+        return C
+    points = np.asarray(C, dtype=float)
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    if keep.all():
+        return C
+    return tuple(C[i] for i in np.flatnonzero(keep))
 
 def get_area(coords):
     '''get area of enclosed coordinates- determines clockwise or counterclockwise order'''
-    print("get_area : coords : %s" %coords)
-    n = len(coords) # of corners
-    area = 0.0
-    for i in range(n):
-        j = (i + 1) % n
-        #print("i : %s j: %s, coords[i][1] : %s coords[j][0] : %s coords[j][1] : %s coords[i][0] : %s"  %(i, j, coords[i][1], coords[j][0], coords[j][1], coords[i][0]))
-        area += coords[i][1] * coords[j][0]
-        area -= coords[j][1] * coords[i][0]
-    #area = abs(area) / 2.0
-    return old_div(area, 2)
+    return float(ring_areas([coords])[0])
+
+def ring_areas(rings):
+    '''
+    signed areas of all the rings in one array operation. Uses the same sign as get_area:
+    positive for clockwise rings, negative for counterclockwise
+    '''
+    lengths = np.array([len(ring) for ring in rings])
+    if not lengths.all():
+        raise Exception('unable to compute the area of an empty ring')
+    points = np.concatenate([np.asarray(ring, dtype=float)[:, :2] for ring in rings])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts # each ring wraps around to its first vertex
+    terms = points[:, 1] * points[following, 0] - points[following, 1] * points[:, 0]
+    return np.add.reduceat(terms, starts) / 2
 
 def change_coordinate_direction(cord):
-    print("change_coordinate_direction 1 cord: {}\n".format(cord))
-    cord_area = get_area(cord)
-    if not cord_area>0:
-        print("change_coordinate_direction : coordinates are not clockwise, reversing it")
-        cord = [cord[::-1]]
-        print("change_coordinate_direction 2 : cord : {}".format(cord))
-        try:
-            cord_area = get_area(cord)
-        except:
-            cord = cord[0]
-            print("change_coordinate_direction 3 : cord : {}".format(cord))
-            cord_area = get_area(cord)
-        if not cord_area>0:
-            print("change_coordinate_direction. coordinates are STILL NOT  clockwise")
-    else:
-        print("change_coordinate_direction: coordinates are already clockwise")
-
-    print("change_coordinate_direction 4 : cord : {}".format(cord))
-    return cord
+    '''returns the ring with its vertices in clockwise order'''
+    if get_area(cord) > 0:
+        return cord
+    return cord[::-1]
 
 def validate_geojson2(geojson):
     '''validates the geojson and converts it into a shapely object. can accept strings, shapefiles & geojson dicts'''
@@ -94,28 +76,29 @@ def validate_geojson2(geojson):
         if shp.is_valid:
             return shp
         else:
-            print(type(geojson))
-            raise Exception('input geojson is not valid: {}'.format(explain_validity(shp)))
-
+            raise Exception('input geojson ({}) is not valid: {}'.format(type(geojson), explain_validity(shp)))
 
 def change_union_coordinate_direction(union_geom):
-    print("change_coordinate_direction")
-    coordinates = union_geom["coordinates"]
-    print("Type of union polygon : {} of len {}".format((type(coordinates), len(coordinates))))
-    for i in range(len(coordinates)):
-        cord = coordinates[i]
-        cord_area = get_area(cord)
-        if not cord_area>0:
-            print("change_coordinate_direction : coordinates are not clockwise, reversing it")
-            cord = [cord[::-1]]
-            print(cord)
-            cord_area = get_area(cord)
-            if not cord_area>0:
-                print("change_coordinate_direction. coordinates are STILL NOT  clockwise")
-            union_geom["coordinates"][i] = cord
-        else:
-            print("change_coordinate_direction: coordinates are already clockwise")
-
+    '''
+    orients every polygon of a (Multi)Polygon geojson: exterior rings clockwise & holes
+    counterclockwise. The signed areas of all rings are computed together
+    '''
+    if union_geom['type'] == 'MultiPolygon':
+        polygons = union_geom['coordinates']
+    else:
+        polygons = [union_geom['coordinates']]
+    rings = [ring for polygon in polygons for ring in polygon]
+    if not rings:
+        return union_geom
+    clockwise = ring_areas(rings) > 0
+    oriented = []
+    i = 0
+    for polygon in polygons:
+        fixed = []
+        for j, ring in enumerate(polygon):
+            # exterior (j == 0) must be clockwise, holes counterclockwise
+            fixed.append(ring if clockwise[i] == (j == 0) else ring[::-1])
+            i += 1
+        oriented.append(fixed)
+    union_geom['coordinates'] = oriented if union_geom['type'] == 'MultiPolygon' else oriented[0]
     return union_geom
-
-